@@ -0,0 +1,277 @@
+# analytics.py
+
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy.linalg import solve_triangular
+except ImportError:
+    solve_triangular = None
+
+REGRESSION_CHUNK_ROWS = 1_000_000
+# R 因子对角元相对最大值低于该比例时视为共线
+COLLINEARITY_RTOL = 1e-8
+
+
+def _chunk_matrix(df, columns, start, stop):
+    # 每次只复制一个分块为 float64，避免生成完整的设计矩阵
+    return df[columns].iloc[start:stop].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def linear_regression(df, target_column, feature_columns, weight_column=None, ridge_alpha=0.0, chunk_rows=REGRESSION_CHUNK_ROWS):
+    """分块 QR（TSQR）求解加权、可带岭惩罚的最小二乘。
+
+    对增广矩阵 [1, X, y] 逐块做 QR 分解并合并 R 因子，内存占用只与分块大小和特征数有关。
+    含缺失值的行会被跳过；共线性时返回最小范数解并列出相关列。
+    """
+    start_time = time.perf_counter()
+    p = len(feature_columns) + 1  # 含截距
+    columns = list(feature_columns) + [target_column] + ([weight_column] if weight_column else [])
+    r_factor = np.zeros((0, p + 1))
+    n_used, sum_w, sum_wy, sum_wy2 = 0, 0.0, 0.0, 0.0
+
+    for start in range(0, len(df), chunk_rows):
+        block = _chunk_matrix(df, columns, start, start + chunk_rows)
+        valid = np.isfinite(block).all(axis=1)
+        if weight_column:
+            weights = block[:, -1]
+            if (weights[valid] < 0).any():
+                raise ValueError(f"权重列 '{weight_column}' 含有负值")
+            block = block[:, :-1]
+        else:
+            weights = np.ones(len(block))
+        if not valid.all():
+            block, weights = block[valid], weights[valid]
+        if len(block) == 0:
+            continue
+        y = block[:, -1]
+        n_used += len(block)
+        sum_w += weights.sum()
+        sum_wy += weights @ y
+        sum_wy2 += weights @ (y * y)
+        sqrt_w = np.sqrt(weights)[:, None]
+        augmented = np.hstack([sqrt_w, block * sqrt_w])
+        r_factor = np.linalg.qr(np.vstack([r_factor, augmented]), mode='r')
+
+    if n_used <= p:
+        raise ValueError(f"有效样本数（{n_used}）不足以估计 {p} 个参数")
+
+    r_xx, r_xy = r_factor[:p, :p], r_factor[:p, p]
+    # 未加惩罚时 r_yy^2 即残差平方和
+    r_yy = r_factor[p, p] if r_factor.shape[0] > p else 0.0
+    penalty = np.zeros(p)
+    if ridge_alpha:
+        penalty[1:] = ridge_alpha  # 不惩罚截距
+        # 追加 sqrt(alpha)·I 行后重新分解，等价于求解 (X'WX + alpha·I) b = X'Wy
+        ridge_rows = np.hstack([np.diag(np.sqrt(penalty)), np.zeros((p, 1))])
+        penalized = np.linalg.qr(np.vstack([r_factor[:p + 1], ridge_rows]), mode='r')
+        solve_r, solve_rhs = penalized[:p, :p], penalized[:p, p]
+    else:
+        solve_r, solve_rhs = r_xx, r_xy
+
+    diag = np.abs(np.diag(solve_r))
+    rank_deficient = diag <= diag.max() * COLLINEARITY_RTOL
+    if rank_deficient.any():
+        coeffs = np.linalg.lstsq(solve_r, solve_rhs, rcond=COLLINEARITY_RTOL)[0]
+    else:
+        coeffs = solve_triangular(solve_r, solve_rhs) if solve_triangular else np.linalg.solve(solve_r, solve_rhs)
+    rank = int((~rank_deficient).sum())
+
+    residual = r_xx @ coeffs - r_xy
+    rss = float(residual @ residual + r_yy ** 2)
+    tss = float(sum_wy2 - sum_wy ** 2 / sum_w) if sum_w else 0.0
+    dof = n_used - rank
+    sigma2 = rss / dof if dof > 0 else np.nan
+
+    xtx = r_xx.T @ r_xx
+    standard_errors = np.full(p, np.nan)
+    if not rank_deficient.any():
+        inverse = np.linalg.inv(xtx + np.diag(penalty))
+        covariance = sigma2 * (inverse @ xtx @ inverse if ridge_alpha else inverse)
+        standard_errors = np.sqrt(np.clip(np.diag(covariance), 0, None))
+
+    names = ["intercept"] + list(feature_columns)
+    r_squared = 1 - rss / tss if tss > 0 else None
+    adj_r_squared = 1 - (1 - r_squared) * (n_used - 1) / dof if r_squared is not None and dof > 0 else None
+    return {
+        "intercept": float(coeffs[0]),
+        "coefficients": {name: float(c) for name, c in zip(feature_columns, coeffs[1:])},
+        "standard_errors": {name: _json_float(se) for name, se in zip(names, standard_errors)},
+        "r_squared": _json_float(r_squared),
+        "adj_r_squared": _json_float(adj_r_squared),
+        "n_observations": n_used,
+        "dropped_rows": len(df) - n_used,
+        "ridge_alpha": ridge_alpha,
+        "collinear_columns": [name for name, flag in zip(names, rank_deficient) if flag],
+        "runtime_seconds": round(time.perf_counter() - start_time, 4),
+    }
+
+
+def _json_float(value):
+    if value is None or not np.isfinite(value):
+        return None
+    return float(value)
+
+
+CORRELATION_CHUNK_ELEMENTS = 8_000_000
+
+
+def correlation_matrix(df, method="pearson", sample_rows=None, random_state=0):
+    """分块计算数值列之间的成对相关系数，返回 (相关系数矩阵, 每对的有效样本数, 使用的行数)。
+
+    按行分块累加 X'X 等矩阵乘积，任何时刻只转换一个行块为 float64；
+    缺失值按成对删除处理（与 DataFrame.corr 一致）。method='spearman' 时先对各列求秩。
+    sample_rows 指定时对超出该行数的数据随机抽样。
+    """
+    numeric = df.select_dtypes(include=[np.number, 'bool'])
+    if sample_rows and len(numeric) > sample_rows:
+        rng = np.random.default_rng(random_state)
+        positions = np.sort(rng.choice(len(numeric), size=int(sample_rows), replace=False))
+        numeric = numeric.iloc[positions]
+    if method == "spearman":
+        numeric = numeric.rank(method="average")
+    columns = list(numeric.columns)
+    p = len(columns)
+    # 先按列均值中心化，减小平方和相减带来的舍入误差
+    means = numeric.mean().to_numpy(dtype=np.float64)
+    chunk_rows = max(1, CORRELATION_CHUNK_ELEMENTS // max(p, 1))
+
+    pair_counts = np.zeros((p, p))
+    sums = np.zeros((p, p))      # sums[i, j]: 列 i 在 i、j 均非空的行上的和
+    squares = np.zeros((p, p))   # squares[i, j]: 列 i 在 i、j 均非空的行上的平方和
+    products = np.zeros((p, p))
+    for start in range(0, len(numeric), chunk_rows):
+        block = numeric.iloc[start:start + chunk_rows].to_numpy(dtype=np.float64, na_value=np.nan) - means
+        present = ~np.isnan(block)
+        if present.all():
+            mask = None
+        else:
+            mask = present.astype(np.float64)
+            block = np.where(present, block, 0.0)
+        products += block.T @ block
+        if mask is None:
+            rows = len(block)
+            pair_counts += rows
+            sums += block.sum(axis=0)[:, None]
+            squares += (block * block).sum(axis=0)[:, None]
+        else:
+            pair_counts += mask.T @ mask
+            sums += block.T @ mask
+            squares += (block * block).T @ mask
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        covariance = products - sums * sums.T / pair_counts
+        variance_i = squares - sums * sums / pair_counts
+        variance_j = variance_i.T
+        corr = covariance / np.sqrt(variance_i * variance_j)
+    corr = np.clip(corr, -1.0, 1.0)
+    corr[pair_counts < 2] = np.nan
+    np.fill_diagonal(corr, np.where(np.diag(pair_counts) >= 2, 1.0, np.nan))
+    return (
+        pd.DataFrame(corr, index=columns, columns=columns),
+        pd.DataFrame(pair_counts.astype(np.int64), index=columns, columns=columns),
+        len(numeric),
+    )
+
+
+def top_correlated_pairs(corr, counts, k):
+    """按相关系数绝对值从大到小返回前 k 对 (列1, 列2, 相关系数, 样本数)。"""
+    values = corr.to_numpy()
+    upper_i, upper_j = np.triu_indices(len(values), k=1)
+    pair_values = values[upper_i, upper_j]
+    valid = ~np.isnan(pair_values)
+    upper_i, upper_j, pair_values = upper_i[valid], upper_j[valid], pair_values[valid]
+    if len(pair_values) > k:
+        top = np.argpartition(-np.abs(pair_values), k - 1)[:k]
+    else:
+        top = np.arange(len(pair_values))
+    top = top[np.argsort(-np.abs(pair_values[top]))]
+    names, count_values = corr.columns, counts.to_numpy()
+    return [
+        (names[upper_i[t]], names[upper_j[t]], float(pair_values[t]), int(count_values[upper_i[t], upper_j[t]]))
+        for t in top
+    ]
+
+
+IMPUTE_STRATEGIES = ("mean", "median", "mode", "drop")
+
+
+def _mode_value(series):
+    counts = series.value_counts(dropna=True, sort=False)
+    return counts.idxmax() if len(counts) else None
+
+
+def impute_missing(df, default_strategy=None, strategies=None):
+    """按列处理缺失值，返回 (新 DataFrame, 每列处理报告, 删除的行数)。
+
+    strategies 为 {列名: 策略}，策略为 mean/median/mode/drop 或 {"value": 常量}；
+    未指定的列使用 default_strategy。所有填充值通过一次聚合计算，并只对含缺失值的列生效；
+    返回的 DataFrame 与原数据共享未修改的列（写时复制），不会整体复制。
+    """
+    strategies = dict(strategies or {})
+    null_counts = df.isna().sum()
+    null_counts = null_counts[null_counts > 0]
+    plan = {}
+    report = {}
+    for col, count in null_counts.items():
+        strategy = strategies.get(col, default_strategy)
+        if strategy is None:
+            continue
+        plan[col] = strategy
+        report[col] = {"missing": int(count), "strategy": strategy if isinstance(strategy, str) else "value", "filled": 0}
+    for col, strategy in strategies.items():
+        if col not in df.columns:
+            report[col] = {"missing": 0, "strategy": str(strategy), "filled": 0, "note": "列不存在"}
+        elif col not in report:
+            # 指定了策略但没有缺失值的列也写入报告，避免被误认为已处理
+            report[col] = {"missing": 0, "strategy": strategy if isinstance(strategy, str) else "value", "filled": 0}
+
+    numeric_cols = [c for c, s in plan.items() if s in ("mean", "median") and pd.api.types.is_numeric_dtype(df[c])]
+    for col, strategy in plan.items():
+        if strategy in ("mean", "median") and col not in numeric_cols:
+            report[col]["note"] = "非数值列，未处理"
+    mean_cols = [c for c in numeric_cols if plan[c] == "mean"]
+    median_cols = [c for c in numeric_cols if plan[c] == "median"]
+    fill_values = {}
+    if mean_cols:
+        fill_values.update(df[mean_cols].mean().to_dict())
+    if median_cols:
+        fill_values.update(df[median_cols].median().to_dict())
+    for col, strategy in plan.items():
+        if strategy == "mode":
+            fill_values[col] = _mode_value(df[col])
+        elif isinstance(strategy, dict) and "value" in strategy:
+            fill_values[col] = strategy["value"]
+        elif not isinstance(strategy, (str, dict)):
+            fill_values[col] = strategy  # 直接给出的常量
+        elif strategy not in IMPUTE_STRATEGIES:
+            report[col]["note"] = f"未知策略 {strategy}"
+
+    for col in list(fill_values):
+        value = fill_values[col]
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            report[col]["note"] = "整列为空，无法计算填充值"
+            del fill_values[col]
+            continue
+        if pd.api.types.is_integer_dtype(df[col].dtype) and isinstance(value, float):
+            # 可空整数列不能填入小数
+            fill_values[col] = round(value)
+
+    result = df.fillna(value=fill_values) if fill_values else df
+    for col in fill_values:
+        # 按实际减少的缺失值计数，而不是假定全部填充成功
+        report[col]["filled"] = report[col]["missing"] - int(result[col].isna().sum())
+        report[col]["value"] = fill_values[col]
+
+    drop_cols = [c for c, s in plan.items() if s == "drop"]
+    dropped_rows = 0
+    if drop_cols:
+        for col in drop_cols:
+            # 该列为空的行都会被删除（与其他列为空的行可能重叠）
+            report[col]["dropped"] = int(result[col].isna().sum())
+        before = len(result)
+        result = result.dropna(subset=drop_cols)
+        dropped_rows = before - len(result)
+    return result, report, dropped_rows
@@ -7,10 +7,24 @@ import json
 import datetime
 import re
 import shutil 
+import threading
+import atexit
+import multiprocessing
 from flask import Flask, render_template, request, stream_with_context, Response, send_from_directory, jsonify
-from openai import OpenAI, AuthenticationError, APIConnectionError
+from openai import AuthenticationError, APIConnectionError
 from talk_to_data_core import TalkToDataCore
+import llm_clients
 from evaluator import Evaluator
+from dataset_cache import DatasetCache
+from ingest import save_upload
+from session_manager import SessionManager, SESSION_ID_PATTERN
+from evaluation_jobs import EvaluationJobs
+from sandbox import SandboxPool
+from shared_frames import SharedFrameStore, default_shared_root
+import results_store
+import plotting
+import metrics
+from werkzeug.utils import safe_join
 
 app = Flask(__name__)
 
@@ -22,33 +36,71 @@ else:
     SESSIONS_FOLDER = os.path.join(BASE_DIR, 'sessions')
 os.makedirs(SESSIONS_FOLDER, exist_ok=True)
 
-
-class SessionManager:
-    def __init__(self):
-        self.sessions = {}
-
-    def create_session(self):
-        session_id = f"talk-to-data-{uuid.uuid4()}"
-        session_path = os.path.join(SESSIONS_FOLDER, session_id)
-        plot_path = os.path.join(session_path, 'plots')
-        upload_path = os.path.join(session_path, 'uploads')
-        os.makedirs(plot_path, exist_ok=True)
-        os.makedirs(upload_path, exist_ok=True)
-
-        self.sessions[session_id] = {
-            "id": session_id,
-            "session_path": session_path,
-            "plot_path": plot_path,
-            "upload_path": upload_path,
-            "state": { "dataframes": {}, "plots": [] },
-            "llm_history": []
-        }
-        return self.sessions[session_id]
-
-    def get_session(self, session_id):
-        return self.sessions.get(session_id)
-
-session_manager = SessionManager()
+DATASET_CACHE_MAX_MB = int(os.environ.get('TTD_DATASET_CACHE_MAX_MB', 2048))
+dataset_cache = DatasetCache(
+    os.path.join(SESSIONS_FOLDER, '.dataset_cache'),
+    max_bytes=DATASET_CACHE_MAX_MB * 1024 * 1024
+)
+
+
+SESSION_MEMORY_BUDGET_MB = int(os.environ.get('TTD_SESSION_MEMORY_MB', 4096))
+SESSION_IDLE_TTL_SECONDS = int(os.environ.get('TTD_SESSION_IDLE_TTL', 1800))
+session_manager = SessionManager(
+    SESSIONS_FOLDER,
+    memory_budget_bytes=SESSION_MEMORY_BUDGET_MB * 1024 * 1024,
+    idle_ttl_seconds=SESSION_IDLE_TTL_SECONDS
+)
+session_manager.start_reaper()
+
+EVALUATION_WORKERS = int(os.environ.get('TTD_EVALUATION_WORKERS', 4))
+# 流结束前最多等待评估结果的时间；超时后由前端通过 /evaluation/<session_id> 查询
+EVALUATION_INLINE_WAIT_SECONDS = float(os.environ.get('TTD_EVALUATION_INLINE_WAIT', 0))
+evaluation_jobs = EvaluationJobs(max_workers=EVALUATION_WORKERS)
+
+SANDBOX_WORKERS = int(os.environ.get('TTD_SANDBOX_WORKERS', min(4, os.cpu_count() or 1)))
+SANDBOX_CPU_SECONDS = int(os.environ.get('TTD_SANDBOX_CPU_SECONDS', 120))
+SANDBOX_MEMORY_MB = int(os.environ.get('TTD_SANDBOX_MEMORY_MB', 4096))
+SANDBOX_TIMEOUT_SECONDS = int(os.environ.get('TTD_SANDBOX_TIMEOUT', 300))
+# /dev/shm 剩余空间低于该值时改用磁盘目录
+SHARED_FRAMES_SHM_MIN_FREE_MB = int(os.environ.get('TTD_SHM_MIN_FREE_MB', 512))
+# 主进程与执行进程交换 DataFrame 的共享内存目录；设为空字符串则通过管道传输
+SHARED_FRAMES_DIR = os.environ.get('TTD_SHARED_FRAMES_DIR', default_shared_root(
+    os.path.join(SESSIONS_FOLDER, '.shared'), SHARED_FRAMES_SHM_MIN_FREE_MB * 1024 * 1024))
+_sandbox_pool = None
+_sandbox_lock = threading.Lock()
+
+
+def get_sandbox_pool():
+    """延迟创建代码执行进程池（spawn 子进程会重新导入本模块，不能在导入时创建）。"""
+    global _sandbox_pool
+    if SANDBOX_WORKERS <= 0:
+        return None
+    with _sandbox_lock:
+        if _sandbox_pool is None:
+            try:
+                frame_store = None
+                if SHARED_FRAMES_DIR:
+                    frame_store = SharedFrameStore(SHARED_FRAMES_DIR)
+                    atexit.register(frame_store.close)
+                _sandbox_pool = SandboxPool(
+                    num_workers=SANDBOX_WORKERS,
+                    cpu_seconds=SANDBOX_CPU_SECONDS,
+                    memory_bytes=SANDBOX_MEMORY_MB * 1024 * 1024,
+                    timeout_seconds=SANDBOX_TIMEOUT_SECONDS,
+                    frame_store=frame_store
+                )
+                session_manager.add_evict_listener(_sandbox_pool.drop_session)
+            except Exception:
+                # 无法启动子进程时退回到进程内执行
+                import traceback
+                traceback.print_exc()
+                return None
+        return _sandbox_pool
+
+
+def get_code_executor(session_id):
+    pool = get_sandbox_pool()
+    return pool.session(session_id) if pool is not None else None
 
 
 @app.route('/')
@@ -63,7 +115,7 @@ def test_connection():
     if not api_key or not base_url:
         return jsonify({"success": False, "message": "API Key 和地址不能为空"}), 400
     try:
-        client = OpenAI(api_key=api_key, base_url=base_url, timeout=10.0)
+        client = llm_clients.get_client(api_key, base_url).with_options(timeout=10.0)
         client.models.list()
         return jsonify({"success": True, "message": "连接成功！设置有效。"})
     except AuthenticationError:
@@ -86,33 +138,35 @@ def start_session():
         return jsonify({"error": "必须提供至少一个文件"}), 400
 
     session = session_manager.create_session()
-    
-    saved_files_paths = []
-    for file in files:
-        if file and file.filename:
-            filepath = os.path.join(session['upload_path'], file.filename)
-            file.save(filepath)
-            saved_files_paths.append(filepath)
-
-    agent_core = TalkToDataCore(
-        api_key=api_key, base_url=base_url, model_name=model_name,
-        plot_save_dir=session['plot_path'],
-        session_state=session['state']
-    )
+    with session_manager.pinned(session):
+        saved_files_paths = []
+        content_hashes = {}
+        for file in files:
+            if file and file.filename:
+                filepath = os.path.join(session['upload_path'], file.filename)
+                content_hashes[filepath] = save_upload(file, filepath)
+                saved_files_paths.append(filepath)
 
-    load_messages_html = []
-    files_to_process = [p for p in saved_files_paths if not p.lower().endswith(('.dbf', '.shx', '.prj', '.cpg', '.sbn', '.sbx'))]
-    for filepath in files_to_process:
-        message_html = agent_core.load_data_from_filepath(filepath)
-        load_messages_html.append(message_html)
-    
-    initial_observation_html = "\n".join(load_messages_html)
-    frontend_system_message = {'type': 'system', 'content': initial_observation_html}
-    
-    # LLM历史记录仍然使用纯文本，以保持简洁
-    df_info_for_llm = "\n".join([f"DataFrame '{name}' with columns {list(df.columns)}" for name, df in session['state']['dataframes'].items()])
-    session['llm_history'].append({"role": "user", "content": f"数据加载完成。摘要如下：\n{df_info_for_llm}"})
+        agent_core = TalkToDataCore(
+            api_key=api_key, base_url=base_url, model_name=model_name,
+            plot_save_dir=session['plot_path'],
+            session_state=session['state'],
+            dataset_cache=dataset_cache,
+            session_path=session['session_path']
+        )
+
+        load_messages_html = []
+        files_to_process = [p for p in saved_files_paths if not p.lower().endswith(('.dbf', '.shx', '.prj', '.cpg', '.sbn', '.sbx'))]
+        for filepath in files_to_process:
+            message_html = agent_core.load_data_from_filepath(filepath, content_hash=content_hashes.get(filepath))
+            load_messages_html.append(message_html)
+
+        initial_observation_html = "\n".join(load_messages_html)
+        frontend_system_message = {'type': 'system', 'content': initial_observation_html}
 
+        # LLM历史记录仍然使用纯文本，以保持简洁
+        df_info_for_llm = "\n".join([f"DataFrame '{name}' with columns {list(df.columns)}" for name, df in session['state']['dataframes'].items()])
+        session['llm_history'].append({"role": "user", "content": f"数据加载完成。摘要如下：\n{df_info_for_llm}"})
 
     return jsonify({
         "success": True,
@@ -127,7 +181,8 @@ def delete_session():
     if not session_id:
         return jsonify({"success": False, "message": "未提供 session_id"}), 400
 
-    session = session_manager.get_session(session_id)
+    session = session_manager.remove_session(session_id)
+    evaluation_jobs.discard(session_id)
     if not session:
         session_path_to_delete = os.path.join(SESSIONS_FOLDER, session_id)
         if os.path.isdir(session_path_to_delete):
@@ -138,52 +193,97 @@ def delete_session():
     try:
         if os.path.isdir(session_path):
             shutil.rmtree(session_path)
-        del session_manager.sessions[session_id]
         return jsonify({"success": True, "message": f"会话 {session_id} 已成功删除。"}), 200
 
     except Exception as e:
         return jsonify({"success": False, "message": f"删除会话时发生错误: {e}"}), 500
 
-@app.route('/continue_analysis', methods=['POST'])
-def continue_analysis():
-    data = request.json
-    session_id = data.get('session_id')
-    task = data.get('task')
-    api_key = data.get('api_key')
-    base_url = data.get('api_base_url')
-    model_name = data.get('model_name')
-    
-    if not all([session_id, task, api_key, base_url, model_name]):
-        return Response('{"error": "请求参数不完整"}', status=400, mimetype='application/json')
+class AnalysisRun:
+    """一次 /continue_analysis 请求的处理过程，同步（WSGI）和异步（ASGI）两种服务方式共用。"""
+
+    def __init__(self, session, task, agent_core, evaluator):
+        self.session = session
+        self.session_id = session['id']
+        self.task = task
+        self.agent_core = agent_core
+        self.evaluator = evaluator
+        self.history_for_report = []
+        self.evaluation_job = None
+        self.finished = False
+        self._closed = False
+
+    @classmethod
+    def open(cls, data):
+        """校验参数并固定会话；返回 (AnalysisRun, None) 或 (None, 错误响应参数)。"""
+        session_id = data.get('session_id')
+        task = data.get('task')
+        api_key = data.get('api_key')
+        base_url = data.get('api_base_url')
+        model_name = data.get('model_name')
         
-    session = session_manager.get_session(session_id)
-    if not session:
-        return Response('{"error": "无效的 session_id"}', status=404, mimetype='application/json')
-
-    try:
-        agent_core = TalkToDataCore(
-            api_key=api_key, base_url=base_url, model_name=model_name,
-            plot_save_dir=session['plot_path'],
-            session_state=session['state']
-        )
-        evaluator = Evaluator(
-            api_key=api_key, base_url=base_url, model_name=model_name
-        )
-    except Exception as e:
-         return Response(f'{{"error": "初始化核心组件失败: {e}"}}', status=500, mimetype='application/json')
-    
-    def generate_stream():
-        history_for_report = []
-        for step in agent_core.run(task, session['llm_history']):
-            history_for_report.append(step)
-            
-            if step.get('type') == 'observation' and '图表已生成并保存于:' in str(step.get('content', '')):
-                server_path = step['content'].split(":", 1)[1].strip()
-                web_path = os.path.join('sessions', session_id, 'plots', os.path.basename(server_path)).replace('\\', '/')
-                step['content'] = f"图表已生成并保存于: {web_path}"
+        if not all([session_id, task, api_key, base_url, model_name]):
+            return None, ('{"error": "请求参数不完整"}', 400)
             
-            yield f"data: {json.dumps(step)}\n\n"
-
+        # 分析进行期间固定会话，防止其被换出到磁盘
+        session = session_manager.get_session(session_id, acquire=True)
+        if not session:
+            return None, ('{"error": "无效的 session_id"}', 404)
+
+        try:
+            agent_core = TalkToDataCore(
+                api_key=api_key, base_url=base_url, model_name=model_name,
+                plot_save_dir=session['plot_path'],
+                session_state=session['state'],
+                executor=get_code_executor(session_id),
+                session_path=session['session_path']
+            )
+            evaluator = Evaluator(
+                api_key=api_key, base_url=base_url, model_name=model_name
+            )
+        except Exception as e:
+            session_manager.release(session)
+            return None, (f'{{"error": "初始化核心组件失败: {e}"}}', 500)
+        return cls(session, task, agent_core, evaluator), None
+
+    def format_step(self, step):
+        """把 agent 产生的事件转换为 SSE 消息。"""
+        if step.get('type') == 'thought_delta':
+            # 流式思考片段只用于实时展示，不计入报告历史
+            return f"data: {json.dumps(step)}\n\n"
+        self.history_for_report.append(step)
+        if step.get('type') == 'final_summary':
+            # 任务一结束就开始评估，与剩余的流输出并行
+            self.start_evaluation()
+        
+        if step.get('type') == 'observation' and '图表已生成并保存于:' in str(step.get('content', '')):
+            notes, server_path = step['content'].split('图表已生成并保存于:', 1)
+            web_path = os.path.join('sessions', self.session_id, 'plots', os.path.basename(server_path.strip())).replace('\\', '/')
+            step['content'] = f"{notes}图表已生成并保存于: {web_path}"
+        
+        return f"data: {json.dumps(step)}\n\n"
+
+    def start_evaluation(self):
+        """在后台提交评估任务；重复调用不会重复提交。"""
+        if self.evaluation_job is not None:
+            return self.evaluation_job
+        # 评估在后台线程中进行，会话可能已被换出，这里先取快照
+        history_for_report = list(self.history_for_report)
+        plots = list(self.session['state']['plots'])
+        self.evaluation_job = evaluation_jobs.submit(
+            self.session_id, lambda: self._evaluate(history_for_report, plots)
+        )
+        return self.evaluation_job
+
+    def evaluation_message(self):
+        """流结束时发送的评估消息：评估已完成则直接附带结果，否则告知前端稍后查询。"""
+        job = self.start_evaluation()
+        if evaluation_jobs.wait(job, EVALUATION_INLINE_WAIT_SECONDS) and job["status"] == "done":
+            return f"data: {json.dumps({'type': 'evaluation', 'content': job['evaluation']})}\n\n"
+        pending = {'type': 'evaluation_pending', 'content': {'session_id': self.session_id, 'job_id': job['job_id']}}
+        return f"data: {json.dumps(pending)}\n\n"
+
+    def _evaluate(self, history_for_report, plots):
+        """对完成的分析进行评估并生成雷达图（阻塞调用，在后台线程中执行）。"""
         final_summary = "任务未正常结束。"
         for item in reversed(history_for_report):
             if item.get('type') == 'final_summary':
@@ -191,48 +291,145 @@ def continue_analysis():
                 break
         
         web_plots = [
-            os.path.join('sessions', session_id, 'plots', os.path.basename(p)).replace('\\', '/')
-            for p in session['state']['plots']
+            os.path.join('sessions', self.session_id, 'plots', os.path.basename(p)).replace('\\', '/')
+            for p in plots
         ]
 
-        evaluation = evaluator.evaluate_completion(
-            task=task, final_summary=final_summary,
+        evaluation = self.evaluator.evaluate_completion(
+            task=self.task, final_summary=final_summary,
             history=history_for_report, generated_plots=web_plots
         )
         
         # 1. 计算效率统计数据
         thought_count = sum(1 for item in history_for_report if item.get('type') == 'thought')
         action_count = sum(1 for item in history_for_report if item.get('type') == 'action')
-        error_count = sum(1 for item in history_for_report if '错误' in str(item.get('content','')).lower() and item.get('type') == 'observation')
+        # 错误数、耗时和 token 用量来自事件上附带的 span
+        spans = [span for item in history_for_report for span in item.get('spans', [])]
+        llm_spans = [span for span in spans if span['kind'] == 'llm']
+        error_count = sum(1 for span in spans if span.get('error'))
         
         evaluation['efficiency_details'] = {
             'thoughts': thought_count,
             'actions': action_count,
-            'errors': error_count
+            'errors': error_count,
+            'llm_calls': len(llm_spans),
+            'llm_seconds': round(sum(span['seconds'] for span in llm_spans), 3),
+            'tool_seconds': round(sum(span['seconds'] for span in spans if span['kind'] == 'tool'), 3),
+            'prompt_tokens': sum(span.get('prompt_tokens') or 0 for span in llm_spans),
+            'completion_tokens': sum(span.get('completion_tokens') or 0 for span in llm_spans),
         }
 
         # 2. 调用新的雷达图生成函数
-        eval_chart_save_path = os.path.join(session['plot_path'], f"eval_radar_{uuid.uuid4()}.png")
+        eval_chart_save_path = os.path.join(self.session['plot_path'], f"eval_radar_{uuid.uuid4()}.png")
         if 'details' in evaluation:
-             evaluator.generate_evaluation_radar_chart(details=evaluation['details'], save_path=eval_chart_save_path)
+             self.evaluator.generate_evaluation_radar_chart(details=evaluation['details'], save_path=eval_chart_save_path)
         
         # 3. 将图表路径添加到评估结果中
         if os.path.exists(eval_chart_save_path):
-            eval_chart_web_path = os.path.join('sessions', session_id, 'plots', os.path.basename(eval_chart_save_path)).replace('\\', '/')
+            eval_chart_web_path = os.path.join('sessions', self.session_id, 'plots', os.path.basename(eval_chart_save_path)).replace('\\', '/')
             evaluation['chart_path'] = eval_chart_web_path
         else:
             evaluation['chart_path'] = None
-        
-        eval_message = {'type': 'evaluation', 'content': evaluation}
-        yield f"data: {json.dumps(eval_message)}\n\n"
+        return evaluation
 
-    return Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
+    def close(self):
+        """结束请求：若分析未完成（客户端断开），中止正在执行的代码；释放会话。"""
+        if self._closed:
+            return
+        self._closed = True
+        if not self.finished:
+            self.agent_core.cancel()
+        session_manager.release(self.session)
+
+
+def _client_disconnected(environ):
+    # waitress 在启用 channel_request_lookahead 时提供该检测函数
+    check = environ.get('waitress.client_disconnected')
+    return check is not None and check()
+
+
+@app.route('/continue_analysis', methods=['POST'])
+def continue_analysis():
+    analysis, error = AnalysisRun.open(request.json)
+    if error:
+        body, status = error
+        return Response(body, status=status, mimetype='application/json')
+    environ = request.environ
+
+    def generate_stream():
+        steps = analysis.agent_core.run(analysis.task, analysis.session['llm_history'])
+        try:
+            for step in steps:
+                yield analysis.format_step(step)
+                if _client_disconnected(environ):
+                    # 客户端已断开，关闭模型流，不再继续消耗 token
+                    return
+            analysis.finished = True
+            yield analysis.evaluation_message()
+        finally:
+            steps.close()
+            analysis.close()
+
+    response = Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
+    response.call_on_close(analysis.close)
+    return response
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus 文本格式的运行指标（各阶段耗时直方图、错误数、token 用量、峰值内存）。"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/evaluation/<session_id>')
+def get_evaluation(session_id):
+    job = evaluation_jobs.get(session_id)
+    if job is None:
+        return jsonify({"status": "missing", "error": "该会话没有评估任务"}), 404
+    return jsonify(job), 200 if job["status"] != "running" else 202
+
+
+@app.route('/results/<session_id>/<handle>')
+def get_result_page(session_id, handle):
+    """分页读取保存在服务端的完整工具结果（offset/limit 为行号范围，format=json|arrow）。"""
+    if not SESSION_ID_PATTERN.match(session_id):
+        return jsonify({"error": "无效的 session_id"}), 404
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return jsonify({"error": "offset 和 limit 必须是整数"}), 400
+    body, mimetype = results_store.read_page(
+        os.path.join(SESSIONS_FOLDER, session_id), handle, offset, limit, request.args.get('format', 'json')
+    )
+    if body is None:
+        return jsonify({"error": "结果不存在或已过期"}), 404
+    return Response(body, mimetype=mimetype)
 
 
 @app.route('/sessions/<session_id>/plots/<filename>')
 def serve_session_plot(session_id, filename):
     directory = os.path.join(SESSIONS_FOLDER, session_id, 'plots')
-    return send_from_directory(directory, filename)
+    # send_from_directory 会附带基于修改时间和大小的 ETag，并处理 If-None-Match
+    return send_from_directory(directory, filename, max_age=plotting.PLOT_CACHE_MAX_AGE)
+
+
+@app.route('/sessions/<session_id>/thumbs/<filename>')
+def serve_session_plot_thumbnail(session_id, filename):
+    """图表的 WebP 缩略图（首次请求时生成并缓存）；矢量图直接返回原图。"""
+    if not SESSION_ID_PATTERN.match(session_id):
+        return jsonify({"error": "无效的 session_id"}), 404
+    directory = os.path.join(SESSIONS_FOLDER, session_id, 'plots')
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        return jsonify({"error": "图表不存在"}), 404
+    try:
+        thumb_path = plotting.thumbnail(path)
+    except OSError:
+        thumb_path = None
+    if thumb_path is None:
+        return send_from_directory(directory, filename, max_age=plotting.PLOT_CACHE_MAX_AGE)
+    return send_from_directory(os.path.dirname(thumb_path), os.path.basename(thumb_path), max_age=plotting.PLOT_CACHE_MAX_AGE)
 
 @app.route('/export_markdown', methods=['POST'])
 def export_markdown():
@@ -295,7 +492,10 @@ def export_markdown():
                  md.append(f"```\n{content}\n```\n")
 
         elif msg_type_raw == 'observation':
-            if '图表已生成并保存于:' in str(content):
+            if '交互式图表已生成并保存于:' in str(content):
+                plot_filename = os.path.basename(content.split(':')[-1].strip())
+                md.append(f"*(交互式图表 {plot_filename}，请在应用内查看)*\n")
+            elif '图表已生成并保存于:' in str(content):
                 plot_path = content.split(':')[-1].strip()
                 plot_filename = os.path.basename(plot_path)
                 md.append(f"![生成的图表]({plot_filename})\n\n*(注意: 图片文件需与本报告放在同一目录下才能显示)*\n")
@@ -338,5 +538,39 @@ def export_markdown():
         headers={"Content-Disposition": f"attachment;filename={filename}"}
     )
 
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = int(os.environ.get('TTD_PORT', 5001))
+# waitress（多线程 WSGI，默认）、asgi（异步，需要 starlette 和 uvicorn）或 flask（开发服务器）
+SERVER_MODE = os.environ.get('TTD_SERVER', 'waitress')
+SERVER_THREADS = int(os.environ.get('TTD_SERVER_THREADS', 32))
+# waitress 默认拒绝超过 1 GB 的请求体，上传更大的数据文件时需要调大
+SERVER_MAX_UPLOAD_MB = int(os.environ.get('TTD_MAX_UPLOAD_MB', 1024))
+
+
+def serve_forever():
+    if SERVER_MODE == 'asgi':
+        try:
+            import asgi
+            asgi.serve(host=SERVER_HOST, port=SERVER_PORT)
+            return
+        except ImportError as e:
+            print(f"无法启动 ASGI 服务（{e}），改用 waitress。")
+    if SERVER_MODE != 'flask':
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+        if serve is not None:
+            # channel_request_lookahead 使 waitress 能检测到客户端断开
+            serve(
+                app, host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS, channel_request_lookahead=5,
+                max_request_body_size=SERVER_MAX_UPLOAD_MB * 1024 * 1024
+            )
+            return
+    app.run(host=SERVER_HOST, port=SERVER_PORT, debug=False, threaded=True)
+
+
 if __name__ == '__main__':
-    app.run(host='127.0.0.1', port=5001, debug=False)
\ No newline at end of file
+    multiprocessing.freeze_support()
+    get_sandbox_pool()
+    serve_forever()
\ No newline at end of file
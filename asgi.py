@@ -0,0 +1,65 @@
+# asgi.py
+#
+# 异步服务模式：/continue_analysis 由事件循环直接处理（异步模型客户端 + 非阻塞 SSE），
+# 其余路由仍由 Flask 应用通过 WSGI 适配层处理。
+# 需要额外安装: pip install -r requirements-asgi.txt（starlette、uvicorn，以及推荐的 a2wsgi）
+#
+# 启动方式: TTD_SERVER=asgi python app.py，或 uvicorn asgi:application --port 5001
+
+import asyncio
+import json
+
+import anyio
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+from app import AnalysisRun, app as flask_app
+
+
+async def continue_analysis(request: Request):
+    try:
+        data = await request.json()
+    except json.JSONDecodeError:
+        data = {}
+    # 获取会话可能需要从磁盘重新加载数据，放到线程中执行
+    loop = asyncio.get_running_loop()
+    analysis, error = await loop.run_in_executor(None, AnalysisRun.open, data)
+    if error:
+        body, status = error
+        return Response(body, status_code=status, media_type='application/json')
+
+    async def generate_stream():
+        steps = analysis.agent_core.arun(analysis.task, analysis.session['llm_history'])
+        try:
+            async for step in steps:
+                yield analysis.format_step(step)
+                if await request.is_disconnected():
+                    # 客户端已断开，关闭模型流，不再继续消耗 token
+                    return
+            analysis.finished = True
+            yield await loop.run_in_executor(None, analysis.evaluation_message)
+        finally:
+            # 断开连接时 Starlette 会取消本生成器；清理过程需屏蔽取消，才能关闭模型流并中止正在执行的代码
+            with anyio.CancelScope(shield=True):
+                await steps.aclose()
+                await loop.run_in_executor(None, analysis.close)
+
+    return StreamingResponse(generate_stream(), media_type='text/event-stream')
+
+
+application = Starlette(routes=[
+    Route('/continue_analysis', continue_analysis, methods=['POST']),
+    Mount('/', app=WSGIMiddleware(flask_app)),
+])
+
+
+def serve(host, port):
+    import uvicorn
+    uvicorn.run(application, host=host, port=port, log_level='warning')
@@ -0,0 +1,194 @@
+# datasets.py
+
+import argparse
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import shapefile  # pyshp
+except ImportError:
+    shapefile = None
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+FORMATS = ('csv', 'json', 'xlsx', 'shp')
+CHUNK_ROWS = 200_000
+FIRST_CHUNK_ROWS = 10_000
+# Excel 单个工作表最多 1048576 行（含表头）
+XLSX_MAX_ROWS = 1_048_575
+XLSX_SAMPLE_ROWS = 5_000
+
+CATEGORIES = np.array(["电子", "服装", "食品", "家居", "图书", "运动", "美妆", "汽车"])
+REGIONS = np.array([f"区域{i:02d}" for i in range(20)])
+WORDS = np.array(["增长", "下降", "平稳", "波动", "异常", "促销", "退货", "新客", "复购", "缺货"])
+WGS84_PRJ = (
+    'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+    'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]'
+)
+SHP_FIELDS = [
+    ("id", "N", 12, 0), ("timestamp", "C", 19, 0), ("category", "C", 12, 0), ("region", "C", 12, 0),
+    ("value", "N", 16, 4), ("amount", "N", 16, 2), ("quantity", "N", 8, 0), ("note", "C", 24, 0),
+]
+
+
+def make_chunk(start, rows, seed=0):
+    """生成第 start 行起的 rows 行合成数据；相同的 (start, seed) 总是得到相同的数据。"""
+    rng = np.random.default_rng((seed, start))
+    ids = np.arange(start, start + rows)
+    trend = ids / 1e5
+    return pd.DataFrame({
+        "id": ids,
+        "timestamp": (pd.Timestamp("2020-01-01") + pd.to_timedelta(ids * 60, unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "category": CATEGORIES[rng.integers(0, len(CATEGORIES), rows)],
+        "region": REGIONS[rng.integers(0, len(REGIONS), rows)],
+        "value": np.round(np.sin(trend) * 50 + rng.normal(100, 15, rows), 4),
+        "amount": np.round(rng.lognormal(4, 1, rows), 2),
+        "quantity": rng.integers(1, 500, rows),
+        "lon": np.round(rng.uniform(73, 135, rows), 6),
+        "lat": np.round(rng.uniform(18, 53, rows), 6),
+        "note": np.char.add(WORDS[rng.integers(0, len(WORDS), rows)], rng.integers(0, 1000, rows).astype(str)),
+    })
+
+
+def _write_until(path, target_bytes, write_chunk, seed):
+    """逐块写入直到文件达到目标大小，返回写入的行数。
+
+    先写一小块估算每行字节数，之后的分块按剩余大小确定行数，避免小文件明显超出目标。
+    """
+    rows, chunk_rows = 0, FIRST_CHUNK_ROWS
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        while rows == 0 or f.tell() < target_bytes:
+            write_chunk(f, make_chunk(rows, chunk_rows, seed), rows == 0)
+            rows += chunk_rows
+            bytes_per_row = f.tell() / rows
+            chunk_rows = max(1, min(CHUNK_ROWS, int((target_bytes - f.tell()) / bytes_per_row) + 1))
+    return rows
+
+
+def _write_csv(path, target_bytes, seed):
+    return _write_until(path, target_bytes, lambda f, chunk, first: chunk.to_csv(f, index=False, header=first), seed)
+
+
+def _write_json(path, target_bytes, seed):
+    # JSON Lines：加载时可以分块读取，与大文件的常见形式一致
+    return _write_until(path, target_bytes, lambda f, chunk, first: chunk.to_json(f, orient='records', lines=True, force_ascii=False), seed)
+
+
+def _xlsx_rows(target_bytes, seed):
+    """用一小段样本估算每行压缩后的字节数，再换算出目标行数。"""
+    sample = io.BytesIO()
+    _write_xlsx_rows(sample, XLSX_SAMPLE_ROWS, seed)
+    return max(1, min(XLSX_MAX_ROWS, int(target_bytes / (sample.tell() / XLSX_SAMPLE_ROWS))))
+
+
+def _write_xlsx_rows(target, rows, seed):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("data")
+    written = 0
+    while written < rows:
+        chunk = make_chunk(written, min(CHUNK_ROWS, rows - written), seed)
+        if written == 0:
+            sheet.append(list(chunk.columns))
+        for row in chunk.itertuples(index=False):
+            sheet.append([v.item() if isinstance(v, np.generic) else v for v in row])
+        written += len(chunk)
+    workbook.save(target)
+
+
+def _write_xlsx(path, target_bytes, seed):
+    if openpyxl is None:
+        raise RuntimeError("生成 XLSX 文件需要 openpyxl，请运行 'pip install openpyxl'。")
+    rows = _xlsx_rows(target_bytes, seed)
+    _write_xlsx_rows(path, rows, seed)
+    return rows
+
+
+def _write_shp(path, target_bytes, seed):
+    """点要素 Shapefile；经纬度作为几何，其余列写入 .dbf。"""
+    if shapefile is None:
+        raise RuntimeError("生成 SHP 文件需要 pyshp，请运行 'pip install pyshp'。")
+    # 每条记录：.shp 28 字节、.shx 8 字节、.dbf 1 字节删除标记加字段宽度
+    record_bytes = 28 + 8 + 1 + sum(width for _, _, width, _ in SHP_FIELDS)
+    rows = max(1, int(target_bytes / record_bytes))
+    stem = os.path.splitext(path)[0]
+    writer = shapefile.Writer(stem, shapeType=shapefile.POINT)
+    for name, field_type, width, decimals in SHP_FIELDS:
+        writer.field(name, field_type, size=width, decimal=decimals)
+    written = 0
+    while written < rows:
+        chunk = make_chunk(written, min(CHUNK_ROWS, rows - written), seed)
+        columns = [chunk[name].tolist() for name, *_ in SHP_FIELDS]
+        for lon, lat, *record in zip(chunk["lon"].tolist(), chunk["lat"].tolist(), *columns):
+            writer.point(lon, lat)
+            writer.record(*record)
+        written += len(chunk)
+    writer.close()
+    with open(stem + '.prj', 'w', encoding='utf-8') as f:
+        f.write(WGS84_PRJ)
+    return rows
+
+
+WRITERS = {"csv": _write_csv, "json": _write_json, "xlsx": _write_xlsx, "shp": _write_shp}
+SHP_SIDECARS = ('.shx', '.dbf', '.prj')
+
+
+def dataset_files(path):
+    """上传时需要一起提交的文件（Shapefile 包含辅助文件）。"""
+    if not path.lower().endswith('.shp'):
+        return [path]
+    stem = os.path.splitext(path)[0]
+    return [path] + [stem + ext for ext in SHP_SIDECARS]
+
+
+def ensure_dataset(fmt, size_mb, directory=DEFAULT_DATA_DIR, seed=0):
+    """返回 (主文件路径, 信息)；同名文件已生成过时直接复用。
+
+    XLSX 受工作表行数上限约束，目标过大时实际文件会小于 size_mb。
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"不支持的格式: {fmt}（可选 {', '.join(FORMATS)}）")
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"bench_{fmt}_{size_mb}mb.{fmt}")
+    info_path = path + '.info.json'
+    if os.path.exists(info_path) and all(os.path.exists(p) for p in dataset_files(path)):
+        with open(info_path, 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get("seed") == seed:
+            return path, info
+    rows = WRITERS[fmt](path, int(size_mb * 1024 * 1024), seed)
+    info = {
+        "format": fmt, "target_mb": size_mb, "seed": seed, "rows": rows,
+        "bytes": sum(os.path.getsize(p) for p in dataset_files(path)),
+    }
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f)
+    return path, info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成基准测试用的合成数据文件")
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--sizes', default='10', help="目标大小（MB），逗号分隔，例如 10,100,1000,4000")
+    parser.add_argument('--dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for fmt in args.formats.split(','):
+        for size in args.sizes.split(','):
+            try:
+                path, info = ensure_dataset(fmt.strip(), float(size) if '.' in size else int(size), args.dir, args.seed)
+            except RuntimeError as e:
+                print(e)
+                continue
+            print(f"{path}: {info['rows']} 行，{info['bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
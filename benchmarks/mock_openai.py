@@ -0,0 +1,229 @@
+# mock_openai.py
+
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_SCENARIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios.json')
+# 模型名为 "bench-<场景名>" 时回放对应场景的脚本，其余模型名回放第一个场景
+MODEL_PREFIX = 'bench-'
+STREAM_CHUNK_CHARS = 16
+
+DF_NAME_PATTERN = re.compile(r"DataFrame '(\w+)'")
+
+MOCK_EVALUATION = {
+    "score": 8,
+    "justification": "基准测试中的固定评估结果。",
+    "details": {"completeness": 8, "accuracy": 8, "insight": 7, "efficiency": 8, "visualization": 7},
+}
+
+
+def load_scenarios(path=DEFAULT_SCENARIOS):
+    with open(path, 'r', encoding='utf-8') as f:
+        return {scenario["name"]: scenario for scenario in json.load(f)}
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def _substitute(value, df_name):
+    if isinstance(value, str):
+        return value.replace("{df}", df_name)
+    if isinstance(value, list):
+        return [_substitute(v, df_name) for v in value]
+    if isinstance(value, dict):
+        return {k: _substitute(v, df_name) for k, v in value.items()}
+    return value
+
+
+class ScriptedModel:
+    """按请求中的对话回放脚本：已有的 assistant 消息数就是当前轮次，因此不需要保存会话状态。
+
+    脚本中的 "{df}" 替换为对话里出现的第一个 DataFrame 名称（由 /start_session 写入历史）。
+    """
+
+    def __init__(self, scenarios):
+        self.scenarios = scenarios
+
+    def transcript_for(self, model):
+        name = model[len(MODEL_PREFIX):] if model.startswith(MODEL_PREFIX) else model
+        scenario = self.scenarios.get(name) or next(iter(self.scenarios.values()))
+        return scenario["turns"]
+
+    def next_turn(self, body):
+        messages = body.get("messages", [])
+        turns = self.transcript_for(body.get("model", ""))
+        turn = sum(1 for m in messages if m.get("role") == "assistant")
+        df_name = "df"
+        for message in messages:
+            if message.get("role") == "user":
+                match = DF_NAME_PATTERN.search(_message_text(message))
+                if match:
+                    df_name = match.group(1)
+                    break
+        # 脚本用完后一直重复最后一轮（通常是 finish_task），避免 agent 无限循环
+        return _substitute(turns[min(turn, len(turns) - 1)], df_name)
+
+    def reply(self, body):
+        """返回 (文本内容, 原生工具调用列表)。"""
+        if body.get("response_format"):
+            # 评估器以 JSON 模式调用
+            return json.dumps(MOCK_EVALUATION, ensure_ascii=False), []
+        turn = self.next_turn(body)
+        actions = turn.get("actions", [])
+        thought = f"<thought>{turn.get('thought', '')}</thought>"
+        if not body.get("tools"):
+            payload = actions[0] if len(actions) == 1 else actions
+            return f"{thought}<action>{json.dumps(payload, ensure_ascii=False)}</action>", []
+        calls = [
+            {"id": f"call_{i}_{time.monotonic_ns()}", "type": "function",
+             "function": {"name": a["tool"], "arguments": json.dumps(a.get("args", {}), ensure_ascii=False)}}
+            for i, a in enumerate(actions)
+        ]
+        return thought, calls
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MockOpenAI/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            models = [{"id": MODEL_PREFIX + name, "object": "model", "owned_by": "benchmark"} for name in self.server.model.scenarios]
+            self._send_json({"object": "list", "data": models})
+        else:
+            self._send_json({"error": {"message": "not found"}}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json({"error": {"message": "invalid JSON body", "type": "invalid_request_error"}}, status=400)
+            return
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json({"error": {"message": "not found"}}, status=404)
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        content, calls = self.server.model.reply(body)
+        usage = {
+            "prompt_tokens": sum(_estimate_tokens(_message_text(m)) for m in body.get("messages", [])),
+            "completion_tokens": _estimate_tokens(content + json.dumps(calls)),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if body.get("stream"):
+            include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+            self._stream(body.get("model", ""), content, calls, usage if include_usage else None)
+            return
+        message = {"role": "assistant", "content": content}
+        if calls:
+            message["tool_calls"] = calls
+        self._send_json({
+            "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()), "model": body.get("model", ""),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if calls else "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, model, content, calls, usage):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        base = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": model}
+
+        def send(delta, finish_reason=None):
+            chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}])
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            if self.server.chunk_delay:
+                self.wfile.flush()
+                time.sleep(self.server.chunk_delay)
+
+        send({"role": "assistant", "content": ""})
+        for i in range(0, len(content), STREAM_CHUNK_CHARS):
+            send({"content": content[i:i + STREAM_CHUNK_CHARS]})
+        for i, call in enumerate(calls):
+            send({"tool_calls": [{"index": i, "id": call["id"], "type": "function", "function": {"name": call["function"]["name"], "arguments": ""}}]})
+            arguments = call["function"]["arguments"]
+            for j in range(0, len(arguments), STREAM_CHUNK_CHARS):
+                send({"tool_calls": [{"index": i, "function": {"arguments": arguments[j:j + STREAM_CHUNK_CHARS]}}]})
+        send({}, "tool_calls" if calls else "stop")
+        if usage is not None:
+            self.wfile.write(f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    """本地的 OpenAI 兼容服务（/v1/chat/completions、/v1/models），按脚本回放模型输出。
+
+    latency 为每次请求返回前的等待时间，chunk_delay 为流式输出中每个数据块之间的间隔（秒），
+    默认均为 0，使基准测试只衡量应用本身的开销。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, scenarios=None, latency=0.0, chunk_delay=0.0):
+        super().__init__((host, port), _Handler)
+        self.model = ScriptedModel(scenarios if scenarios is not None else load_scenarios())
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开（例如关闭了保持的连接）不算错误
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回放脚本化对话的本地 OpenAI 兼容服务")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--scenarios', default=DEFAULT_SCENARIOS)
+    parser.add_argument('--latency', type=float, default=0.0, help="每次请求的模拟延迟（秒）")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="流式数据块之间的间隔（秒）")
+    args = parser.parse_args()
+    server = MockOpenAIServer(args.host, args.port, load_scenarios(args.scenarios), args.latency, args.chunk_delay)
+    print(f"模拟 OpenAI 服务已启动: {server.base_url}（模型名: {', '.join(MODEL_PREFIX + n for n in server.model.scenarios)}）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,327 @@
+# run.py
+
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+
+from benchmarks import datasets
+from benchmarks.mock_openai import MODEL_PREFIX, MockOpenAIServer, load_scenarios, DEFAULT_SCENARIOS
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(REPO_DIR, 'benchmarks')
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, 'results', 'latest.json')
+SERVER_START_TIMEOUT = 120
+UPLOAD_BLOCK_BYTES = 1 << 20
+# 相对基线变慢（或内存增加）超过该比例，且绝对差值超过下面的噪声下限时判为退化
+DEFAULT_THRESHOLD = 0.2
+MIN_SECONDS_DELTA = 0.05
+MIN_MEMORY_DELTA_MB = 32
+
+LOAD_SECONDS_PATTERN = re.compile(r"耗时 ([\d.]+) 秒")
+PEAK_RSS_PATTERN = re.compile(r"^ttd_process_peak_rss_bytes (\d+)$", re.MULTILINE)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class AppServer:
+    """在子进程中以 waitress 启动应用，每次运行使用新进程，峰值内存互不影响。
+
+    数据集缓存上限设为 0，使每次 /start_session 都走完整的解析路径。
+    """
+
+    def __init__(self, protocol, log_path):
+        self.port = _free_port()
+        env = dict(
+            os.environ, TTD_PORT=str(self.port), TTD_SERVER='waitress', TTD_TOOL_PROTOCOL=protocol,
+            TTD_DATASET_CACHE_MAX_MB='0', TTD_MAX_UPLOAD_MB=str(1 << 20), PYTHONUNBUFFERED='1',
+        )
+        self.log_path = log_path
+        self._log = open(log_path, 'w', encoding='utf-8')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(REPO_DIR, 'app.py')], cwd=REPO_DIR, env=env,
+            stdout=self._log, stderr=subprocess.STDOUT,
+        )
+
+    def connection(self, timeout=None):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+
+    def wait_ready(self):
+        deadline = time.monotonic() + SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"应用进程已退出（退出码 {self.process.returncode}），日志见 {self.log_path}")
+            try:
+                conn = self.connection(timeout=2)
+                conn.request('GET', '/metrics')
+                if conn.getresponse().status == 200:
+                    return
+            except OSError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"应用在 {SERVER_START_TIMEOUT} 秒内未就绪，日志见 {self.log_path}")
+
+    def request_json(self, method, path, payload=None):
+        conn = self.connection()
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        conn.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+        response = conn.getresponse()
+        return response.status, response.read()
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+
+def _upload(server, fields, paths):
+    """以 multipart/form-data 流式上传文件，不把整个文件读入内存。返回 (状态码, 响应 JSON)。"""
+    boundary = f"----ttdbench{uuid.uuid4().hex}"
+    field_parts = b"".join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8')
+        for name, value in fields.items()
+    )
+    file_headers = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+        for path in paths
+    ]
+    closing = f"--{boundary}--\r\n".encode('utf-8')
+    length = len(field_parts) + len(closing) + sum(len(h) + os.path.getsize(p) + 2 for h, p in zip(file_headers, paths))
+
+    conn = server.connection()
+    conn.putrequest('POST', '/start_session')
+    conn.putheader('Content-Type', f'multipart/form-data; boundary={boundary}')
+    conn.putheader('Content-Length', str(length))
+    conn.endheaders()
+    conn.send(field_parts)
+    for header, path in zip(file_headers, paths):
+        conn.send(header)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(UPLOAD_BLOCK_BYTES), b''):
+                conn.send(block)
+        conn.send(b"\r\n")
+    conn.send(closing)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read() or b'{}')
+
+
+def _stream_analysis(server, payload):
+    """调用 /continue_analysis 并逐条读取 SSE 事件；返回 (首个事件耗时, 总耗时, 事件列表)。"""
+    conn = server.connection()
+    start = time.perf_counter()
+    conn.request('POST', '/continue_analysis', body=json.dumps(payload).encode('utf-8'), headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    if response.status != 200:
+        raise RuntimeError(f"/continue_analysis 返回 {response.status}: {response.read()[:500]!r}")
+    first_event, events = None, []
+    while True:
+        line = response.readline()
+        if not line:
+            break
+        if line.startswith(b'data:'):
+            if first_event is None:
+                first_event = time.perf_counter() - start
+            events.append(json.loads(line[5:]))
+    return first_event, time.perf_counter() - start, events
+
+
+def run_once(scenario, dataset_path, mock, protocol, log_path):
+    """完整运行一次场景：启动应用、上传数据、执行分析，返回指标字典。"""
+    server = AppServer(protocol, log_path)
+    try:
+        server.wait_ready()
+        model = {"api_key": "bench", "api_base_url": mock.base_url, "model_name": MODEL_PREFIX + scenario["name"]}
+
+        start = time.perf_counter()
+        status, started = _upload(server, model, datasets.dataset_files(dataset_path))
+        session_start = time.perf_counter() - start
+        if status != 200 or not started.get("success"):
+            raise RuntimeError(f"/start_session 失败（{status}）: {started}")
+        initial_message = started["initial_message"]["content"]
+        if "已成功加载为" not in initial_message:
+            raise RuntimeError(f"数据加载失败: {re.sub(r'<[^>]+>', '', initial_message)[:300]}")
+        load_match = LOAD_SECONDS_PATTERN.search(initial_message)
+
+        ttfe, end_to_end, events = _stream_analysis(server, dict(model, session_id=started["session_id"], task=scenario["task"]))
+
+        spans = [span for event in events for span in event.get("spans", [])]
+        tool_seconds = {}
+        for span in spans:
+            if span["kind"] in ("tool", "plot"):
+                key = span["name"] if span["kind"] == "tool" else f"plot:{span['name']}"
+                tool_seconds[key] = tool_seconds.get(key, 0.0) + span["seconds"]
+        status, body = server.request_json('GET', '/metrics')
+        peak = PEAK_RSS_PATTERN.search(body.decode('utf-8')) if status == 200 else None
+        server.request_json('POST', '/delete_session', {"session_id": started["session_id"]})
+        return {
+            "session_start_seconds": session_start,
+            "load_seconds": float(load_match.group(1)) if load_match else None,
+            "ttfe_seconds": ttfe,
+            "end_to_end_seconds": end_to_end,
+            "peak_rss_mb": int(peak.group(1)) / 1024 / 1024 if peak else None,
+            "tool_seconds": tool_seconds,
+            "llm_calls": sum(1 for s in spans if s["kind"] == "llm"),
+            "tool_errors": sum(1 for s in spans if s["kind"] == "tool" and s.get("error")),
+            "finished": any(e.get("type") == "final_summary" for e in events),
+        }
+    finally:
+        server.stop()
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return round(statistics.median(values), 4) if values else None
+
+
+def aggregate(samples):
+    """多次运行取中位数（布尔值要求全部为真）。"""
+    result = {}
+    for key, first in samples[0].items():
+        values = [s[key] for s in samples]
+        if isinstance(first, bool):
+            result[key] = all(values)
+        elif isinstance(first, dict):
+            names = sorted({name for v in values for name in v})
+            result[key] = {name: _median([v.get(name) for v in values]) for name in names}
+        else:
+            result[key] = _median(values)
+    return result
+
+
+def _comparable(metrics):
+    """展开为 {指标名: (值, 噪声下限)}，只包含越小越好的耗时和内存指标。"""
+    flat = {}
+    for key, value in metrics.items():
+        if key == 'tool_seconds':
+            flat.update({f"tool_seconds.{name}": (v, MIN_SECONDS_DELTA) for name, v in value.items() if v is not None})
+        elif key.endswith('_seconds') and value is not None:
+            flat[key] = (value, MIN_SECONDS_DELTA)
+        elif key == 'peak_rss_mb' and value is not None:
+            flat[key] = (value, MIN_MEMORY_DELTA_MB)
+    return flat
+
+
+def compare(results, baseline, threshold):
+    """返回 (对比表行, 退化项列表)。"""
+    rows, regressions = [], []
+    for run_id, metrics in results.items():
+        base = baseline.get(run_id)
+        if base is None:
+            rows.append((run_id, "(基线中没有该项)", "", "", ""))
+            continue
+        base_flat = _comparable(base)
+        for name, (value, min_delta) in _comparable(metrics).items():
+            if name not in base_flat:
+                continue
+            base_value = base_flat[name][0]
+            change = (value - base_value) / base_value if base_value else 0.0
+            regressed = value > base_value * (1 + threshold) and value - base_value > min_delta
+            rows.append((run_id, name, f"{base_value:.3f}", f"{value:.3f}", f"{change:+.1%}" + (" ⚠" if regressed else "")))
+            if regressed:
+                regressions.append(f"{run_id} {name}: {base_value:.3f} → {value:.3f}（{change:+.1%}）")
+    return rows, regressions
+
+
+def _print_table(rows, headers):
+    widths = [max(len(str(r[i])) for r in [headers] + rows) for i in range(len(headers))]
+    for row in [headers] + rows:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(row, widths)))
+
+
+def _parse_sizes(text):
+    return [float(s) if '.' in s else int(s) for s in text.split(',') if s.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Talk to Data 离线性能基准：模拟 OpenAI 服务 + 合成数据集")
+    parser.add_argument('--scenarios', default='', help="要运行的场景名，逗号分隔（默认全部）")
+    parser.add_argument('--scenario-file', default=DEFAULT_SCENARIOS)
+    parser.add_argument('--sizes', default='10', help="数据集目标大小（MB），逗号分隔，例如 10,1000,4000")
+    parser.add_argument('--format', default='', help="覆盖场景默认的数据格式（csv/json/xlsx/shp）")
+    parser.add_argument('--protocol', default='auto', choices=['auto', 'native', 'tags'], help="工具调用协议（TTD_TOOL_PROTOCOL）")
+    parser.add_argument('--repeat', type=int, default=1, help="每项运行次数，结果取中位数")
+    parser.add_argument('--latency', type=float, default=0.0, help="模拟的模型响应延迟（秒）")
+    parser.add_argument('--data-dir', default=datasets.DEFAULT_DATA_DIR)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基线，不做对比")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help="判为退化的相对变化（默认 0.2 即 20%%）")
+    args = parser.parse_args()
+
+    scenarios = load_scenarios(args.scenario_file)
+    selected = [s.strip() for s in args.scenarios.split(',') if s.strip()] or list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        parser.error(f"未知的场景: {', '.join(unknown)}（可选 {', '.join(scenarios)}）")
+
+    mock = MockOpenAIServer(scenarios=scenarios, latency=args.latency).start()
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    results, failures = {}, []
+    for name in selected:
+        scenario = scenarios[name]
+        fmt = args.format or scenario["format"]
+        for size in _parse_sizes(args.sizes):
+            run_id = f"{name}-{fmt}-{size}mb"
+            try:
+                dataset_path, info = datasets.ensure_dataset(fmt, size, args.data_dir)
+                print(f"[{run_id}] 数据集 {os.path.basename(dataset_path)}：{info['rows']} 行，{info['bytes'] / 1024 / 1024:.1f} MB", flush=True)
+                log_path = os.path.join(os.path.dirname(args.output), f"{run_id}.log")
+                samples = [run_once(scenario, dataset_path, mock, args.protocol, log_path) for _ in range(args.repeat)]
+            except Exception as e:
+                failures.append(f"{run_id}: {e}")
+                print(f"[{run_id}] 失败: {e}", flush=True)
+                continue
+            results[run_id] = dict(aggregate(samples), dataset_rows=info["rows"], dataset_mb=round(info["bytes"] / 1024 / 1024, 1))
+            r = results[run_id]
+            print(
+                f"[{run_id}] 启动会话 {r['session_start_seconds']:.2f}s，首个事件 {r['ttfe_seconds']:.3f}s，"
+                f"端到端 {r['end_to_end_seconds']:.2f}s，峰值内存 {r['peak_rss_mb'] or 0:.0f} MB", flush=True
+            )
+    mock.shutdown()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"protocol": args.protocol, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存到 {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({"protocol": args.protocol, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"已保存为基线: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get("protocol") != args.protocol:
+            print(f"注意：基线使用的工具调用协议为 {baseline.get('protocol')}，本次为 {args.protocol}。")
+        rows, regressions = compare(results, baseline.get("results", {}), args.threshold)
+        print()
+        _print_table(rows, ("运行", "指标", "基线", "本次", "变化"))
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项性能退化（阈值 {args.threshold:.0%}）:")
+            for line in regressions:
+                print(f"  {line}")
+            failures.extend(regressions)
+    else:
+        print(f"未找到基线 {args.baseline}，可使用 --save-baseline 保存本次结果。")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
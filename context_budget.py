@@ -0,0 +1,162 @@
+# context_budget.py
+
+import json
+import os
+import re
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+CONTEXT_MAX_TOKENS = int(os.environ.get('TTD_CONTEXT_MAX_TOKENS', 24000))
+OBSERVATION_MAX_TOKENS = int(os.environ.get('TTD_OBSERVATION_MAX_TOKENS', 1500))
+# 压缩时始终保留的最近消息条数
+CONTEXT_KEEP_MESSAGES = int(os.environ.get('TTD_CONTEXT_KEEP_MESSAGES', 8))
+# 压缩后目标占用比例；留出余量，使压缩不会每轮都发生（否则前缀每轮变化，无法命中提示词缓存）
+COMPACT_TARGET_RATIO = 0.6
+SUMMARY_PREFIX = "【此前对话摘要】"
+SUMMARY_LINE_CHARS = 160
+SUMMARY_MAX_TOKENS = 2000
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]')
+_encoding = None
+
+
+def count_tokens(text):
+    """估算文本的 token 数；安装了 tiktoken 时精确计数，否则按字符类型估算。"""
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message):
+    # 每条消息另有少量角色和分隔符开销；原生函数调用的参数同样计入
+    tokens = count_tokens(str(message.get("content") or "")) + 4
+    for call in message.get("tool_calls") or []:
+        tokens += count_tokens(call["function"]["name"]) + count_tokens(call["function"]["arguments"]) + 4
+    return tokens
+
+
+def truncate_text(text, max_tokens):
+    """超出预算时保留开头和结尾，中间替换为截断说明。"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep_chars = max(200, int(len(text) * max_tokens / tokens))
+    head, tail = text[:keep_chars * 2 // 3], text[-(keep_chars // 3):]
+    omitted = len(text) - len(head) - len(tail)
+    return f"{head}\n...[内容过长，已省略 {omitted} 个字符]...\n{tail}"
+
+
+def _one_line(text, limit=SUMMARY_LINE_CHARS):
+    text = re.sub(r'\s+', ' ', text or '').strip()
+    return text if len(text) <= limit else text[:limit] + '…'
+
+
+def _summarize_message(message):
+    """从单条消息中抽取一行摘要。"""
+    content = str(message.get("content") or "")
+    if message["role"] == "assistant":
+        thought = re.search(r'<thought>(.*?)</thought>', content, re.DOTALL)
+        action = re.search(r'<action>(.*?)</action>', content, re.DOTALL)
+        parts = []
+        if thought:
+            parts.append(f"思考: {_one_line(thought.group(1), 80)}")
+        if action:
+            try:
+                action_json = json.loads(re.sub(r'^```json\s*|\s*```$', '', action.group(1).strip(), flags=re.MULTILINE))
+                # 一轮中可能同时调用多个工具
+                for item in action_json if isinstance(action_json, list) else [action_json]:
+                    parts.append(f"调用 {item.get('tool')} {_one_line(json.dumps(item.get('args', {}), ensure_ascii=False), 100)}")
+            except (json.JSONDecodeError, AttributeError):
+                parts.append(f"行动: {_one_line(action.group(1), 80)}")
+        if message.get("tool_calls") and content and not thought:
+            parts.append(f"思考: {_one_line(content, 80)}")
+        for call in message.get("tool_calls") or []:
+            parts.append(f"调用 {call['function']['name']} {_one_line(call['function']['arguments'], 100)}")
+        return "- 助手 " + ("；".join(parts) if parts else _one_line(content))
+    if message["role"] == "tool":
+        return "  - 结果: " + _one_line(content)
+    if content.startswith("观察结果:"):
+        return "  - 结果: " + _one_line(content[len("观察结果:"):])
+    if content.startswith(SUMMARY_PREFIX):
+        return content[len(SUMMARY_PREFIX):].strip()
+    return "- 用户: " + _one_line(content, 240)
+
+
+class ContextBudgeter:
+    """控制发送给模型的对话历史大小。
+
+    - 观察结果写入历史前按 token 预算截断；
+    - 历史超出预算时，把较早的消息压缩成一条抽取式摘要，放在系统提示词之后。
+    系统提示词始终保持不变，压缩只在超出预算时一次性进行，两次压缩之间的前缀保持稳定，便于服务端的提示词缓存命中。
+    """
+
+    def __init__(self, max_tokens=CONTEXT_MAX_TOKENS, observation_tokens=OBSERVATION_MAX_TOKENS, keep_messages=CONTEXT_KEEP_MESSAGES):
+        self.max_tokens = max_tokens
+        self.observation_tokens = observation_tokens
+        self.keep_messages = keep_messages
+
+    def truncate_observation(self, text):
+        return truncate_text(text, self.observation_tokens)
+
+    def total_tokens(self, llm_history):
+        return sum(message_tokens(m) for m in llm_history)
+
+    def compact(self, llm_history):
+        """必要时原地压缩历史；返回压缩统计，未压缩时返回 None。"""
+        token_counts = [message_tokens(m) for m in llm_history]
+        before = sum(token_counts)
+        if before <= self.max_tokens:
+            return None
+
+        start = 1 if llm_history and llm_history[0]["role"] == "system" else 0
+        if start < len(llm_history) and str(llm_history[start].get("content", "")).startswith(SUMMARY_PREFIX):
+            start += 1
+        end = start
+        stop = max(start, len(llm_history) - self.keep_messages)
+        remaining = before
+        target = self.max_tokens * COMPACT_TARGET_RATIO
+        while end < stop and remaining > target:
+            remaining -= token_counts[end]
+            end += 1
+        # 保留部分从助手消息开始，使摘要（用户消息）之后的角色保持交替
+        while end < stop and llm_history[end]["role"] != "assistant":
+            end += 1
+        if end < len(llm_history) and llm_history[end]["role"] == "tool":
+            # 原生函数调用的工具结果必须紧跟发起调用的助手消息：退回到该消息，
+            # 已经退到压缩范围开头时改为把整组工具结果一起压缩
+            owner = end
+            while owner > start and llm_history[owner]["role"] == "tool":
+                owner -= 1
+            if owner > start:
+                end = owner
+            else:
+                while end < len(llm_history) and llm_history[end]["role"] != "assistant":
+                    end += 1
+        if end == start:
+            return None
+
+        summary_start = 1 if llm_history and llm_history[0]["role"] == "system" else 0
+        lines = "\n".join(_summarize_message(m) for m in llm_history[summary_start:end]).split("\n")
+        # 摘要本身也有预算，超出时丢弃最早的内容
+        line_tokens = [count_tokens(line) + 1 for line in lines]
+        summary_tokens, first = sum(line_tokens), 0
+        while summary_tokens > SUMMARY_MAX_TOKENS and first < len(lines) - 1:
+            summary_tokens -= line_tokens[first]
+            first += 1
+        summary_body = "\n".join(line for line in lines[first:] if line)
+        summary = {"role": "user", "content": f"{SUMMARY_PREFIX}\n{summary_body}"}
+        llm_history[summary_start:end] = [summary]
+        return {
+            "compacted_messages": end - summary_start,
+            "tokens_before": before,
+            "tokens_after": self.total_tokens(llm_history),
+        }
@@ -0,0 +1,144 @@
+# dataset_cache.py
+
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+# 解析逻辑变化时递增，使旧缓存自然失效
+CACHE_FORMAT_VERSION = 3
+METADATA_KEY = b'talk_to_data'
+# 较小的行组使按统计信息跳过行组（谓词下推）更有效
+ROW_GROUP_ROWS = 128 * 1024
+SHAPEFILE_SIDECARS = ('.dbf', '.shx', '.prj', '.cpg')
+
+
+def write_parquet(df, path, metadata=None):
+    """写入 Parquet，并在 schema 元数据中附带少量 JSON 信息。"""
+    if gpd is not None and isinstance(df, gpd.GeoDataFrame):
+        df.to_parquet(path)
+        return
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        METADATA_KEY: json.dumps(metadata or {}).encode('utf-8'),
+    })
+    pq.write_table(table, path, row_group_size=ROW_GROUP_ROWS)
+
+
+def read_parquet(path):
+    """以内存映射方式读取 Parquet，返回 (df, 附加元数据)。"""
+    table = pq.read_table(path, memory_map=True)
+    schema_metadata = table.schema.metadata or {}
+    if gpd is not None and b'geo' in schema_metadata:
+        df = gpd.read_parquet(path)
+    else:
+        df = table.to_pandas()
+    return df, json.loads(schema_metadata.get(METADATA_KEY, b'{}'))
+
+
+class DatasetCache:
+    """按文件内容哈希缓存解析后的 DataFrame（Parquet 列式存储）。
+
+    同一份文件再次上传时直接以内存映射方式读取缓存，避免重复解析 CSV/Excel。
+    缓存目录按总大小做 LRU 淘汰（以文件修改时间作为最近使用时间）。
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key_for(self, filepath, content_hash=None):
+        """计算缓存键：文件内容哈希 + 扩展名 + 缓存格式版本。"""
+        ext = os.path.splitext(filepath)[1].lower()
+        if content_hash is None or ext == '.shp':
+            content_hash = self._file_digest(self._source_files(filepath))
+        return f"{content_hash}{ext.replace('.', '-')}-v{CACHE_FORMAT_VERSION}"
+
+    def get(self, key):
+        """返回 (df, 附加元数据)；未命中时返回 None。"""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            df, metadata = read_parquet(path)
+        except Exception:
+            # 缓存文件损坏时丢弃，回退到重新解析
+            self._remove(path)
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return df, metadata
+
+    def put(self, key, df, metadata=None):
+        path = self.path_for(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            write_parquet(df, tmp_path, metadata)
+            os.replace(tmp_path, path)
+        except Exception:
+            # 含有 Arrow 无法表示的混合类型列时跳过缓存
+            self._remove(tmp_path)
+            return False
+        self._evict()
+        return True
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    @staticmethod
+    def _source_files(filepath):
+        if not filepath.lower().endswith('.shp'):
+            return [filepath]
+        stem = os.path.splitext(filepath)[0]
+        sidecars = [stem + ext for ext in SHAPEFILE_SIDECARS if os.path.exists(stem + ext)]
+        return [filepath] + sidecars
+
+    @staticmethod
+    def _file_digest(paths):
+        digest = hashlib.sha256()
+        for path in paths:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.parquet'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
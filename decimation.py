@@ -0,0 +1,67 @@
+# decimation.py
+
+import numpy as np
+
+
+def minmax_indices(y, n_buckets):
+    """把序列等分为 n_buckets 段，每段保留最小值和最大值所在的位置（保留尖峰）。"""
+    n = len(y)
+    if n <= 2 * n_buckets:
+        return np.arange(n)
+    edges = np.linspace(0, n, n_buckets + 1).astype(np.int64)
+    starts, sizes = edges[:-1], np.diff(edges)
+    bucket_of = np.repeat(np.arange(n_buckets), sizes)
+    # 按 (段号, 值) 排序后，每段的第一个和最后一个元素即最小值和最大值
+    order = np.lexsort((y, bucket_of))
+    first = order[starts]
+    last = order[starts + sizes - 1]
+    return np.unique(np.concatenate([first, last, [0, n - 1]]))
+
+
+def lttb_indices(x, y, n_out):
+    """Largest-Triangle-Three-Buckets 降采样，返回保留点的位置。
+
+    x 必须单调递增；首尾两点总被保留，中间每个桶选出与相邻桶构成三角形面积最大的点。
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = stop, edges[i + 2] if i + 2 < len(edges) else n
+        if next_stop <= next_start:
+            next_start, next_stop = n - 1, n
+        avg_x, avg_y = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        area = np.abs(
+            (x[previous] - avg_x) * (y[start:stop] - y[previous])
+            - (x[previous] - x[start:stop]) * (avg_y - y[previous])
+        )
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def decimate_line(x, y, max_points):
+    """折线降采样：点数远多于目标时先做 min-max 预降采样，再用 LTTB 选出 max_points 个点。
+
+    x 为数值坐标（日期需先转换为整数），需已排序且不含缺失值。返回保留点的位置。
+    """
+    n = len(x)
+    if n <= max_points:
+        return np.arange(n)
+    index = np.arange(n)
+    if n > 50 * max_points:
+        index = minmax_indices(y, 2 * max_points)
+    return index[lttb_indices(x[index], y[index], max_points)]
+
+
+def bin_scatter(x, y, bins):
+    """把散点分箱为二维计数网格，返回 (x 箱中心, y 箱中心, 计数矩阵[y, x])。"""
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    return x_centers, y_centers, counts.T
@@ -0,0 +1,61 @@
+# evaluation_jobs.py
+
+import threading
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class EvaluationJobs:
+    """后台评估任务队列。
+
+    分析结束（finish_task）后立即提交评估，SSE 流不必等待评估模型调用和雷达图绘制；
+    结果按会话保存，供 /evaluation/<session_id> 查询。每个会话只保留最近一次评估。
+    """
+
+    def __init__(self, max_workers, max_jobs=256):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='evaluation')
+        self._jobs = OrderedDict()  # session_id -> job
+        self._lock = threading.Lock()
+
+    def submit(self, session_id, fn):
+        """提交评估函数 fn()（返回评估结果字典），返回任务信息。"""
+        job = {
+            "job_id": uuid.uuid4().hex[:12], "status": "running",
+            "evaluation": None, "error": None, "done": threading.Event(),
+        }
+        with self._lock:
+            self._jobs.pop(session_id, None)
+            self._jobs[session_id] = job
+            while len(self._jobs) > self.max_jobs:
+                self._jobs.popitem(last=False)
+        self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        try:
+            job["evaluation"] = fn()
+            job["status"] = "done"
+        except Exception as e:
+            traceback.print_exc()
+            job["error"] = str(e)
+            job["status"] = "error"
+        finally:
+            job["done"].set()
+
+    def get(self, session_id):
+        """返回可序列化的任务状态；没有评估任务时返回 None。"""
+        with self._lock:
+            job = self._jobs.get(session_id)
+        if job is None:
+            return None
+        return {k: job[k] for k in ("job_id", "status", "evaluation", "error")}
+
+    def wait(self, job, timeout):
+        return job["done"].wait(timeout)
+
+    def discard(self, session_id):
+        with self._lock:
+            self._jobs.pop(session_id, None)
@@ -1,21 +1,16 @@
 # evaluator.py
 
 import json
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 import os
 import uuid
-from openai import OpenAI
-
-# 设置中文字体和负号显示
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
+import llm_clients
+import plotting  # 设置中文字体和负号显示
 
 class Evaluator:
     def __init__(self, api_key, base_url, model_name):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+        self.client = llm_clients.get_client(api_key, base_url)
         self.model = model_name
 
     # --- START OF CHANGE: Reworked and styled the radar chart function ---
@@ -51,7 +46,9 @@ class Evaluator:
         angles += angles[:1]
 
         # --- 美学设计 ---
-        fig, ax = plt.subplots(figsize=(6, 6), subplot_kw=dict(polar=True))
+        # 每次调用使用独立的 Figure 对象，不经过 pyplot 的全局状态，可在多个后台线程中并发绘制
+        fig = Figure(figsize=(6, 6))
+        ax = fig.add_subplot(polar=True)
         
         # 1. 设置背景颜色为透明
         fig.patch.set_alpha(0)
@@ -80,11 +77,10 @@ class Evaluator:
         ax.grid(color='grey', linestyle='--', linewidth=0.5)
 
         # 7. 添加标题
-        plt.title('AI 能力评估雷达图', size=16, color='white', y=1.1, weight='bold')
+        ax.set_title('AI 能力评估雷达图', size=16, color='white', y=1.1, weight='bold')
         
         # 8. 保存高质量、背景透明的图片
-        plt.savefig(save_path, dpi=150, transparent=True)
-        plt.close()
+        fig.savefig(save_path, dpi=150, transparent=True)
         
         return save_path
     # --- END OF CHANGE ---
@@ -0,0 +1,129 @@
+# ingest.py
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+from pandas.api import types as ptypes
+
+try:
+    import geopandas as gpd
+except ImportError:
+    gpd = None
+
+UPLOAD_BLOCK_BYTES = 1 << 20
+CSV_CHUNK_ROWS = 200_000
+JSON_CHUNK_ROWS = 100_000
+# 唯一值占比低于该阈值的字符串列会转换为 category
+CATEGORY_MAX_RATIO = 0.5
+ARROW_STRING_DTYPE = "string[pyarrow]"
+
+
+def save_upload(file_storage, filepath):
+    """分块写入上传的文件，同时计算内容哈希，避免整个文件进入内存。"""
+    digest = hashlib.sha256()
+    with open(filepath, 'wb') as out:
+        while True:
+            block = file_storage.stream.read(UPLOAD_BLOCK_BYTES)
+            if not block:
+                break
+            digest.update(block)
+            out.write(block)
+    return digest.hexdigest()
+
+
+def memory_bytes(df):
+    return int(df.memory_usage(deep=True).sum())
+
+
+def format_bytes(num_bytes):
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    for unit in ('KB', 'MB', 'GB'):
+        num_bytes /= 1024
+        if num_bytes < 1024 or unit == 'GB':
+            return f"{num_bytes:.1f} {unit}"
+
+
+def _downcast_column(series):
+    if ptypes.is_bool_dtype(series.dtype):
+        return series
+    # 整数列保持 int64：降为 int8/int16 后，模型代码中的乘法、加法会静默溢出
+    if ptypes.is_float_dtype(series.dtype) and series.dtype == np.float64:
+        as_float32 = series.astype(np.float32)
+        # 仅在不损失精度时降为 float32
+        if np.array_equal(as_float32.to_numpy(dtype=np.float64), series.to_numpy(), equal_nan=True):
+            return as_float32
+        return series
+    if ptypes.is_object_dtype(series.dtype):
+        if pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+            return series.astype(ARROW_STRING_DTYPE)
+    return series
+
+
+def _is_arrow_string(dtype):
+    return isinstance(dtype, pd.StringDtype) and dtype.storage == 'pyarrow'
+
+
+def compact_dtypes(df):
+    """按列推断更紧凑的类型：浮点数无损时降为 float32，文本列使用 Arrow 字符串。"""
+    for col in df.columns:
+        if gpd is not None and isinstance(df, gpd.GeoDataFrame) and col == df.geometry.name:
+            continue
+        compacted = _downcast_column(df[col])
+        if compacted.dtype != df[col].dtype:
+            df[col] = compacted
+    return df
+
+
+def categorize_strings(df):
+    """把低基数的字符串列转换为 category。"""
+    if len(df) == 0:
+        return df
+    for col in df.columns:
+        if not _is_arrow_string(df[col].dtype):
+            continue
+        if df[col].nunique(dropna=True) <= CATEGORY_MAX_RATIO * len(df):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _concat_chunks(chunks):
+    """逐块压缩后再合并，峰值内存只取决于单个分块的原始大小。"""
+    compacted, raw_bytes = [], 0
+    for chunk in chunks:
+        raw_bytes += memory_bytes(chunk)
+        compacted.append(compact_dtypes(chunk))
+    if not compacted:
+        return pd.DataFrame(), raw_bytes
+    df = pd.concat(compacted, ignore_index=True) if len(compacted) > 1 else compacted[0]
+    # 不同分块可能被降为不同精度，合并后再统一压缩一次
+    return categorize_strings(compact_dtypes(df)), raw_bytes
+
+
+def _read_json(filepath):
+    with open(filepath, 'r', encoding='utf-8') as f:
+        head = f.read(64).lstrip()
+    if not head.startswith('['):
+        # JSON Lines 可以分块读取
+        try:
+            return _concat_chunks(pd.read_json(filepath, lines=True, chunksize=JSON_CHUNK_ROWS))
+        except ValueError:
+            pass
+    try:
+        df = pd.read_json(filepath, orient='records')
+    except ValueError:
+        df = pd.read_json(filepath)
+    return _concat_chunks([df])
+
+
+def read_compact(filepath):
+    """读取数据文件并压缩类型，返回 (df, 原始内存字节数)。"""
+    lower_path = filepath.lower()
+    if lower_path.endswith('.csv'):
+        return _concat_chunks(pd.read_csv(filepath, chunksize=CSV_CHUNK_ROWS))
+    if lower_path.endswith('.json'):
+        return _read_json(filepath)
+    if lower_path.endswith(('.xlsx', '.xls')):
+        return _concat_chunks([pd.read_excel(filepath)])
+    return _concat_chunks([gpd.read_file(filepath)])
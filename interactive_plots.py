@@ -0,0 +1,154 @@
+# interactive_plots.py
+
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from decimation import bin_scatter, decimate_line
+
+CHART_KINDS = ("line", "scatter", "bar", "histogram")
+# 每条折线最多发送的点数
+LINE_MAX_POINTS = int(os.environ.get('TTD_PLOTLY_LINE_MAX_POINTS', 2000))
+# 散点总数超过该值时改为二维分箱的密度图（指定了分组列时改为按组抽样）
+SCATTER_MAX_POINTS = int(os.environ.get('TTD_PLOTLY_SCATTER_MAX_POINTS', 10000))
+SCATTER_BINS = 200
+HISTOGRAM_BINS = 50
+BAR_MAX_CATEGORIES = 50
+MAX_SERIES = 20
+
+
+class ChartSpecError(ValueError):
+    """图表参数不合法。"""
+
+
+def _numeric_x(values):
+    """折线降采样使用的数值横坐标；日期转为整数纳秒，其他类型按位置。"""
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        return values.to_numpy(dtype='datetime64[ns]').astype(np.int64).astype(np.float64)
+    if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype):
+        return values.to_numpy(dtype=np.float64, na_value=np.nan)
+    return np.arange(len(values), dtype=np.float64)
+
+
+def _series_groups(df, color):
+    if not color:
+        return [(None, df)]
+    groups = list(df.groupby(color, sort=True, observed=True))
+    if len(groups) > MAX_SERIES:
+        raise ChartSpecError(f"分组列 '{color}' 有 {len(groups)} 个取值，超过上限 {MAX_SERIES}")
+    return [(str(key[0] if isinstance(key, tuple) else key), group) for key, group in groups]
+
+
+def _line_traces(df, x, ys, color, max_points, stats):
+    traces = []
+    for group_name, group in _series_groups(df, color):
+        for y in ys:
+            part = group[[x, y]].dropna()
+            if not pd.api.types.is_numeric_dtype(part[y].dtype):
+                raise ChartSpecError(f"列 '{y}' 不是数值类型")
+            numeric_x = _numeric_x(part[x])
+            order = np.argsort(numeric_x, kind='stable')
+            y_values = part[y].to_numpy(dtype=np.float64)[order]
+            keep = order[decimate_line(numeric_x[order], y_values, max_points)]
+            stats["points_in"] += len(part)
+            stats["points_out"] += len(keep)
+            name = y if group_name is None else (group_name if len(ys) == 1 else f"{group_name} · {y}")
+            traces.append(go.Scattergl(x=part[x].iloc[keep], y=part[y].iloc[keep], mode='lines', name=name))
+    return traces
+
+
+def _scatter_traces(df, x, y, color, max_points, stats):
+    part = df[[x, y] + ([color] if color else [])].dropna(subset=[x, y])
+    stats["points_in"] += len(part)
+    if len(part) <= max_points:
+        stats["points_out"] += len(part)
+        return [
+            go.Scattergl(x=group[x], y=group[y], mode='markers', name=name or y, marker={"size": 4})
+            for name, group in _series_groups(part, color)
+        ]
+    if color:
+        # 有分组时密度图会丢失图例：按各组行数比例分配点数，每组单独随机抽样（固定种子）
+        rng = np.random.default_rng(0)
+        traces = []
+        for name, group in _series_groups(part, color):
+            budget = max(1, round(max_points * len(group) / len(part)))
+            if len(group) > budget:
+                group = group.iloc[np.sort(rng.choice(len(group), budget, replace=False))]
+            stats["points_out"] += len(group)
+            traces.append(go.Scattergl(x=group[x], y=group[y], mode='markers', name=name, marker={"size": 4}))
+        return traces
+    # 点数过多时改为密度图：只发送分箱后的计数网格
+    x_values, y_values = _numeric_x(part[x]), _numeric_x(part[y])
+    x_centers, y_centers, counts = bin_scatter(x_values, y_values, SCATTER_BINS)
+    if pd.api.types.is_datetime64_any_dtype(part[x].dtype):
+        x_centers = pd.to_datetime(x_centers.astype(np.int64))
+    stats["points_out"] += counts.size
+    stats["binned"] = True
+    return [go.Heatmap(
+        x=x_centers, y=y_centers, z=np.where(counts > 0, counts, np.nan),
+        colorscale='Viridis', colorbar={"title": "点数"}, name=f"{x} × {y}",
+    )]
+
+
+def _bar_traces(df, x, ys, stats):
+    traces = []
+    for y in ys:
+        values = df.groupby(x, sort=False, observed=True)[y].sum()
+        stats["points_in"] += len(df)
+        if len(values) > BAR_MAX_CATEGORIES:
+            values = values.loc[values.abs().nlargest(BAR_MAX_CATEGORIES).index]
+            stats["truncated_categories"] = True
+        stats["points_out"] += len(values)
+        traces.append(go.Bar(x=values.index.astype(str), y=values.to_numpy(), name=y))
+    return traces
+
+
+def _histogram_traces(df, ys, stats):
+    traces = []
+    for y in ys:
+        values = df[y].dropna()
+        if not pd.api.types.is_numeric_dtype(values.dtype):
+            raise ChartSpecError(f"列 '{y}' 不是数值类型")
+        # 在服务端分箱，只发送各箱的计数
+        counts, edges = np.histogram(values.to_numpy(dtype=np.float64), bins=HISTOGRAM_BINS)
+        stats["points_in"] += len(values)
+        stats["points_out"] += len(counts)
+        traces.append(go.Bar(x=(edges[:-1] + edges[1:]) / 2, y=counts, width=np.diff(edges), name=y, opacity=0.75))
+    return traces
+
+
+def build_chart(df, kind, x=None, y=None, color=None, title=None, max_points=None):
+    """构建降采样后的 Plotly 图表，返回 (Figure, 统计信息)。"""
+    if kind not in CHART_KINDS:
+        raise ChartSpecError(f"不支持的图表类型 '{kind}'，可用: {', '.join(CHART_KINDS)}")
+    ys = [y] if isinstance(y, str) else list(y or [])
+    columns = [c for c in [x, color] + ys if c]
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise ChartSpecError(f"找不到列 {missing}")
+    if not ys:
+        raise ChartSpecError("需要指定 y 列")
+    if kind != "histogram" and not x:
+        raise ChartSpecError("需要指定 x 列")
+
+    stats = {"points_in": 0, "points_out": 0, "binned": False, "truncated_categories": False}
+    if kind == "line":
+        traces = _line_traces(df, x, ys, color, max_points or LINE_MAX_POINTS, stats)
+    elif kind == "scatter":
+        if len(ys) != 1:
+            raise ChartSpecError("散点图只能指定一个 y 列")
+        traces = _scatter_traces(df, x, ys[0], color, max_points or SCATTER_MAX_POINTS, stats)
+    elif kind == "bar":
+        traces = _bar_traces(df, x, ys, stats)
+    else:
+        traces = _histogram_traces(df, ys, stats)
+
+    fig = go.Figure(data=traces)
+    fig.update_layout(
+        title=title, template='plotly_dark', paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)',
+        xaxis_title=x if kind != "histogram" else ", ".join(ys), yaxis_title=", ".join(ys) if kind != "histogram" else "频数",
+        barmode='overlay' if kind == "histogram" else None, margin={"l": 50, "r": 20, "t": 50 if title else 20, "b": 50},
+    )
+    return fig, stats
@@ -0,0 +1,164 @@
+# joins.py
+
+import os
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from ingest import memory_bytes
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# 合并结果的行数和内存预算，超出时拒绝执行
+JOIN_MAX_ROWS = int(os.environ.get('TTD_JOIN_MAX_ROWS', 50_000_000))
+JOIN_MAX_BYTES = int(os.environ.get('TTD_JOIN_MAX_MB', 4096)) * 1024 * 1024
+# 结果行数超过较大输入的该倍数时给出警告
+JOIN_WARN_RATIO = 2.0
+# 结果行数超过较大输入的该倍数（且超过 JOIN_EXPANSION_MIN_ROWS 行）时拒绝执行，防止错误的连接键造成行数爆炸
+JOIN_MAX_EXPANSION = float(os.environ.get('TTD_JOIN_MAX_EXPANSION', 100))
+JOIN_EXPANSION_MIN_ROWS = 1_000_000
+# DuckDB 执行合并时的内存上限，超出部分溢写到会话目录
+JOIN_DUCKDB_MEMORY_MB = int(os.environ.get('TTD_JOIN_DUCKDB_MEMORY_MB', 1024))
+
+_ACERO_JOIN_TYPES = {"inner": "inner", "left": "left outer", "right": "right outer", "outer": "full outer"}
+_SQL_JOIN_TYPES = {"inner": "INNER", "left": "LEFT", "right": "RIGHT", "outer": "FULL OUTER"}
+# 引擎不支持某些列类型时引发的异常，此时退回 pd.merge
+_ENGINE_ERRORS = (pa.ArrowException, NotImplementedError) + ((duckdb.Error,) if duckdb is not None else ())
+
+
+def _key_counts(df, on):
+    # 与 pd.merge 一致，空值键之间也会互相匹配，因此保留空值
+    if len(on) == 1:
+        return df[on[0]].value_counts(dropna=False, sort=False)
+    return df[on].value_counts(dropna=False, sort=False)
+
+
+def estimate_join(left, right, on, how):
+    """根据两侧连接键的取值频数计算合并结果的行数和内存占用。
+
+    只扫描键列，不生成任何结果行；行数与 pd.merge 的结果完全一致，内存按两侧平均行宽估算。
+    """
+    start_time = time.perf_counter()
+    left_counts, right_counts = _key_counts(left, on).align(_key_counts(right, on), join='outer', fill_value=0)
+    left_counts = left_counts.to_numpy(dtype='int64')
+    right_counts = right_counts.to_numpy(dtype='int64')
+    matched = int((left_counts * right_counts).sum())
+    left_only = int(left_counts[right_counts == 0].sum())
+    right_only = int(right_counts[left_counts == 0].sum())
+    rows = {
+        "inner": matched,
+        "left": matched + left_only,
+        "right": matched + right_only,
+        "outer": matched + left_only + right_only,
+    }[how]
+
+    right_extra = right.drop(columns=on)
+    left_row_bytes = memory_bytes(left) / len(left) if len(left) else 0
+    right_row_bytes = memory_bytes(right_extra) / len(right) if len(right) else 0
+    return {
+        "rows": rows,
+        "bytes": int(rows * (left_row_bytes + right_row_bytes)),
+        "left_duplicate_keys": bool((left_counts > 1).any()),
+        "right_duplicate_keys": bool((right_counts > 1).any()),
+        "many_to_many": bool(((left_counts > 1) & (right_counts > 1)).any()),
+        "seconds": round(time.perf_counter() - start_time, 4),
+    }
+
+
+def check_join_budget(estimate, left_rows, right_rows, max_rows=JOIN_MAX_ROWS, max_bytes=JOIN_MAX_BYTES,
+                      max_expansion=JOIN_MAX_EXPANSION):
+    """返回 (是否允许执行, 提示信息列表)。"""
+    warnings = []
+    if estimate["rows"] > max_rows:
+        return False, [f"预计结果有 {estimate['rows']} 行，超过上限 {max_rows} 行"]
+    if estimate["bytes"] > max_bytes:
+        return False, [f"预计结果占用约 {estimate['bytes'] / 1024 ** 2:.0f} MB 内存，超过上限 {max_bytes / 1024 ** 2:.0f} MB"]
+    larger_input = max(left_rows, right_rows, 1)
+    if estimate["rows"] > max(max_expansion * larger_input, JOIN_EXPANSION_MIN_ROWS):
+        return False, [
+            f"预计结果有 {estimate['rows']} 行，是较大输入（{larger_input} 行）的 {estimate['rows'] / larger_input:.0f} 倍，"
+            f"超过上限 {max_expansion:g} 倍（连接键很可能不正确）"
+        ]
+    if estimate["many_to_many"]:
+        warnings.append("两侧连接键都存在重复值（多对多连接），结果行会成倍增加")
+    if estimate["rows"] > JOIN_WARN_RATIO * max(left_rows, right_rows, 1):
+        warnings.append(f"结果行数（{estimate['rows']}）远多于输入行数，请确认连接键是否正确")
+    return True, warnings
+
+
+def _merged_columns(left_columns, right_columns, on):
+    """与 pd.merge 相同的结果列：左侧列在前（重名列加 _x），再接右侧的非键列（重名列加 _y）。"""
+    overlap = (set(left_columns) & set(right_columns)) - set(on)
+    columns = [(c, "left", f"{c}_x" if c in overlap else c) for c in left_columns]
+    columns += [(c, "right", f"{c}_y" if c in overlap else c) for c in right_columns if c not in on]
+    return columns
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _duckdb_join(left, right, left_columns, right_columns, on, how, temp_dir):
+    """在 DuckDB 中执行合并：Parquet 数据集按需流式扫描，内存中的 DataFrame 直接读取，不复制；
+    超出内存上限的中间结果溢写到 temp_dir。空值键之间互相匹配，与 pd.merge 一致。"""
+    connection = duckdb.connect()
+    try:
+        connection.execute(f"SET memory_limit = '{JOIN_DUCKDB_MEMORY_MB}MB'")
+        if temp_dir:
+            spill_dir = os.path.join(temp_dir, "join_spill")
+            connection.execute("SET temp_directory = '" + spill_dir.replace("'", "''") + "'")
+        connection.register("ttd_left", left)
+        connection.register("ttd_right", right)
+        select = []
+        for column, side, output in _merged_columns(left_columns, right_columns, on):
+            if column in on:
+                expression = f"COALESCE(l.{_quote(column)}, r.{_quote(column)})" if how in ("right", "outer") else f"l.{_quote(column)}"
+            else:
+                expression = f"{'l' if side == 'left' else 'r'}.{_quote(column)}"
+            select.append(f"{expression} AS {_quote(output)}")
+        condition = " AND ".join(f"l.{_quote(c)} IS NOT DISTINCT FROM r.{_quote(c)}" for c in on)
+        sql = f"SELECT {', '.join(select)} FROM ttd_left AS l {_SQL_JOIN_TYPES[how]} JOIN ttd_right AS r ON {condition}"
+        return connection.execute(sql).fetch_arrow_table().to_pandas()
+    finally:
+        connection.close()
+
+
+def _acero_join(left, right, on, how):
+    """用 Acero 的哈希连接执行合并，两侧 Parquet 数据集按批次扫描，不先转换为 pandas。"""
+    table = left.join(
+        right, keys=on, join_type=_ACERO_JOIN_TYPES[how], left_suffix="_x", right_suffix="_y", coalesce_keys=True
+    ).to_table()
+    order = [output for _, _, output in _merged_columns(left.schema.names, right.schema.names, on)]
+    return table.select(order).to_pandas()
+
+
+def _has_null_keys(df, on):
+    return bool(df[on].isna().to_numpy().any())
+
+
+def run_join(left_df, right_df, on, how, left_path=None, right_path=None, temp_dir=None):
+    """执行合并，返回 (结果 DataFrame, 执行引擎)。
+
+    left_path/right_path 为 DataFrame 当前版本对应的 Parquet 文件（没有时为 None），有文件时直接扫描文件。
+    安装了 DuckDB 时用它执行；否则两侧都有 Parquet 文件且连接键无空值时用 Acero
+    （Acero 中空值键互不匹配，与 pd.merge 不同）；其余情况，以及列名不是字符串或列类型不受支持时使用 pd.merge。
+    各引擎得到的结果行相同，但行顺序不保证一致。
+    """
+    if all(isinstance(c, str) for c in list(left_df.columns) + list(right_df.columns)):
+        try:
+            if duckdb is not None:
+                left = ds.dataset(left_path, format="parquet") if left_path else left_df
+                right = ds.dataset(right_path, format="parquet") if right_path else right_df
+                merged = _duckdb_join(left, right, list(left_df.columns), list(right_df.columns), on, how, temp_dir)
+                return merged, "duckdb"
+            if left_path and right_path and not (_has_null_keys(left_df, on) or _has_null_keys(right_df, on)):
+                left, right = ds.dataset(left_path, format="parquet"), ds.dataset(right_path, format="parquet")
+                return _acero_join(left, right, on, how), "acero"
+        except _ENGINE_ERRORS:
+            pass
+    return pd.merge(left_df, right_df, on=on, how=how, sort=False), "pandas"
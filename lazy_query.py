@@ -0,0 +1,195 @@
+# lazy_query.py
+
+import os
+import threading
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+from pyarrow import acero
+
+# 单次查询最多读取的结果行数；只有最终结果会被物化
+QUERY_MAX_ROWS = int(os.environ.get('TTD_QUERY_MAX_ROWS', 100_000))
+QUERY_PREVIEW_ROWS = 50
+
+FILTER_OPS = ("==", "!=", ">", ">=", "<", "<=", "in", "not_in", "is_null", "not_null")
+AGGREGATE_FUNCS = ("sum", "mean", "min", "max", "count", "count_distinct", "count_all", "stddev")
+
+
+class QuerySpecError(ValueError):
+    """查询描述不合法（列不存在、运算符未知等）。"""
+
+
+class QuerySources:
+    """为每个 DataFrame 提供可延迟扫描的 pyarrow 数据集。
+
+    从文件加载、且之后未被修改的 DataFrame 直接扫描数据集缓存中的 Parquet 文件，
+    过滤条件和列选择会下推到文件（按行组统计信息跳过不相关的行组）；
+    其余 DataFrame 按版本戳缓存一份 Arrow 表，在内存中扫描。
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self._tables = {}  # name -> (version, pa.Table)
+        self._lock = threading.Lock()
+
+    def _sources(self):
+        return self.state.setdefault("sources", {})
+
+    def register_file(self, name, path):
+        """记录 DataFrame 当前版本对应的 Parquet 文件。"""
+        self._sources()[name] = {"path": path, "version": self.state["versions"].get(name)}
+
+    def parquet_path(self, name):
+        """DataFrame 当前版本对应的 Parquet 文件；没有记录或数据已被修改时返回 None。"""
+        source = self._sources().get(name)
+        if source is not None and source["version"] == self.state["versions"].get(name) and os.path.exists(source["path"]):
+            return source["path"]
+        return None
+
+    def dataset(self, name):
+        """返回 (数据集, 来源说明)。"""
+        version = self.state["versions"].get(name)
+        path = self.parquet_path(name)
+        if path is not None:
+            return ds.dataset(path, format="parquet"), "Parquet 缓存文件"
+        with self._lock:
+            cached = self._tables.get(name)
+            if cached is None or cached[0] != version:
+                table = pa.Table.from_pandas(self.state["dataframes"][name], preserve_index=False)
+                cached = (version, table)
+                self._tables[name] = cached
+        return ds.dataset(cached[1]), "内存中的 Arrow 表"
+
+    def discard(self, name):
+        self._sources().pop(name, None)
+        with self._lock:
+            self._tables.pop(name, None)
+
+
+def _check_columns(schema, columns, what):
+    missing = [c for c in columns if c not in schema.names]
+    if missing:
+        raise QuerySpecError(f"{what}中的列 {missing} 不存在")
+
+
+def _literal(value, field_type):
+    # 日期、时间等列允许用字符串给出比较值
+    if isinstance(value, str) and (pa.types.is_temporal(field_type) or pa.types.is_decimal(field_type)):
+        return pa.scalar(value).cast(field_type)
+    return value
+
+
+def build_filter(schema, filters):
+    """把 [{"column", "op", "value"}] 转换为 pyarrow 表达式（各条件之间为“且”）。"""
+    expression = None
+    for condition in filters or []:
+        column, op, value = condition.get("column"), condition.get("op", "=="), condition.get("value")
+        _check_columns(schema, [column], "过滤条件")
+        if op not in FILTER_OPS:
+            raise QuerySpecError(f"未知的过滤运算符 '{op}'，可用: {', '.join(FILTER_OPS)}")
+        field, field_type = ds.field(column), schema.field(column).type
+        if op in ("in", "not_in"):
+            values = value if isinstance(value, list) else [value]
+            term = field.isin([_literal(v, field_type) for v in values])
+            term = ~term if op == "not_in" else term
+        elif op == "is_null":
+            term = field.is_null()
+        elif op == "not_null":
+            term = field.is_valid()
+        else:
+            literal = _literal(value, field_type)
+            term = {
+                "==": field == literal, "!=": field != literal, ">": field > literal,
+                ">=": field >= literal, "<": field < literal, "<=": field <= literal,
+            }[op]
+        expression = term if expression is None else expression & term
+    return expression
+
+
+def build_plan(dataset, filters=None, columns=None, group_by=None, aggregations=None, sort_by=None):
+    """构建 Acero 执行计划：扫描 → 过滤 → 投影/分组聚合 → 排序。
+
+    返回 (执行计划, 扫描的列, 过滤表达式)。扫描节点带上过滤条件和所需列，用于下推到 Parquet。
+    """
+    schema = dataset.schema
+    group_by = list(group_by or [])
+    aggregations = list(aggregations or [])
+    filter_expression = build_filter(schema, filters)
+
+    aggregate_specs = []
+    for item in aggregations:
+        func, column = item.get("func"), item.get("column")
+        if func not in AGGREGATE_FUNCS:
+            raise QuerySpecError(f"未知的聚合函数 '{func}'，可用: {', '.join(AGGREGATE_FUNCS)}")
+        if func != "count_all":
+            _check_columns(schema, [column], "聚合")
+        name = item.get("name") or (f"{func}_{column}" if column else func)
+        target = [] if func == "count_all" else column
+        aggregate_specs.append((target, f"hash_{func}" if group_by else func, None, name))
+    _check_columns(schema, group_by, "分组")
+
+    if aggregate_specs or group_by:
+        output_columns = group_by + [spec[3] for spec in aggregate_specs]
+        needed = group_by + [spec[0] for spec in aggregate_specs if spec[0]]
+    else:
+        output_columns = list(columns) if columns else list(schema.names)
+        _check_columns(schema, output_columns, "选择")
+        needed = output_columns
+    if filter_expression is not None:
+        needed = needed + [c["column"] for c in filters]
+    scan_columns = list(dict.fromkeys(needed)) or schema.names[:1]
+
+    # 不聚合时保持原始行顺序
+    scan_options = {"columns": scan_columns, "implicit_ordering": not (aggregate_specs or group_by)}
+    if filter_expression is not None:
+        scan_options["filter"] = filter_expression
+    nodes = [acero.Declaration("scan", acero.ScanNodeOptions(dataset, **scan_options))]
+    if filter_expression is not None:
+        nodes.append(acero.Declaration("filter", acero.FilterNodeOptions(filter_expression)))
+    if aggregate_specs or group_by:
+        nodes.append(acero.Declaration("aggregate", acero.AggregateNodeOptions(aggregate_specs, keys=group_by)))
+    else:
+        nodes.append(acero.Declaration("project", acero.ProjectNodeOptions([ds.field(c) for c in output_columns], output_columns)))
+
+    if sort_by:
+        keys = []
+        for item in (sort_by if isinstance(sort_by, list) else [sort_by]):
+            column, descending = (item, False) if isinstance(item, str) else (item.get("column"), item.get("descending", False))
+            if column not in output_columns:
+                raise QuerySpecError(f"排序列 '{column}' 不在查询结果中")
+            keys.append((column, "descending" if descending else "ascending"))
+        nodes.append(acero.Declaration("order_by", acero.OrderByNodeOptions(keys)))
+    return acero.Declaration.from_sequence(nodes), scan_columns, filter_expression
+
+
+def run_plan(plan, limit):
+    """流式执行计划，最多读取 limit 行；返回 (结果表, 是否被截断)。"""
+    reader = plan.to_reader(use_threads=True)
+    schema = reader.schema
+    batches, rows, truncated = [], 0, False
+    try:
+        for batch in reader:
+            if rows + batch.num_rows > limit:
+                batches.append(batch.slice(0, limit - rows))
+                truncated = True
+                break
+            batches.append(batch)
+            rows += batch.num_rows
+    finally:
+        reader.close()
+    return pa.Table.from_batches(batches, schema=schema), truncated
+
+
+def explain(dataset, plan, scan_columns, filter_expression):
+    """说明执行计划及下推效果（扫描的列、被跳过的 Parquet 行组）。"""
+    lines = [str(plan).strip(), f"扫描的列: {', '.join(scan_columns)}（共 {len(dataset.schema.names)} 列）"]
+    if isinstance(dataset, ds.FileSystemDataset):
+        total = kept = 0
+        for fragment in dataset.get_fragments():
+            total += fragment.num_row_groups
+            if filter_expression is None:
+                kept += fragment.num_row_groups
+            else:
+                kept += len(fragment.subset(filter=filter_expression).row_groups)
+        lines.append(f"Parquet 行组: 需要读取 {kept} / {total} 个（其余按统计信息跳过）")
+    return "\n".join(lines)
@@ -0,0 +1,111 @@
+# llm_clients.py
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+LLM_MAX_CONNECTIONS = int(os.environ.get('TTD_LLM_MAX_CONNECTIONS', 100))
+LLM_MAX_KEEPALIVE = int(os.environ.get('TTD_LLM_MAX_KEEPALIVE', 20))
+LLM_KEEPALIVE_EXPIRY = float(os.environ.get('TTD_LLM_KEEPALIVE_EXPIRY', 120))
+# 超过该时间未使用的客户端会从注册表中移除（连接池本身是共享的，不受影响）
+LLM_CLIENT_IDLE_TTL = float(os.environ.get('TTD_LLM_CLIENT_IDLE_TTL', 1800))
+
+
+def _http_client_kwargs():
+    if httpx is None:
+        return {}
+    return {"limits": httpx.Limits(
+        max_connections=LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=LLM_MAX_KEEPALIVE,
+        keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+    )}
+
+
+class ClientRegistry:
+    """进程级的 OpenAI 客户端注册表。
+
+    客户端按 (base_url, API Key 哈希) 复用，所有客户端共享同一个 HTTP 连接池，
+    因此连续的请求和轮次可以复用 keep-alive 连接与 TLS 会话。注册表中不保存明文 Key 作为键。
+    """
+
+    def __init__(self, idle_ttl_seconds):
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._clients = {}  # key -> [client, last_used]
+        self._async_clients = {}
+        self._http_client = None
+        self._async_http_client = None
+        self._async_loop = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(api_key, base_url):
+        key_hash = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()
+        return (str(base_url or "").rstrip('/'), key_hash)
+
+    def get(self, api_key, base_url):
+        key = self._key(api_key, base_url)
+        with self._lock:
+            self._evict_idle(self._clients)
+            entry = self._clients.get(key)
+            if entry is None:
+                if self._http_client is None:
+                    self._http_client = openai.DefaultHttpxClient(**_http_client_kwargs())
+                entry = self._clients[key] = [
+                    OpenAI(api_key=api_key, base_url=base_url, http_client=self._http_client), 0
+                ]
+            entry[1] = time.monotonic()
+            return entry[0]
+
+    def get_async(self, api_key, base_url):
+        """返回异步客户端；必须在事件循环中调用，连接池绑定到当前事件循环。"""
+        loop = asyncio.get_running_loop()
+        key = self._key(api_key, base_url)
+        with self._lock:
+            if self._async_loop is not loop:
+                # 事件循环变化（例如测试中多次 asyncio.run）时旧连接池不可再用
+                self._async_clients.clear()
+                self._async_http_client = openai.DefaultAsyncHttpxClient(**_http_client_kwargs())
+                self._async_loop = loop
+            self._evict_idle(self._async_clients)
+            entry = self._async_clients.get(key)
+            if entry is None:
+                entry = self._async_clients[key] = [
+                    AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self._async_http_client), 0
+                ]
+            entry[1] = time.monotonic()
+            return entry[0]
+
+    def _evict_idle(self, clients):
+        deadline = time.monotonic() - self.idle_ttl_seconds
+        for key in [k for k, (_, last_used) in clients.items() if last_used < deadline]:
+            # 不调用 client.close()：它会关闭共享的连接池
+            clients.pop(key)
+
+    def close(self):
+        with self._lock:
+            self._clients.clear()
+            self._async_clients.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+
+
+registry = ClientRegistry(idle_ttl_seconds=LLM_CLIENT_IDLE_TTL)
+
+
+def get_client(api_key, base_url):
+    return registry.get(api_key, base_url)
+
+
+def get_async_client(api_key, base_url):
+    return registry.get_async(api_key, base_url)
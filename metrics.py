@@ -0,0 +1,163 @@
+# metrics.py
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import resource
+except ImportError:
+    # Windows 没有 resource 模块，不记录峰值内存
+    resource = None
+
+TRACE_FILENAME = 'trace.jsonl'
+# 耗时直方图的分桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def peak_rss_bytes():
+    """本进程及已结束子进程中的最大常驻内存（字节）；不支持的平台返回 None。"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux 上单位是 KB，macOS 上是字节
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    """进程级的指标汇总，以 Prometheus 文本格式导出。
+
+    每个 span 计入按 (kind, name) 区分的耗时直方图和错误计数；LLM 调用另计 token 用量。
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}  # (kind, name) -> [各桶计数, 总和, 总数]
+        self._counters = {}    # (指标名, 标签) -> 值
+        self._lock = threading.Lock()
+
+    def _inc(self, metric, labels, value=1):
+        key = (metric, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, span):
+        key = (span["kind"], span["name"])
+        with self._lock:
+            histogram = self._histograms.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if span["seconds"] <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += span["seconds"]
+            histogram[2] += 1
+            if span.get("error"):
+                self._inc("ttd_span_errors_total", {"kind": span["kind"], "name": span["name"]})
+            if span.get("cached"):
+                self._inc("ttd_tool_cache_hits_total", {"name": span["name"]})
+            for kind in ("prompt", "completion"):
+                tokens = span.get(f"{kind}_tokens")
+                if tokens:
+                    self._inc("ttd_llm_tokens_total", {"type": kind, "model": span["name"]}, tokens)
+
+    def render(self):
+        lines = [
+            "# HELP ttd_span_duration_seconds 各阶段（LLM 调用、解析、工具、绘图、加载）的耗时",
+            "# TYPE ttd_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            histograms = {k: ([*v[0]], v[1], v[2]) for k, v in self._histograms.items()}
+            counters = dict(self._counters)
+        for (kind, name), (bucket_counts, total, count) in sorted(histograms.items()):
+            base = [("kind", kind), ("name", name)]
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                lines.append(f"ttd_span_duration_seconds_bucket{_labels(base + [('le', bound)])} {bucket_count}")
+            lines.append(f"ttd_span_duration_seconds_bucket{_labels(base + [('le', '+Inf')])} {count}")
+            lines.append(f"ttd_span_duration_seconds_sum{_labels(base)} {total:.6f}")
+            lines.append(f"ttd_span_duration_seconds_count{_labels(base)} {count}")
+        descriptions = {
+            "ttd_span_errors_total": "出错的 span 数",
+            "ttd_tool_cache_hits_total": "命中缓存的工具调用数",
+            "ttd_llm_tokens_total": "LLM 调用消耗的 token 数",
+        }
+        for metric, description in descriptions.items():
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{_labels(labels)} {value}")
+        rss = peak_rss_bytes()
+        if rss is not None:
+            lines.append("# HELP ttd_process_peak_rss_bytes 进程（含已结束的子进程）的峰值常驻内存")
+            lines.append("# TYPE ttd_process_peak_rss_bytes gauge")
+            lines.append(f"ttd_process_peak_rss_bytes {rss}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class Tracer:
+    """记录一次分析中的 span：计入进程级指标，追加到会话目录下的 trace.jsonl，
+    并暂存起来随下一个 SSE 事件发送给前端。
+    """
+
+    def __init__(self, session_path, metrics=registry):
+        self.path = os.path.join(session_path, TRACE_FILENAME) if session_path else None
+        self.metrics = metrics
+        self.run_id = uuid.uuid4().hex[:12]
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, kind, name, **attrs):
+        """计时一个阶段；yield 的字典可在执行过程中补充属性（如 token 数、是否出错）。"""
+        span = {"kind": kind, "name": name, **attrs}
+        started_at, start = time.time(), time.perf_counter()
+        try:
+            yield span
+        except Exception:
+            span["error"] = True
+            raise
+        finally:
+            span["seconds"] = round(time.perf_counter() - start, 6)
+            span["start"] = round(started_at, 6)
+            span["peak_rss_bytes"] = peak_rss_bytes()
+            self._finish(span)
+
+    def record(self, kind, name, seconds, **attrs):
+        """记录一个已经计时完成的阶段。"""
+        span = {"kind": kind, "name": name, **attrs}
+        span["seconds"] = round(seconds, 6)
+        span["start"] = round(time.time() - seconds, 6)
+        span["peak_rss_bytes"] = peak_rss_bytes()
+        self._finish(span)
+
+    def _finish(self, span):
+        self.metrics.observe(span)
+        with self._lock:
+            self._pending.append(span)
+            if self.path is not None:
+                try:
+                    with open(self.path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps({"run": self.run_id, **span}, ensure_ascii=False, default=str) + "\n")
+                except OSError:
+                    pass
+
+    def take_new(self):
+        """返回并清空尚未发送的 span。"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
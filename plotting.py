@@ -0,0 +1,85 @@
+# plotting.py
+
+import contextlib
+import os
+import threading
+import uuid
+
+import matplotlib
+import numpy as np
+from matplotlib.axes import Axes
+from PIL import Image
+
+PLOT_FORMATS = ("png", "svg", "jpg", "webp")
+# 散点数超过该值时随机抽样绘制，避免渲染时间和文件大小失控
+SCATTER_MAX_POINTS = int(os.environ.get('TTD_PLOT_SCATTER_MAX_POINTS', 200_000))
+THUMBNAIL_WIDTH = 480
+THUMBS_DIRNAME = '.thumbs'
+RASTER_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# 图表文件名带有随机 UUID，内容不会改变，可以长期缓存
+PLOT_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# pyplot 的全局状态机不是线程安全的；在同一进程内执行绘图代码时需要串行
+PYPLOT_LOCK = threading.Lock()
+
+matplotlib.rcParams['font.sans-serif'] = ['SimHei']
+matplotlib.rcParams['axes.unicode_minus'] = False
+
+
+def _take(values, keep):
+    if hasattr(values, 'iloc'):
+        return values.iloc[keep]
+    return np.asarray(values)[keep]
+
+
+def _is_per_point(values, n):
+    return values is not None and not isinstance(values, str) and np.ndim(values) >= 1 and len(values) == n
+
+
+@contextlib.contextmanager
+def scatter_downsampling(max_points=SCATTER_MAX_POINTS):
+    """在上下文中对超大的散点序列做随机抽样（固定随机种子），产生的说明追加到 yield 的列表中。
+
+    通过替换 Axes.scatter 实现，pandas、seaborn 等基于 matplotlib 的散点图同样生效；
+    与散点一一对应的大小、颜色参数会同步抽样。
+    """
+    notes = []
+    original = Axes.scatter
+
+    def scatter(ax, x, y, *args, **kwargs):
+        n = np.size(x)
+        if max_points and n > max_points and np.size(y) == n:
+            keep = np.sort(np.random.default_rng(0).choice(n, size=max_points, replace=False))
+            x, y = _take(x, keep), _take(y, keep)
+            args = tuple(_take(a, keep) if _is_per_point(a, n) else a for a in args)
+            for key in ('s', 'c', 'color', 'edgecolors', 'linewidths'):
+                if _is_per_point(kwargs.get(key), n):
+                    kwargs[key] = _take(kwargs[key], keep)
+            notes.append(f"散点数量 {n} 超过 {max_points}，已随机抽样 {max_points} 个点绘制。")
+        return original(ax, x, y, *args, **kwargs)
+
+    Axes.scatter = scatter
+    try:
+        yield notes
+    finally:
+        Axes.scatter = original
+
+
+def thumbnail(path, width=THUMBNAIL_WIDTH):
+    """返回图表的 WebP 缩略图路径；矢量图等不支持的格式返回 None。
+
+    缩略图缓存在图表目录的 .thumbs 子目录中，源文件更新后重新生成。
+    """
+    if not path.lower().endswith(RASTER_EXTENSIONS):
+        return None
+    directory = os.path.join(os.path.dirname(path), THUMBS_DIRNAME)
+    thumb_path = os.path.join(directory, f"{os.path.splitext(os.path.basename(path))[0]}-{width}.webp")
+    if os.path.exists(thumb_path) and os.path.getmtime(thumb_path) >= os.path.getmtime(path):
+        return thumb_path
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{thumb_path}.{uuid.uuid4().hex}.tmp"
+    with Image.open(path) as image:
+        image.thumbnail((width, width * 4))
+        image.save(tmp_path, 'WEBP', quality=80, method=4)
+    os.replace(tmp_path, thumb_path)
+    return thumb_path
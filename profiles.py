@@ -0,0 +1,84 @@
+# profiles.py
+
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from ingest import memory_bytes
+
+PROFILE_WORKERS = int(os.environ.get('TTD_PROFILE_WORKERS', 2))
+_executor = ThreadPoolExecutor(max_workers=max(1, PROFILE_WORKERS), thread_name_prefix='profile')
+
+
+def build_profile(df):
+    """计算 DataFrame 概要：结构、空值数、内存占用和描述性统计。"""
+    buffer = io.StringIO()
+    df.info(buf=buffer)
+    try:
+        describe = df.describe()
+    except ValueError:
+        # 没有任何列时 describe 会报错
+        describe = None
+    return {
+        "rows": len(df),
+        "columns": [str(c) for c in df.columns],
+        "dtypes": {str(c): str(t) for c, t in df.dtypes.items()},
+        "null_counts": {str(c): int(n) for c, n in df.isna().sum().items()},
+        "memory_bytes": memory_bytes(df),
+        "info": buffer.getvalue(),
+        "describe": describe,
+    }
+
+
+class ProfileCache:
+    """按版本戳缓存每个 DataFrame 的概要信息。
+
+    概要保存在会话状态的 "profiles" 中，键为 DataFrame 名称，并记录计算时的版本戳；
+    DataFrame 被替换或修改后版本戳改变，旧概要自然失效。加载新数据后可在后台预先计算。
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        return self.state.setdefault("profiles", {})
+
+    def schedule(self, name):
+        """在后台计算当前版本的概要。"""
+        df = self.state["dataframes"].get(name)
+        version = self.state["versions"].get(name)
+        if df is None:
+            return
+        with self._lock:
+            entry = self._entries().get(name)
+            if entry is not None and entry["version"] == version:
+                return
+            self._entries()[name] = {"version": version, "future": _executor.submit(build_profile, df)}
+
+    def get(self, name):
+        """返回当前版本的概要；后台计算尚未完成时等待，缓存失效时同步计算。"""
+        df = self.state["dataframes"][name]
+        version = self.state["versions"].get(name)
+        with self._lock:
+            entry = self._entries().get(name)
+            if entry is None or entry["version"] != version:
+                entry = {"version": version, "future": Future()}
+                self._entries()[name] = entry
+                compute = True
+            else:
+                compute = False
+        if compute:
+            try:
+                entry["future"].set_result(build_profile(df))
+            except Exception as e:
+                entry["future"].set_exception(e)
+                with self._lock:
+                    if self._entries().get(name) is entry:
+                        self._entries().pop(name)
+        return entry["future"].result()
+
+    def discard(self, name):
+        with self._lock:
+            self._entries().pop(name, None)
@@ -0,0 +1,169 @@
+# results_store.py
+
+import contextlib
+import json
+import os
+import re
+import threading
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+
+RESULTS_DIRNAME = 'results'
+# 单个观察事件（SSE）中最多发送的字符数，超出部分保存在服务端按需分页获取
+OBSERVATION_EVENT_MAX_CHARS = int(os.environ.get('TTD_OBSERVATION_EVENT_MAX_CHARS', 20000))
+PREVIEW_MAX_LINES = 200
+PREVIEW_MAX_COLUMNS = 30
+PAGE_MAX_ROWS = 1000
+RESULTS_MAX_PER_SESSION = 200
+ARROW_BATCH_ROWS = 64 * 1024
+
+HANDLE_PATTERN = re.compile(r'^r_[0-9a-f]{12}$')
+
+
+class ResultsStore:
+    """保存完整的工具结果，观察事件中只发送有限的预览和结果句柄。
+
+    文本结果保存为 .txt，表格保存为 Arrow IPC 文件（分页时以内存映射方式读取）。
+    文件位于会话目录下，随会话一起删除；每个会话只保留最近的 RESULTS_MAX_PER_SESSION 个结果。
+    """
+
+    def __init__(self, session_path):
+        self.directory = os.path.join(session_path, RESULTS_DIRNAME)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _new_handle(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return f"r_{uuid.uuid4().hex[:12]}"
+
+    def put_text(self, text):
+        return self._added(self._write_text(text))
+
+    def _write_text(self, text):
+        handle = self._new_handle()
+        with open(os.path.join(self.directory, f"{handle}.txt"), 'w', encoding='utf-8') as f:
+            f.write(text)
+        return {"handle": handle, "kind": "text", "total_lines": text.count('\n') + 1}
+
+    def put_table(self, df):
+        """保存 DataFrame；Arrow 无法表示的列转换为字符串。"""
+        handle = self._new_handle()
+        df = df.reset_index() if not _is_default_index(df) else df
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            table = pa.Table.from_pandas(df.astype(str), preserve_index=False)
+        table = table.rename_columns([str(c) for c in table.column_names])
+        path = os.path.join(self.directory, f"{handle}.arrow")
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=ARROW_BATCH_ROWS)
+        return self._added({"handle": handle, "kind": "table", "total_rows": table.num_rows})
+
+    def _added(self, meta):
+        captured = getattr(self._local, 'captured', None)
+        if captured is not None:
+            captured.append(meta)
+        else:
+            with self._lock:
+                self._pending.append(meta)
+        self._evict()
+        return meta
+
+    def take_new(self):
+        """返回并清空自上次调用以来新保存的结果。"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    @contextlib.contextmanager
+    def capture(self):
+        """收集当前线程中新保存的结果，而不放入待发送队列（并发执行工具时按调用区分结果）。"""
+        produced = []
+        self._local.captured = produced
+        try:
+            yield produced
+        finally:
+            self._local.captured = None
+
+    def enqueue(self, metas):
+        with self._lock:
+            self._pending.extend(metas)
+
+    def available(self, metas):
+        """这些结果是否仍保存在服务端（可能已被淘汰）。"""
+        session_path = os.path.dirname(self.directory)
+        return all(_result_path(session_path, meta["handle"])[0] is not None for meta in metas)
+
+    def bound_observation(self, text):
+        """文本过长时保存完整内容，返回 (预览文本, 结果信息或 None)。"""
+        if len(text) <= OBSERVATION_EVENT_MAX_CHARS:
+            return text, None
+        meta = self._write_text(text)
+        self._evict()
+        preview = '\n'.join(text[:OBSERVATION_EVENT_MAX_CHARS].split('\n')[:PREVIEW_MAX_LINES])
+        meta = dict(meta, preview_lines=preview.count('\n') + 1)
+        return preview, meta
+
+    def _evict(self):
+        try:
+            entries = sorted(
+                (os.path.getmtime(os.path.join(self.directory, name)), name) for name in os.listdir(self.directory)
+            )
+        except OSError:
+            return
+        for _, name in entries[:max(0, len(entries) - RESULTS_MAX_PER_SESSION)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+def _is_default_index(df):
+    index = df.index
+    return isinstance(index, pd.RangeIndex) and index.start == 0 and index.step == 1 and index.name is None
+
+
+def _result_path(session_path, handle):
+    if not HANDLE_PATTERN.match(handle or ''):
+        return None, None
+    directory = os.path.join(session_path, RESULTS_DIRNAME)
+    for kind, ext in (("table", ".arrow"), ("text", ".txt")):
+        path = os.path.join(directory, handle + ext)
+        if os.path.exists(path):
+            return kind, path
+    return None, None
+
+
+def read_page(session_path, handle, offset=0, limit=100, fmt='json'):
+    """读取结果的一页；返回 (内容, MIME 类型)，结果不存在时返回 (None, None)。
+
+    表格按行分页，fmt='arrow' 时返回 Arrow IPC 流，否则返回紧凑 JSON（列名 + 行数组）；
+    文本按行分页。
+    """
+    kind, path = _result_path(session_path, handle)
+    if kind is None:
+        return None, None
+    offset, limit = max(0, int(offset)), max(1, min(int(limit), PAGE_MAX_ROWS))
+    if kind == "text":
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        page = {"kind": "text", "offset": offset, "total_lines": len(lines), "lines": lines[offset:offset + limit]}
+        return json.dumps(page, ensure_ascii=False), 'application/json'
+
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        page_table = table.slice(offset, limit)
+        if fmt == 'arrow':
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, page_table.schema) as writer:
+                writer.write_table(page_table)
+            return sink.getvalue().to_pybytes(), 'application/vnd.apache.arrow.stream'
+        rows = [list(row) for row in zip(*(column.to_pylist() for column in page_table.columns))]
+        page = {
+            "kind": "table", "offset": offset, "total_rows": table.num_rows,
+            "columns": table.column_names, "rows": rows,
+        }
+    return json.dumps(page, ensure_ascii=False, default=str), 'application/json'
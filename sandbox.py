@@ -0,0 +1,492 @@
+# sandbox.py
+
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import re
+import signal
+import threading
+import traceback
+from contextlib import redirect_stdout
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+import plotting
+from shared_frames import attach, new_version, pickle_handle, write_frame
+
+try:
+    import resource
+except ImportError:  # Windows 下没有 resource 模块，只能依赖超时终止
+    resource = None
+
+
+class CpuTimeExceeded(Exception):
+    pass
+
+
+def _digest(buffer):
+    return hashlib.blake2b(buffer, digest_size=16).hexdigest()
+
+
+def _array_tokens(array):
+    """单个底层数组的指纹片段列表。
+
+    不可变数组（只读 numpy 数组、Arrow 数组）直接以对象本身作为片段，比较标识即可，代价与数据量无关；
+    可写数组退回到内容哈希。
+    """
+    if isinstance(array, np.ndarray):
+        if not array.flags.writeable:
+            return [("ref", array)]
+        if array.dtype != object:
+            return [("hash", _digest(np.ascontiguousarray(array).view(np.uint8)))]
+        try:
+            return [("hash", _digest(pd.util.hash_array(array.ravel()).tobytes()))]
+        except TypeError:
+            # 含有不可哈希的单元格（列表、几何对象等）时退化为对象标识
+            return [("ref", array)]
+    if isinstance(array, pd.Categorical):
+        return [("ref", array.dtype)] + _array_tokens(array._codes)
+    if hasattr(array, '_pa_array'):
+        # Arrow 数组本身不可变，写入时 pandas 会替换 _pa_array
+        return [("ref", array._pa_array)]
+    try:
+        return [("hash", _digest(pd.util.hash_array(np.asarray(array, dtype=object)).tobytes()))]
+    except (TypeError, ValueError):
+        return [("ref", array)]
+
+
+class FrameFingerprint:
+    """DataFrame 指纹，用于检测用户代码是否修改了数据。
+
+    按底层数组分别计算：只读挂载的列比较对象标识，只有可写的列才需要计算内容哈希。
+    """
+
+    __slots__ = ("meta", "tokens")
+
+    def __init__(self, df):
+        self.meta = (df.shape, tuple(str(c) for c in df.columns), tuple(str(t) for t in df.dtypes))
+        arrays = getattr(getattr(df, '_mgr', None), 'arrays', None)
+        if arrays is None:
+            arrays = [df[col].array for col in df.columns]
+        # Index 对象不可变，原地修改索引只能通过替换它实现
+        self.tokens = [("ref", df.index)]
+        for array in arrays:
+            self.tokens.extend(_array_tokens(array))
+
+    def __eq__(self, other):
+        if not isinstance(other, FrameFingerprint) or self.meta != other.meta:
+            return False
+        if len(self.tokens) != len(other.tokens):
+            return False
+        for (kind, value), (other_kind, other_value) in zip(self.tokens, other.tokens):
+            if kind != other_kind:
+                return False
+            if kind == "ref" and value is not other_value:
+                return False
+            if kind == "hash" and value != other_value:
+                return False
+        return True
+
+
+def frame_fingerprint(df):
+    return FrameFingerprint(df)
+
+
+def _exec(code, exec_globals, kind):
+    try:
+        exec(code, exec_globals)
+    except CpuTimeExceeded:
+        return "[CpuTimeExceeded] 代码执行超出 CPU 时间限制"
+    except MemoryError:
+        return "[MemoryError] 代码执行超出内存限制"
+    except Exception as e:
+        if kind == "plot":
+            traceback.print_exc()
+        return f"[{type(e).__name__}] {e}"
+    return None
+
+
+def _exec_plot(code, exec_globals, save_path):
+    """执行绘图代码：抽样超大的散点序列，未保存时自动保存当前图表，最后关闭所有图表。
+
+    返回 (错误信息, 处理说明列表)。
+    """
+    with plotting.PYPLOT_LOCK:
+        plt.close('all')
+        try:
+            with plotting.scatter_downsampling() as notes:
+                error = _exec(code, exec_globals, "plot")
+            drawn = [plt.figure(num) for num in plt.get_fignums() if plt.figure(num).axes]
+            if error is None and save_path and not os.path.exists(save_path) and drawn:
+                drawn[-1].savefig(save_path)
+                notes.append("代码未调用 savefig，已自动保存最后绘制的图表。")
+            return error, notes
+        finally:
+            # 用户代码常常忘记 plt.close()，这里强制关闭，避免图表在进程中累积
+            plt.close('all')
+
+
+def execute_code(code, frames, kind, save_path=None, fingerprints=None):
+    """在当前进程中执行代码。
+
+    frames 是可被代码原地修改的 DataFrame 字典；返回输出、错误以及被修改/删除的 DataFrame。
+    fingerprints 保存上一次执行后的指纹，调用方可以跨调用复用以避免重复计算。
+    """
+    if fingerprints is None:
+        fingerprints = {}
+    for name, df in frames.items():
+        if name not in fingerprints:
+            fingerprints[name] = frame_fingerprint(df)
+    before_names = set(frames)
+
+    exec_globals = {"dataframes": frames, "pd": pd, "np": np}
+    if kind == "plot":
+        exec_globals.update({"plt": plt, "save_path": save_path})
+    exec_globals.update(frames)
+
+    output, notes = io.StringIO(), []
+    with redirect_stdout(output):
+        if kind == "plot":
+            error, notes = _exec_plot(code, exec_globals, save_path)
+        else:
+            error = _exec(code, exec_globals, kind)
+
+    changed, deleted = {}, [name for name in before_names if name not in frames]
+    for name in deleted:
+        fingerprints.pop(name, None)
+    for name, df in frames.items():
+        if not isinstance(df, pd.DataFrame):
+            continue
+        fingerprint = frame_fingerprint(df)
+        if fingerprints.get(name) != fingerprint:
+            changed[name] = df
+            fingerprints[name] = fingerprint
+    return {"output": output.getvalue(), "error": error, "changed": changed, "deleted": deleted, "notes": notes}
+
+
+# --- 工作进程 ---
+
+def _current_vm_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _raise_cpu_exceeded(signum, frame):
+    raise CpuTimeExceeded()
+
+
+def _set_call_limits(cpu_seconds, memory_bytes):
+    if resource is None:
+        return
+    if cpu_seconds:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        used = math.ceil(usage.ru_utime + usage.ru_stime)
+        _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+        resource.setrlimit(resource.RLIMIT_CPU, (_within_hard(used + cpu_seconds, hard), hard))
+    vm_bytes = _current_vm_bytes()
+    if memory_bytes and vm_bytes is not None:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        resource.setrlimit(resource.RLIMIT_AS, (_within_hard(vm_bytes + memory_bytes, hard), hard))
+
+
+def _within_hard(soft, hard):
+    return soft if hard == resource.RLIM_INFINITY else min(soft, hard)
+
+
+def _clear_call_limits():
+    if resource is None:
+        return
+    for limit in (resource.RLIMIT_CPU, resource.RLIMIT_AS):
+        _, hard = resource.getrlimit(limit)
+        resource.setrlimit(limit, (hard, hard))
+
+
+def _is_read_only_error(error):
+    return bool(error) and error.startswith("[ValueError]") and "read-only" in error
+
+
+# 按位置写入已有数据的写法（df.loc[...] = ...、df.values[...] += ... 以及 inplace=True），只读挂载不支持
+_INDEXER_PATTERN = re.compile(r"\.(?:loc|iloc|at|iat|values)\s*\[|\.to_numpy\(\)\s*\[")
+_ASSIGN_AFTER_INDEX_PATTERN = re.compile(r"\]\s*(?:[-+*/%&|^]|//|\*\*)?=(?!=)")
+_INPLACE_PATTERN = re.compile(r"inplace\s*=\s*True")
+
+READ_ONLY_HINT = (
+    "提示：DataFrame 以只读方式共享挂载，不支持原地写入。代码没有自动重新执行（避免输出、文件等副作用重复发生），"
+    "已为后续执行准备好可写副本，请重新运行需要的部分。"
+)
+
+
+def _writes_in_place(code):
+    """粗略判断代码是否会原地写入 DataFrame 已有的数据。"""
+    if _INPLACE_PATTERN.search(code):
+        return True
+    return any(_INDEXER_PATTERN.search(line) and _ASSIGN_AFTER_INDEX_PATTERN.search(line) for line in code.splitlines())
+
+
+def _make_writable(frames, handles, writable, names):
+    """把只读挂载的 DataFrame 换成可写副本；返回换过的名称。"""
+    swapped = []
+    for name in names:
+        handle = handles.get(name)
+        if handle is None or handle["kind"] != "arrow" or name in writable:
+            continue
+        frames[name] = attach(handle, writable=True)
+        writable.add(name)
+        swapped.append(name)
+    return swapped
+
+
+def _run_with_limits(message, frames, fingerprints):
+    _set_call_limits(message["cpu_seconds"], message["memory_bytes"])
+    try:
+        return execute_code(message["code"], frames, message["kind"], message.get("save_path"), fingerprints)
+    finally:
+        _clear_call_limits()
+
+
+def _worker_main(conn):
+    """工作进程主循环：挂载各会话的 DataFrame 并执行代码。"""
+    if hasattr(signal, 'SIGXCPU'):
+        signal.signal(signal.SIGXCPU, _raise_cpu_exceeded)
+    sessions = {}
+    handles = {}
+    fingerprints = {}
+    writables = {}  # session_id -> 当前挂载为可写副本的 DataFrame 名称
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        command = message["command"]
+        for session_id in message.get("drop_sessions", ()):
+            sessions.pop(session_id, None)
+            handles.pop(session_id, None)
+            fingerprints.pop(session_id, None)
+            writables.pop(session_id, None)
+        if command == "exec":
+            session_id = message["session_id"]
+            frames = sessions.setdefault(session_id, {})
+            session_handles = handles.setdefault(session_id, {})
+            session_fingerprints = fingerprints.setdefault(session_id, {})
+            session_writable = writables.setdefault(session_id, set())
+            for name in list(frames):
+                if name not in message["names"]:
+                    frames.pop(name)
+                    session_handles.pop(name, None)
+                    session_fingerprints.pop(name, None)
+                    session_writable.discard(name)
+            for name, handle in message["updates"].items():
+                frames[name] = attach(handle)
+                session_handles[name] = handle
+                session_fingerprints.pop(name, None)
+                session_writable.discard(name)
+
+            code = message["code"]
+            if _writes_in_place(code):
+                # 会原地写入时，执行前先把代码中提到的 DataFrame 换成可写副本
+                for name in _make_writable(frames, session_handles, session_writable, [n for n in session_handles if n in code]):
+                    session_fingerprints.pop(name, None)
+            result = _run_with_limits(message, frames, session_fingerprints)
+            if _is_read_only_error(result["error"]):
+                # 未识别出的原地写入：不重新执行（副作用会发生两次），换成可写副本供下次使用并提示模型
+                swapped = _make_writable(frames, session_handles, session_writable, list(session_handles))
+                for name in swapped:
+                    session_fingerprints.pop(name, None)
+                if swapped:
+                    result["error"] = f"{result['error']}\n{READ_ONLY_HINT}"
+
+            # 修改过的 DataFrame 发布为新版本；写入共享内存后改为只读挂载，与主进程共用物理内存
+            shared_dir = message.get("shared_dir")
+            changed = {}
+            for name, df in result["changed"].items():
+                version = new_version()
+                handle = write_frame(shared_dir, name, version, df) if shared_dir else pickle_handle(version, df)
+                if handle["kind"] == "arrow":
+                    frames[name] = attach(handle)
+                    session_fingerprints[name] = frame_fingerprint(frames[name])
+                    session_writable.discard(name)
+                session_handles[name] = changed[name] = handle
+            for name in result["deleted"]:
+                session_handles.pop(name, None)
+                session_writable.discard(name)
+            result["changed"] = changed
+            conn.send(result)
+        elif command == "ping":
+            conn.send({"ok": True})
+
+
+class _Worker:
+    def __init__(self, context):
+        self._context = context
+        self.lock = threading.Lock()
+        self.sessions = {}  # session_id -> {name: version}，记录工作进程已持有的数据版本
+        self.busy_session = None
+        self._start()
+
+    def _start(self):
+        parent_conn, child_conn = self._context.Pipe()
+        self.process = self._context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.sessions = {}
+        self.pending_drops = set()
+
+    def restart(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        except Exception:
+            pass
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+        self._start()
+
+    def request(self, message, timeout):
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError()
+        return self.conn.recv()
+
+
+class SandboxPool:
+    """预热的代码执行进程池。
+
+    每个会话固定在一个工作进程上，工作进程缓存该会话的 DataFrame，只在数据版本变化时重新同步。
+    代码在工作进程中执行，受单次调用 CPU 时间、内存和超时限制，不会阻塞 Web 进程的 GIL。
+    提供 frame_store 时，DataFrame 通过共享内存中的 Arrow IPC 文件交换，管道中只传递句柄。
+    """
+
+    def __init__(self, num_workers, cpu_seconds, memory_bytes, timeout_seconds, frame_store=None):
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_bytes
+        self.timeout_seconds = timeout_seconds
+        self.frame_store = frame_store
+        context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(context) for _ in range(num_workers)]
+        self._assignments = {}
+        self._lock = threading.Lock()
+
+    def session(self, session_id):
+        return SandboxSession(self, session_id)
+
+    def _worker_for(self, session_id):
+        with self._lock:
+            worker = self._assignments.get(session_id)
+            if worker is None:
+                load = {id(w): 0 for w in self._workers}
+                for assigned in self._assignments.values():
+                    load[id(assigned)] += 1
+                worker = min(self._workers, key=lambda w: load[id(w)])
+                self._assignments[session_id] = worker
+            return worker
+
+    def drop_session(self, session_id):
+        """释放会话在工作进程中的数据；不等待工作进程，随下一次执行请求一并处理。"""
+        with self._lock:
+            worker = self._assignments.pop(session_id, None)
+            if worker is not None:
+                worker.sessions.pop(session_id, None)
+                worker.pending_drops.add(session_id)
+        if self.frame_store is not None:
+            self.frame_store.drop_session(session_id)
+
+    def execute(self, session_id, code, kind, frames, versions, save_path=None):
+        """在工作进程中执行代码。
+
+        返回的 changed 为主进程可直接使用的 DataFrame，versions 为它们在工作进程中的新版本戳。
+        已发布到共享内存的 DataFrame 会在 frames 中被替换为只读挂载版本，避免主进程再保留一份堆内存副本。
+        """
+        worker = self._worker_for(session_id)
+        with worker.lock:
+            known = worker.sessions.setdefault(session_id, {})
+            updates = {}
+            for name, df in frames.items():
+                version = versions.get(name)
+                if known.get(name) == version:
+                    continue
+                if self.frame_store is None:
+                    updates[name] = pickle_handle(version, df)
+                    continue
+                updates[name] = self.frame_store.publish(session_id, name, version, df)
+                if updates[name]["kind"] == "arrow":
+                    frames[name] = attach(updates[name])
+            message = {
+                "command": "exec", "session_id": session_id, "code": code, "kind": kind,
+                "save_path": save_path, "names": list(frames), "updates": updates,
+                "cpu_seconds": self.cpu_seconds, "memory_bytes": self.memory_bytes,
+                "shared_dir": self.frame_store.session_dir(session_id) if self.frame_store is not None else None,
+            }
+            with self._lock:
+                message["drop_sessions"] = list(worker.pending_drops)
+                worker.pending_drops.clear()
+            worker.busy_session = session_id
+            try:
+                result = worker.request(message, self.timeout_seconds)
+            except TimeoutError:
+                worker.restart()
+                return {"output": "", "error": f"[TimeoutError] 代码执行超过 {self.timeout_seconds} 秒，已终止。", "changed": {}, "deleted": [], "versions": {}}
+            except (EOFError, OSError, BrokenPipeError):
+                # 工作进程崩溃（例如被系统因内存不足终止）或被取消
+                worker.restart()
+                return {"output": "", "error": "[WorkerError] 执行进程意外终止，代码已被取消或超出资源限制。", "changed": {}, "deleted": [], "versions": {}}
+            finally:
+                worker.busy_session = None
+            known.clear()
+            known.update({name: versions.get(name) for name in frames})
+            changed, new_versions = {}, {}
+            for name, handle in result["changed"].items():
+                if self.frame_store is not None:
+                    self.frame_store.register(session_id, name, handle)
+                changed[name] = attach(handle)
+                known[name] = new_versions[name] = handle["version"]
+            for name in result["deleted"]:
+                known.pop(name, None)
+                if self.frame_store is not None:
+                    self.frame_store.forget(session_id, name)
+            result.update({"changed": changed, "versions": new_versions})
+            return result
+
+    def cancel(self, session_id):
+        """终止该会话正在执行的代码（会重启所在的工作进程）。"""
+        with self._lock:
+            worker = self._assignments.get(session_id)
+        if worker is not None and worker.busy_session == session_id:
+            try:
+                worker.process.kill()
+            except Exception:
+                pass
+            return True
+        return False
+
+    def shutdown(self):
+        for worker in self._workers:
+            try:
+                worker.process.kill()
+            except Exception:
+                pass
+
+
+class SandboxSession:
+    """绑定到单个会话的执行句柄，传给 ToolManager 使用。"""
+
+    def __init__(self, pool, session_id):
+        self.pool = pool
+        self.session_id = session_id
+
+    def execute(self, code, kind, frames, versions, save_path=None):
+        return self.pool.execute(self.session_id, code, kind, frames, versions, save_path)
+
+    def cancel(self):
+        return self.pool.cancel(self.session_id)
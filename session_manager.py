@@ -0,0 +1,301 @@
+# session_manager.py
+
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import pandas as pd
+
+from dataset_cache import read_parquet, write_parquet
+from ingest import memory_bytes
+
+SESSION_ID_PATTERN = re.compile(r'^talk-to-data-[0-9a-f-]{36}$')
+SPILL_DIRNAME = 'spill'
+MANIFEST_FILENAME = 'manifest.json'
+HISTORY_FILENAME = 'llm_history.json'
+# 换出时随会话一起保存的状态字段，其余字段视为可重建的运行时缓存
+PERSISTED_STATE_KEYS = ("plots", "telemetry", "versions", "sources")
+
+
+class SessionManager:
+    """带内存预算的会话存储。
+
+    会话按最近使用顺序排列；超过全局内存预算或空闲超时的会话会被换出到磁盘
+    （DataFrame 写为 Parquet，LLM 历史写为 JSON），下次 get_session 时透明地重新加载。
+    正在处理请求的会话（acquire 之后）不会被换出。
+
+    换出和重新加载的文件读写在管理器的锁之外进行：锁内只把会话标记为 spilling/loading 并取下其状态，
+    其他会话的 get_session 和 release 不会被大会话的磁盘 I/O 阻塞；访问同一会话的请求等待 I/O 完成。
+    """
+
+    def __init__(self, sessions_folder, memory_budget_bytes, idle_ttl_seconds):
+        self.sessions_folder = sessions_folder
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.sessions = OrderedDict()
+        self._lock = threading.RLock()
+        # 会话的换出或加载完成时通知等待者
+        self._io_done = threading.Condition(self._lock)
+        self._evict_listeners = []
+
+    def create_session(self):
+        session_id = f"talk-to-data-{uuid.uuid4()}"
+        session_path = os.path.join(self.sessions_folder, session_id)
+        plot_path = os.path.join(session_path, 'plots')
+        upload_path = os.path.join(session_path, 'uploads')
+        os.makedirs(plot_path, exist_ok=True)
+        os.makedirs(upload_path, exist_ok=True)
+
+        session = self._new_session_record(session_id)
+        session.update({
+            "state": {"dataframes": {}, "plots": []},
+            "llm_history": [],
+        })
+        with self._lock:
+            self.sessions[session_id] = session
+        self._enforce_limits(keep=session_id)
+        return session
+
+    def get_session(self, session_id, acquire=False):
+        """取得会话（必要时从磁盘重新加载）；acquire=True 时同时固定该会话。"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = self._discover_spilled_session(session_id)
+                if session is None:
+                    return None
+                self.sessions[session_id] = session
+            while session["transition"] is not None:
+                # 其他线程正在换出或加载这个会话
+                self._io_done.wait()
+            loading = session["spilled"]
+            if loading:
+                session["transition"] = "loading"
+            else:
+                self._touch(session, acquire)
+        if loading:
+            self._rehydrate(session, acquire)
+        self._enforce_limits(keep=session_id)
+        return session
+
+    def remove_session(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        self._notify_evicted(session_id)
+        return session
+
+    def add_evict_listener(self, callback):
+        """注册回调：会话被换出或删除时调用 callback(session_id)，用于释放其它地方持有的副本。"""
+        self._evict_listeners.append(callback)
+
+    def _notify_evicted(self, session_id):
+        for callback in self._evict_listeners:
+            try:
+                callback(session_id)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+
+    def acquire(self, session):
+        """标记会话正在使用，期间不会被换出。"""
+        with self._lock:
+            session["active"] += 1
+        return session
+
+    def release(self, session):
+        # 会话仍被固定（active > 0），不会被换出；memory_usage(deep=True) 可能需要扫描全部数据，在锁外计算
+        state, llm_history = session["state"], session["llm_history"]
+        memory = self._state_bytes(state, llm_history) if state is not None else None
+        with self._lock:
+            session["active"] = max(0, session["active"] - 1)
+            session["last_access"] = time.time()
+            if memory is not None and not session["spilled"]:
+                session["memory_bytes"] = memory
+        self._enforce_limits()
+
+    @contextmanager
+    def pinned(self, session):
+        self.acquire(session)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def sweep(self):
+        """换出空闲超时的会话；由后台线程定期调用。"""
+        self._enforce_limits()
+
+    def start_reaper(self, interval_seconds=60):
+        def _loop():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.sweep()
+                except Exception:
+                    import traceback
+                    traceback.print_exc()
+
+        thread = threading.Thread(target=_loop, name="session-reaper", daemon=True)
+        thread.start()
+        return thread
+
+    # --- 内部实现 ---
+
+    def _new_session_record(self, session_id):
+        session_path = os.path.join(self.sessions_folder, session_id)
+        return {
+            "id": session_id,
+            "session_path": session_path,
+            "plot_path": os.path.join(session_path, 'plots'),
+            "upload_path": os.path.join(session_path, 'uploads'),
+            "state": None,
+            "llm_history": None,
+            "spilled": False,
+            # None，或正在进行的磁盘 I/O："spilling" / "loading"
+            "transition": None,
+            "active": 0,
+            "memory_bytes": 0,
+            "last_access": time.time(),
+        }
+
+    @staticmethod
+    def _state_bytes(state, llm_history):
+        # 其他请求可能同时增删 DataFrame 或消息，先复制一份再遍历
+        total = sum(memory_bytes(df) for df in list(state["dataframes"].values()))
+        total += sum(len(str(msg.get("content", ""))) for msg in list(llm_history))
+        return total
+
+    def _touch(self, session, acquire):
+        session["last_access"] = time.time()
+        if acquire:
+            session["active"] += 1
+        if self.sessions.get(session["id"]) is session:
+            self.sessions.move_to_end(session["id"])
+
+    def _enforce_limits(self, keep=None):
+        """换出空闲超时或超出内存预算的会话；必须在不持有锁时调用。"""
+        with self._lock:
+            jobs = [self._begin_spill(session) for session in self._select_spills(keep)]
+        for session, state, llm_history in jobs:
+            self._spill(session, state, llm_history)
+
+    def _select_spills(self, keep):
+        now = time.time()
+        candidates = [
+            s for sid, s in self.sessions.items()
+            if sid != keep and not s["spilled"] and s["transition"] is None and s["active"] == 0
+        ]
+        selected = {s["id"]: s for s in candidates if now - s["last_access"] > self.idle_ttl_seconds}
+
+        total = sum(s["memory_bytes"] for sid, s in self.sessions.items() if not s["spilled"] and sid not in selected)
+        # OrderedDict 的顺序即最近使用顺序，从最久未用的开始换出
+        for session in candidates:
+            if total <= self.memory_budget_bytes:
+                break
+            if session["id"] in selected:
+                continue
+            total -= session["memory_bytes"]
+            selected[session["id"]] = session
+        return list(selected.values())
+
+    def _begin_spill(self, session):
+        """（持有锁）标记会话正在换出并取下其状态，之后的写盘在锁外进行。"""
+        state, llm_history = session["state"], session["llm_history"]
+        session["transition"] = "spilling"
+        session["spilled"] = True
+        session["state"] = None
+        session["llm_history"] = None
+        return session, state, llm_history
+
+    def _spill_dir(self, session):
+        return os.path.join(session["session_path"], SPILL_DIRNAME)
+
+    def _spill(self, session, state, llm_history):
+        spill_dir = self._spill_dir(session)
+        manifest = {"dataframes": {}, "state": {k: state[k] for k in PERSISTED_STATE_KEYS if k in state}}
+        try:
+            os.makedirs(spill_dir, exist_ok=True)
+            for index, (name, df) in enumerate(state["dataframes"].items()):
+                filename = f"df_{index}.parquet"
+                try:
+                    write_parquet(df, os.path.join(spill_dir, filename))
+                except Exception:
+                    # Arrow 无法表示的混合类型列（通常来自用户代码）退回到 pickle
+                    filename = f"df_{index}.pkl"
+                    df.to_pickle(os.path.join(spill_dir, filename))
+                manifest["dataframes"][name] = filename
+            with open(os.path.join(spill_dir, HISTORY_FILENAME), 'w', encoding='utf-8') as f:
+                json.dump(llm_history, f, ensure_ascii=False)
+            with open(os.path.join(spill_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+                json.dump(manifest, f, ensure_ascii=False, default=str)
+            spilled = True
+        except Exception:
+            # 换出失败时保留在内存中，下次再试
+            import traceback
+            traceback.print_exc()
+            shutil.rmtree(spill_dir, ignore_errors=True)
+            spilled = False
+        with self._lock:
+            if spilled:
+                session["memory_bytes"] = 0
+            else:
+                session["state"], session["llm_history"], session["spilled"] = state, llm_history, False
+            session["transition"] = None
+            self._io_done.notify_all()
+            removed = self.sessions.get(session["id"]) is not session
+        if removed:
+            # 写盘期间会话已被删除
+            shutil.rmtree(spill_dir, ignore_errors=True)
+        elif spilled:
+            self._notify_evicted(session["id"])
+        return spilled
+
+    def _rehydrate(self, session, acquire):
+        """从换出文件加载会话（调用前已在锁内标记为 loading）。"""
+        spill_dir = self._spill_dir(session)
+        try:
+            with open(os.path.join(spill_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            with open(os.path.join(spill_dir, HISTORY_FILENAME), 'r', encoding='utf-8') as f:
+                llm_history = json.load(f)
+            dataframes = {}
+            for name, filename in manifest["dataframes"].items():
+                path = os.path.join(spill_dir, filename)
+                if filename.endswith('.pkl'):
+                    dataframes[name] = pd.read_pickle(path)
+                else:
+                    dataframes[name], _ = read_parquet(path)
+        except Exception:
+            with self._lock:
+                session["transition"] = None
+                self._io_done.notify_all()
+            raise
+        state = {"dataframes": dataframes, "plots": []}
+        state.update(manifest.get("state", {}))
+        memory = self._state_bytes(state, llm_history)
+        # 仍处于 loading 状态时删除换出文件，避免删掉之后再次换出写入的文件
+        shutil.rmtree(spill_dir, ignore_errors=True)
+        with self._lock:
+            session["state"] = state
+            session["llm_history"] = llm_history
+            session["spilled"] = False
+            session["memory_bytes"] = memory
+            session["transition"] = None
+            self._io_done.notify_all()
+            self._touch(session, acquire)
+
+    def _discover_spilled_session(self, session_id):
+        """进程重启后，从磁盘上的换出文件恢复会话。"""
+        if not SESSION_ID_PATTERN.match(session_id):
+            return None
+        session = self._new_session_record(session_id)
+        if not os.path.exists(os.path.join(self._spill_dir(session), MANIFEST_FILENAME)):
+            return None
+        session["spilled"] = True
+        return session
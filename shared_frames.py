@@ -0,0 +1,138 @@
+# shared_frames.py
+
+import os
+import re
+import shutil
+import threading
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+
+
+def new_version():
+    """生成 DataFrame 版本戳；数据被替换或修改时都会换用新的版本戳。"""
+    return uuid.uuid4().hex[:12]
+
+
+def _shm_usable(min_free_bytes):
+    if not (os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK)):
+        return False
+    try:
+        return shutil.disk_usage('/dev/shm').free >= min_free_bytes
+    except OSError:
+        return False
+
+
+def default_shared_root(fallback_dir, min_free_bytes=0):
+    """优先使用 /dev/shm（Linux 共享内存），否则退回到磁盘目录（依赖系统页缓存共享）。
+
+    /dev/shm 剩余空间不足 min_free_bytes 时（例如 Docker 默认只有 64 MB）同样使用磁盘目录。
+    """
+    base = '/dev/shm' if _shm_usable(min_free_bytes) else fallback_dir
+    return os.path.join(base, f'talk-to-data-{os.getpid()}')
+
+
+def attach(handle, writable=False):
+    """挂载已发布的 DataFrame。
+
+    只读模式下数值列直接引用内存映射的 Arrow 缓冲区，不复制数据；
+    writable=True 时复制出可原地修改的普通 DataFrame。
+    """
+    if handle["kind"] == "pickle":
+        return handle["df"]
+    source = pa.memory_map(handle["path"], 'r')
+    table = pa.ipc.open_file(source).read_all()
+    if writable:
+        return table.to_pandas()
+    return table.to_pandas(split_blocks=True)
+
+
+class SharedFrameStore:
+    """DataFrame 的 Arrow IPC 数据平面。
+
+    每个 (会话, DataFrame, 版本) 只发布一次，写为 Arrow IPC 文件；
+    工作进程通过内存映射只读挂载，因此每次工具调用的同步开销与数据量无关。
+    数据被修改后发布为新版本文件，旧版本文件随即删除。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._published = {}  # (session_id, name) -> handle
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def publish(self, session_id, name, version, df):
+        key = (session_id, name)
+        with self._lock:
+            handle = self._published.get(key)
+            if handle is not None and handle["version"] == version:
+                return handle
+        handle = write_frame(self.session_dir(session_id), name, version, df)
+        self.register(session_id, name, handle)
+        return handle
+
+    def register(self, session_id, name, handle):
+        """登记某个 DataFrame 当前发布的版本（也用于登记工作进程发布的新版本）。"""
+        with self._lock:
+            previous = self._published.get((session_id, name))
+            self._published[(session_id, name)] = handle
+        if previous is not None and previous.get("path") and previous.get("path") != handle.get("path"):
+            _remove_quietly(previous["path"])
+
+    def forget(self, session_id, name):
+        with self._lock:
+            previous = self._published.pop((session_id, name), None)
+        if previous is not None and previous.get("path"):
+            _remove_quietly(previous["path"])
+
+    def drop_session(self, session_id):
+        with self._lock:
+            for key in [k for k in self._published if k[0] == session_id]:
+                self._published.pop(key)
+        shutil.rmtree(self.session_dir(session_id), ignore_errors=True)
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def session_dir(self, session_id):
+        return os.path.join(self.root, session_id)
+
+
+def write_frame(directory, name, version, df):
+    """把 DataFrame 写为 Arrow IPC 文件并返回句柄；Arrow 无法无损表示或写入失败时退回为 pickle 传输。"""
+    # GeoDataFrame 等子类以及非字符串列名经过 Arrow 往返后会丢失类型信息
+    if type(df) is not pd.DataFrame or not all(isinstance(c, str) for c in df.columns):
+        return pickle_handle(version, df)
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowException, TypeError, ValueError):
+        # 混合类型的 object 列
+        return pickle_handle(version, df)
+    safe_name = re.sub(r'[^\w.-]', '_', str(name))
+    path = os.path.join(directory, f"{safe_name}-{version}.arrow")
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+    except OSError:
+        # 空间不足（ENOSPC）等写入错误：删除写了一半的临时文件，避免持续占用共享内存
+        _remove_quietly(tmp_path)
+        return pickle_handle(version, df)
+    return {"kind": "arrow", "version": version, "path": path}
+
+
+def pickle_handle(version, df):
+    """不经过共享内存、直接随管道消息传输的句柄。"""
+    return {"kind": "pickle", "version": version, "df": df}
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        # Windows 下仍被映射的文件无法删除，留待会话清理时处理
+        pass
@@ -0,0 +1,149 @@
+# sql_engine.py
+
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+SQL_BATCH_ROWS = 1000
+# 单次查询最多取回的行数
+SQL_MAX_ROWS = int(os.environ.get('TTD_SQL_MAX_ROWS', 100_000))
+SQL_PREVIEW_ROWS = 50
+SQLITE_CHUNK_ROWS = 50_000
+VERSIONS_TABLE = "_ttd_versions"
+
+ENGINE = "duckdb" if duckdb is not None else "sqlite"
+# 查询本身出错（语法错误、表不存在等）时引发的异常
+SQL_ERRORS = (sqlite3.Error,) + ((duckdb.Error,) if duckdb is not None else ())
+
+_path_locks = {}
+_path_locks_guard = threading.Lock()
+
+
+def database_path(session_path):
+    return os.path.join(session_path, "session.duckdb" if ENGINE == "duckdb" else "session.sqlite")
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+READ_ONLY_HINT = "DataFrame 对应的表是只读的；如需修改，请用 CREATE TABLE ... AS SELECT 建立新表，或用 run_python_code 修改 DataFrame"
+_SQLITE_WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE, sqlite3.SQLITE_DROP_TABLE)
+
+
+def _sqlite_authorizer(protected):
+    """禁止 ATTACH 等访问会话数据库以外文件的操作，以及修改从 DataFrame 同步来的表（否则表与 DataFrame 不再一致，
+    而版本戳仍显示已同步）。protected 为小写的表名集合。"""
+    def authorize(action, arg1, arg2, db_name, trigger):
+        if action in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+            return sqlite3.SQLITE_DENY
+        if action in _SQLITE_WRITE_ACTIONS and str(arg1).lower() in protected:
+            return sqlite3.SQLITE_DENY
+        if action == sqlite3.SQLITE_ALTER_TABLE and str(arg2).lower() in protected:
+            return sqlite3.SQLITE_DENY
+        return sqlite3.SQLITE_OK
+    return authorize
+
+
+class SessionDatabase:
+    """会话级的嵌入式 SQL 数据库，保存在会话目录下。
+
+    安装了 DuckDB 时把每个 DataFrame 注册为视图（直接读取 pandas 内存，不复制），并关闭对外部文件的访问；
+    否则使用 SQLite：DataFrame 按版本戳复制成表，未修改的表在后续查询（以及进程重启后）直接复用；
+    这些表只读，修改它们的语句会被拒绝。用户用 CREATE TABLE 建立的表会一直保存在数据库文件中。
+    """
+
+    def __init__(self, path, state):
+        self.path = path
+        self.state = state
+
+    def _connect(self):
+        if ENGINE == "duckdb":
+            connection = duckdb.connect(self.path)
+            for name, df in self.state["dataframes"].items():
+                connection.register(name, df)
+            connection.execute("SET enable_external_access = false")
+            return connection
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._sync_sqlite(connection)
+        protected = {str(name).lower() for name in self.state["dataframes"]} | {VERSIONS_TABLE}
+        connection.set_authorizer(_sqlite_authorizer(protected))
+        return connection
+
+    def _lock(self):
+        # 数据库文件同一时刻只允许一个连接写入；同一会话的查询串行执行
+        with _path_locks_guard:
+            return _path_locks.setdefault(self.path, threading.Lock())
+
+    def _sync_sqlite(self, connection):
+        """把版本戳有变化的 DataFrame 复制到 SQLite，并删除已不存在的表。"""
+        connection.execute(f"CREATE TABLE IF NOT EXISTS {VERSIONS_TABLE} (name TEXT PRIMARY KEY, version TEXT)")
+        synced = dict(connection.execute(f"SELECT name, version FROM {VERSIONS_TABLE}").fetchall())
+        versions = self.state["versions"]
+        for name, df in self.state["dataframes"].items():
+            if synced.get(name) == versions.get(name):
+                continue
+            try:
+                df.to_sql(name, connection, if_exists="replace", index=False, chunksize=SQLITE_CHUNK_ROWS)
+            except Exception:
+                # 含有 SQLite 无法保存的对象列时跳过，查询该表会报“表不存在”
+                connection.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+                connection.execute(f"DELETE FROM {VERSIONS_TABLE} WHERE name = ?", (name,))
+                continue
+            connection.execute(f"INSERT OR REPLACE INTO {VERSIONS_TABLE} VALUES (?, ?)", (name, versions.get(name)))
+        for name in synced:
+            if name not in self.state["dataframes"]:
+                connection.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+                connection.execute(f"DELETE FROM {VERSIONS_TABLE} WHERE name = ?", (name,))
+        connection.commit()
+
+    def execute(self, sql, max_rows):
+        """执行 SQL，分批取回最多 max_rows 行。
+
+        返回 {"columns", "rows", "truncated", "seconds"}；不返回结果集的语句 columns 为空。
+        """
+        with self._lock():
+            connection = self._connect()
+            try:
+                start_time = time.perf_counter()
+                cursor = connection.cursor()
+                try:
+                    cursor.execute(sql)
+                except sqlite3.DatabaseError as e:
+                    if "not authorized" in str(e):
+                        raise sqlite3.DatabaseError(f"{e}（{READ_ONLY_HINT}）") from e
+                    raise
+                columns = [d[0] for d in cursor.description] if cursor.description else []
+                rows, truncated = [], False
+                while columns:
+                    batch = cursor.fetchmany(SQL_BATCH_ROWS)
+                    if not batch:
+                        break
+                    if len(rows) + len(batch) > max_rows:
+                        rows.extend(batch[:max_rows - len(rows)])
+                        truncated = True
+                        break
+                    rows.extend(batch)
+                connection.commit()
+                return {"columns": columns, "rows": rows, "truncated": truncated,
+                        "seconds": time.perf_counter() - start_time}
+            finally:
+                connection.close()
+
+    def explain(self, sql):
+        """返回 (执行计划文本, 查询耗时秒数)。
+
+        DuckDB 使用 EXPLAIN ANALYZE，计划中带有各算子的耗时；SQLite 只给出查询计划，耗时通过实际执行一次得到。
+        """
+        if ENGINE == "duckdb":
+            result = self.execute(f"EXPLAIN ANALYZE {sql}", SQL_MAX_ROWS)
+            return "\n".join(str(row[-1]) for row in result["rows"]), result["seconds"]
+        plan = self.execute(f"EXPLAIN QUERY PLAN {sql}", SQL_MAX_ROWS)
+        text = "\n".join(f"{'  ' if row[1] else ''}{row[-1]}" for row in plan["rows"])
+        return text, self.execute(sql, SQL_MAX_ROWS)["seconds"]
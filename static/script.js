@@ -194,7 +194,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const downloadLightboxImage = () => {
         const a = document.createElement('a');
         a.href = lightboxState.lastSrc;
-        a.download = `talk-to-data-chart-${Date.now()}.png`;
+        const extension = (lightboxState.lastSrc.split('?')[0].match(/\.(\w+)$/) || [null, 'png'])[1];
+        a.download = `talk-to-data-chart-${Date.now()}.${extension}`;
         document.body.appendChild(a);
         a.click();
         document.body.removeChild(a);
@@ -207,8 +208,9 @@ document.addEventListener('DOMContentLoaded', () => {
     };
 
     const openLightbox = (imgElement) => {
-        lightboxState.lastSrc = imgElement.src;
-        ui.lightboxImg.src = imgElement.src;
+        const src = imgElement.dataset.fullSrc || imgElement.src;
+        lightboxState.lastSrc = src;
+        ui.lightboxImg.src = src;
         ui.imageLightbox.classList.remove('hidden');
         resetLightbox(); // Reset view every time a new image is opened
     };
@@ -312,7 +314,7 @@ document.addEventListener('DOMContentLoaded', () => {
         let formattedContent, isHtml = false;
         
         if (type === 'action') {
-            formattedContent = renderActionCard(content);
+            formattedContent = renderActionCard(content, data.cache);
             isHtml = true;
         } else if (type === 'evaluation') {
             formattedContent = renderEvaluation(content);
@@ -320,9 +322,15 @@ document.addEventListener('DOMContentLoaded', () => {
         } else if (type === 'observation' && typeof content === 'string' && content.includes('<div class="table-wrapper">')) {
             formattedContent = content;
             isHtml = true;
+        } else if (type === 'observation' && typeof content === 'string' && content.includes('交互式图表已生成并保存于:')) {
+            const path = content.split(':').pop().trim();
+            formattedContent = `<p>交互式图表已生成，可缩放、悬停查看数值。</p><div class="interactive-plot" data-spec-src="${path}"></div>`;
+            isHtml = true;
         } else if (type === 'observation' && typeof content === 'string' && content.includes('图表已生成并保存于:')) {
             const path = content.split(':').pop().trim();
-            formattedContent = `<p>图表已生成。点击可放大查看。</p><img src="${path}" alt="生成的图表" class="generated-plot-img" style="max-width: 100%; border-radius: 8px;">`;
+            // 消息中显示缩略图，放大查看时再加载原图
+            const thumbPath = path.replace('/plots/', '/thumbs/');
+            formattedContent = `<p>图表已生成。点击可放大查看。</p><img src="${thumbPath}" data-full-src="${path}" loading="lazy" alt="生成的图表" class="generated-plot-img" style="max-width: 100%; border-radius: 8px;">`;
             isHtml = true;
         } else if (type === 'system' && typeof content === 'string') {
             formattedContent = content.replace(/'([^']+\.[a-zA-Z0-9]+)'/g, '<code class="file-tag">$1</code>');
@@ -337,8 +345,80 @@ document.addEventListener('DOMContentLoaded', () => {
         }
 
         renderContent(contentWrapper, formattedContent, isHtml);
+        contentWrapper.querySelectorAll('.interactive-plot').forEach(renderInteractivePlot);
+        if (type === 'observation' && Array.isArray(data.results) && currentSessionId) renderResultPagers(contentWrapper, data.results, currentSessionId);
         if (type === 'evaluation') ui.exportBtn.classList.remove('hidden');
     };
+
+    const renderInteractivePlot = async (container) => {
+        if (!window.Plotly) { container.textContent = '无法加载 Plotly，交互式图表不可用。'; return; }
+        try {
+            const response = await fetch(container.dataset.specSrc);
+            if (!response.ok) throw new Error(response.status);
+            const figure = await response.json();
+            await Plotly.newPlot(container, figure.data, figure.layout, { responsive: true, displaylogo: false });
+        } catch (error) {
+            container.textContent = `加载交互式图表失败: ${error.message}`;
+        }
+    };
+
+    // 完整结果保存在服务端，观察消息中只有预览；按需分页加载其余内容
+    const RESULT_PAGE_SIZE = 200;
+    const renderResultPagers = (container, results, sessionId) => {
+        results.forEach(meta => {
+            const isTable = meta.kind === 'table';
+            const total = isTable ? meta.total_rows : meta.total_lines;
+            let offset = isTable ? 0 : (meta.preview_lines || 0);
+            const pager = document.createElement('div');
+            pager.className = 'result-pager';
+            const output = document.createElement(isTable ? 'div' : 'pre');
+            if (isTable) output.className = 'table-wrapper';
+            const button = document.createElement('button');
+            button.className = 'btn tertiary result-more-btn';
+            const updateButton = () => {
+                button.textContent = isTable && offset === 0 ? `查看完整结果（共 ${total} 行）` : `加载更多（${Math.min(offset, total)} / ${total}）`;
+                button.disabled = offset >= total;
+            };
+            button.addEventListener('click', async () => {
+                button.disabled = true;
+                try {
+                    const response = await fetch(`/results/${encodeURIComponent(sessionId)}/${encodeURIComponent(meta.handle)}?offset=${offset}&limit=${RESULT_PAGE_SIZE}`);
+                    if (!response.ok) { const err = await response.json().catch(() => ({})); throw new Error(err.error || response.status); }
+                    const page = await response.json();
+                    if (isTable) {
+                        appendTableRows(output, page);
+                        offset += page.rows.length;
+                    } else {
+                        output.textContent += page.lines.join('\n') + '\n';
+                        offset += page.lines.length;
+                    }
+                } catch (error) {
+                    button.textContent = `加载失败: ${error.message}`;
+                    return;
+                }
+                updateButton();
+            });
+            updateButton();
+            pager.append(output, button);
+            container.appendChild(pager);
+        });
+    };
+
+    const appendTableRows = (wrapper, page) => {
+        let table = wrapper.querySelector('table');
+        if (!table) {
+            table = document.createElement('table');
+            table.className = 'data-table';
+            const header = table.createTHead().insertRow();
+            page.columns.forEach(name => { const th = document.createElement('th'); th.textContent = name; header.appendChild(th); });
+            table.createTBody();
+            wrapper.appendChild(table);
+        }
+        page.rows.forEach(row => {
+            const tr = table.tBodies[0].insertRow();
+            row.forEach(value => { tr.insertCell().textContent = value === null ? '' : String(value); });
+        });
+    };
     
     const getStatusTextForType = (type, content = '') => {
         switch(type) {
@@ -399,6 +479,7 @@ document.addEventListener('DOMContentLoaded', () => {
             const reader = response.body.getReader();
             const decoder = new TextDecoder();
             let buffer = "";
+            let streamingThought = null;
             while (true) {
                 const { done, value } = await reader.read();
                 if (done) break;
@@ -411,7 +492,25 @@ document.addEventListener('DOMContentLoaded', () => {
                             const data = JSON.parse(part.substring(6));
                             if (data.type === 'progress') {
                                 currentProgress.percent = data.value;
+                            } else if (data.type === 'evaluation_pending') {
+                                // 评估在后台进行，流已结束，稍后轮询获取结果
+                                pollEvaluation(data.content.session_id, data.content.job_id);
+                                currentProgress.text = "正在评估...";
+                            } else if (data.type === 'thought_delta') {
+                                if (!streamingThought) {
+                                    const bubble = createBubble(`<div class="content-wrapper"><h3>${icons.thought} 思考</h3><div class="streaming-text"></div></div>`, 'thought-message', true);
+                                    streamingThought = { bubble, textEl: bubble.querySelector('.streaming-text'), text: '' };
+                                }
+                                streamingThought.text += data.content;
+                                streamingThought.textEl.textContent = streamingThought.text.trimStart();
+                                currentProgress.text = getStatusTextForType('thought');
+                                scrollToBottom();
                             } else {
+                                if (streamingThought) {
+                                    // 完整的思考内容会以 thought 消息重新渲染
+                                    streamingThought.bubble.remove();
+                                    streamingThought = null;
+                                }
                                 const statusText = getStatusTextForType(data.type, data.content);
                                 if (statusText) {
                                     currentProgress.text = statusText;
@@ -435,6 +534,31 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
     
+    const pollEvaluation = async (sessionId, jobId) => {
+        for (let attempt = 0; attempt < 120; attempt++) {
+            await new Promise(resolve => setTimeout(resolve, 1500));
+            let job;
+            try {
+                const response = await fetch(`/evaluation/${encodeURIComponent(sessionId)}`);
+                if (response.status === 404) return;
+                job = await response.json();
+            } catch (error) { continue; }
+            if (job.job_id !== jobId) return;
+            if (job.status === 'running') continue;
+            if (job.status !== 'done') { console.error("评估失败:", job.error); return; }
+            const message = { type: 'evaluation', content: job.evaluation };
+            const session = sessions[sessionId];
+            if (!session) return;
+            if (sessionId === currentSessionId) {
+                renderMessageBubble(message, true);
+            } else {
+                session.history.push(message);
+                saveSessionsToStorage();
+            }
+            return;
+        }
+    };
+
     const resetUIForAnalysis = () => { ui.messageContainer.innerHTML = ''; ui.exportBtn.classList.add('hidden'); setFormState(false); };
     const setFormState = (enabled) => { ui.submitBtn.disabled = !enabled; ui.submitBtn.textContent = enabled ? '开始分析' : '分析中...'; ui.chatInput.disabled = !enabled; document.getElementById('send-chat-btn').disabled = !enabled; };
     const handleContextMenu = (e) => { e.preventDefault(); rightClickedElement = e.target; const menuItems = []; const selection = window.getSelection().toString().trim(); const isEditable = rightClickedElement.tagName === 'INPUT' || rightClickedElement.tagName === 'TEXTAREA'; if (window.api) { if (isEditable) { menuItems.push({ label: '剪切', action: () => { const selectedText = rightClickedElement.value.substring(rightClickedElement.selectionStart, rightClickedElement.selectionEnd); if (selectedText) { window.api.writeToClipboard(selectedText); document.execCommand('delete'); } } }); menuItems.push({ label: '复制', action: () => { const selectedText = rightClickedElement.value.substring(rightClickedElement.selectionStart, rightClickedElement.selectionEnd); if (selectedText) window.api.writeToClipboard(selectedText); } }); menuItems.push({ label: '粘贴', action: async () => { const text = await window.api.readFromClipboard(); if (text && rightClickedElement) { const start = rightClickedElement.selectionStart; const end = rightClickedElement.selectionEnd; const newText = rightClickedElement.value.substring(0, start) + text + rightClickedElement.value.substring(end); rightClickedElement.value = newText; rightClickedElement.focus(); rightClickedElement.selectionStart = rightClickedElement.selectionEnd = start + text.length; } } }); menuItems.push({ type: 'separator' }); menuItems.push({ label: '全选', action: () => rightClickedElement.select() }); } else if (selection) { menuItems.push({ label: '复制', action: () => window.api.writeToClipboard(selection) }); } else { hideContextMenu(); return; } } else { if (selection) { menuItems.push({ label: '复制 (浏览器)', action: () => document.execCommand('copy') }); } } if (menuItems.length > 0) { showContextMenu(menuItems, e.clientX, e.clientY); } else { hideContextMenu(); } };
@@ -487,7 +611,7 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     };
     
-    const renderActionCard = (actionData) => {
+    const renderActionCard = (actionData, cache) => {
         const toolMatch = actionData.match(/调用工具: ([\w_]+)/);
         const argsMatch = actionData.match(/参数: (\{.*\})$/s);
     
@@ -531,7 +655,10 @@ document.addEventListener('DOMContentLoaded', () => {
             }).join('');
         }
     
-        return `<div class="action-card"><div class="tool-name">${toolName}</div>${paramsHtml}</div>`;
+        const cacheHtml = cache && cache.hit
+            ? `<div class="param-item cache-hit">命中缓存，复用之前的结果（节省约 ${Number(cache.saved_seconds || 0).toFixed(2)} 秒）</div>`
+            : '';
+        return `<div class="action-card"><div class="tool-name">${toolName}</div>${paramsHtml}${cacheHtml}</div>`;
     };
 
     const renderEvaluation = (evalData) => {
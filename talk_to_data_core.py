@@ -1,64 +1,261 @@
 # talk_to_data_core.py
 
+import asyncio
 import json
 import re
 import os
+import time
+import uuid
+import openai
 import pandas as pd
-from openai import OpenAI
 from tools import ToolManager
+import ingest
+import llm_clients
+from context_budget import ContextBudgeter, count_tokens
+from results_store import PREVIEW_MAX_COLUMNS
 
 try:
     import geopandas as gpd
 except ImportError:
     gpd = None
 
+# 一轮中最多同时调用的工具数
+MAX_ACTIONS_PER_TURN = int(os.environ.get('TTD_MAX_ACTIONS_PER_TURN', 8))
+# 工具调用协议：native 使用 OpenAI 原生函数调用（tools / tool_calls），tags 使用 <thought>/<action> 文本标签，
+# auto 优先使用原生调用，服务商不支持时自动退回标签协议
+TOOL_PROTOCOL = os.environ.get('TTD_TOOL_PROTOCOL', 'auto')
+# 已确认不支持原生函数调用的 (base_url, 模型)
+_native_unsupported = set()
+# 流式调用时请求服务端在最后一个数据块中返回 token 用量；个别服务商不支持 stream_options 时可设为 0
+LLM_STREAM_USAGE = os.environ.get('TTD_LLM_STREAM_USAGE', '1') == '1'
+
+
+class _StreamingTagParser:
+    """增量解析流式输出：逐步吐出 <thought> 内容，并检测 </action> 是否已闭合。"""
+
+    THOUGHT_OPEN, THOUGHT_CLOSE = '<thought>', '</thought>'
+    ACTION_CLOSE = '</action>'
+
+    def __init__(self):
+        self.buffer = ""
+        self.action_closed = False
+        self._thought_emitted = 0
+
+    def feed(self, delta: str) -> str:
+        """追加一段增量文本，返回本次新增、可安全展示的思考内容。"""
+        self.buffer += delta
+        if not self.action_closed:
+            # 只需在新增部分（加上可能被截断的标签前缀）中查找闭合标签
+            search_from = max(0, len(self.buffer) - len(delta) - len(self.ACTION_CLOSE))
+            close_idx = self.buffer.find(self.ACTION_CLOSE, search_from)
+            if close_idx != -1:
+                self.action_closed = True
+                self.buffer = self.buffer[:close_idx + len(self.ACTION_CLOSE)]
+        return self._new_thought_text()
+
+    def _new_thought_text(self) -> str:
+        start = self.buffer.find(self.THOUGHT_OPEN)
+        if start == -1:
+            return ""
+        content_start = start + len(self.THOUGHT_OPEN)
+        end = self.buffer.find(self.THOUGHT_CLOSE, content_start)
+        if end == -1:
+            # 末尾可能是被截断的 </thought>，先保留不输出
+            end = len(self.buffer)
+            for k in range(len(self.THOUGHT_CLOSE) - 1, 0, -1):
+                if self.buffer.endswith(self.THOUGHT_CLOSE[:k]):
+                    end -= k
+                    break
+        new_text = self.buffer[content_start + self._thought_emitted:end]
+        self._thought_emitted += len(new_text)
+        return new_text
+
+
+class _ToolCallAccumulator:
+    """累积原生函数调用模式下的流式增量：正文作为思考内容，tool_calls 按 index 拼接。"""
+
+    def __init__(self):
+        self.content = ""
+        self._calls = {}
+
+    def feed(self, delta) -> str:
+        """追加一个增量，返回本次新增的正文。"""
+        text = delta.content or ""
+        self.content += text
+        for call in delta.tool_calls or []:
+            entry = self._calls.setdefault(call.index, {"id": None, "name": "", "arguments": ""})
+            if call.id:
+                entry["id"] = call.id
+            if call.function is not None:
+                entry["name"] += call.function.name or ""
+                entry["arguments"] += call.function.arguments or ""
+        return text
+
+    def message(self):
+        return {"content": self.content, "tool_calls": [self._calls[k] for k in sorted(self._calls)]}
+
+
+def _native_message(message):
+    """把非流式响应中的消息转换为与 _ToolCallAccumulator.message() 相同的结构。"""
+    return {
+        "content": message.content or "",
+        "tool_calls": [
+            {"id": call.id, "name": call.function.name, "arguments": call.function.arguments or ""}
+            for call in message.tool_calls or []
+        ],
+    }
+
+
+# 历史消息格式校验失败（如工具结果找不到对应的 tool_calls）的错误信息同样会提到 tool，
+# 但与服务商是否支持函数调用无关
+_HISTORY_ERROR_HINTS = (
+    "tool_call_id", "messages[", "role 'tool'", 'role "tool"', "preceding", "preceeding",
+    "must be followed", "must be a response",
+)
+
+
+def _tools_unsupported(error):
+    """服务商拒绝 tools 参数时的错误（各家的错误信息不同，只能按状态码和关键词判断）。"""
+    message = str(error).lower()
+    if any(hint in message for hint in _HISTORY_ERROR_HINTS):
+        return False
+    return getattr(error, "status_code", None) in (400, 404, 422) and ("tool" in message or "function" in message)
+
+
+def _history_as_tags(llm_history, system_prompt):
+    """把原生函数调用格式的历史转换为标签协议：tool_calls 写成 <action>，连续的工具结果合并为一条观察消息。"""
+    converted = []
+    for msg in llm_history:
+        if msg["role"] == "system":
+            converted.append({"role": "system", "content": system_prompt})
+        elif msg["role"] == "assistant" and msg.get("tool_calls"):
+            actions = []
+            for call in msg["tool_calls"]:
+                try:
+                    args = json.loads(call["function"]["arguments"] or "{}")
+                except json.JSONDecodeError:
+                    args = call["function"]["arguments"]
+                actions.append({"tool": call["function"]["name"], "args": args})
+            thought = f"<thought>{msg['content']}</thought>" if msg.get("content") else ""
+            action = actions[0] if len(actions) == 1 else actions
+            converted.append({"role": "assistant", "content": f"{thought}<action>{json.dumps(action, ensure_ascii=False)}</action>"})
+        elif msg["role"] == "tool":
+            if converted and converted[-1].get("_tool_results"):
+                converted[-1]["content"] += f"\n\n{msg['content']}"
+            else:
+                converted.append({"role": "user", "content": f"观察结果:\n{msg['content']}", "_tool_results": True})
+        else:
+            converted.append(msg)
+    for msg in converted:
+        msg.pop("_tool_results", None)
+    return converted
+
+
+def _answer_pending_tool_calls(llm_history):
+    """为没有结果的工具调用补上结果（例如上次分析在执行工具时被中断），否则接口会拒绝这段历史。"""
+    last = next((i for i in range(len(llm_history) - 1, -1, -1) if llm_history[i]["role"] == "assistant"), None)
+    if last is None or not llm_history[last].get("tool_calls"):
+        return
+    position = last + 1
+    while position < len(llm_history) and llm_history[position]["role"] == "tool":
+        position += 1
+    answered = {msg.get("tool_call_id") for msg in llm_history[last + 1:position]}
+    llm_history[position:position] = [
+        {"role": "tool", "tool_call_id": call["id"], "content": "未执行：分析已中断。"}
+        for call in llm_history[last]["tool_calls"] if call["id"] not in answered
+    ]
+
+
 class TalkToDataCore:
 
-    def __init__(self, api_key, base_url, model_name, plot_save_dir, session_state):
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
+    MAX_TURNS = 25
+    # 工具定义不随会话变化，系统提示词和原生工具定义只需构造一次
+    _system_prompt_cache = {}
+    _tool_specs_cache = None
+
+    def __init__(self, api_key, base_url, model_name, plot_save_dir, session_state, stream=True, dataset_cache=None, executor=None, context_budget=None, session_path=None, tool_protocol=TOOL_PROTOCOL):
+        self.client = llm_clients.get_client(api_key, base_url)
+        self._api_key, self._base_url = api_key, base_url
+        self._async_client = None
         self.model = model_name
+        self.stream = stream
+        self.dataset_cache = dataset_cache
+        self.context_budget = context_budget or ContextBudgeter()
         self.tool_manager = ToolManager(
             plot_save_dir=plot_save_dir, 
-            session_state=session_state
+            session_state=session_state,
+            executor=executor,
+            session_path=session_path
         )
+        if tool_protocol == "auto":
+            unsupported = (str(base_url or "").rstrip('/'), model_name) in _native_unsupported
+            tool_protocol = "tags" if unsupported else "native"
+        self.protocol = tool_protocol
         self.system_prompt_content = self._construct_system_prompt()
+        self.tracer = self.tool_manager.tracer
+        self.last_usage = None
 
     def _sanitize_filename_for_df_name(self, filename: str) -> str:
         base_name = os.path.splitext(filename)[0]
         sanitized = re.sub(r'\W|^(?=\d)', '_', base_name)
         return f"df_{sanitized}"
 
-    def load_data_from_filepath(self, filepath: str) -> str:
+    def load_data_from_filepath(self, filepath: str, content_hash: str = None) -> str:
         filename = os.path.basename(filepath)
         df_name = self._sanitize_filename_for_df_name(filename)
+        lower_path = filepath.lower()
+        if not lower_path.endswith(('.csv', '.xlsx', '.xls', '.json', '.shp')):
+            return f"文件 '{filename}' 是一个辅助文件或不支持的格式，已跳过加载。"
+        if lower_path.endswith('.shp') and gpd is None:
+            return "错误: 需要 'geopandas' 库来加载 .shp 文件。请运行 'pip install geopandas'。"
         try:
-            if filepath.lower().endswith('.csv'):
-                df = pd.read_csv(filepath)
-            elif filepath.lower().endswith(('.xlsx', '.xls')):
-                df = pd.read_excel(filepath)
-            elif filepath.lower().endswith('.json'):
-                try:
-                    df = pd.read_json(filepath, orient='records')
-                except ValueError:
-                    df = pd.read_json(filepath)
-            elif filepath.lower().endswith('.shp'):
-                if gpd is None:
-                    return "错误: 需要 'geopandas' 库来加载 .shp 文件。请运行 'pip install geopandas'。"
-                df = gpd.read_file(filepath)
+            start_time = time.perf_counter()
+            cached, cache_status, cache_stored = None, "disabled", False
+            if self.dataset_cache is not None:
+                cache_key = self.dataset_cache.key_for(filepath, content_hash)
+                cached = self.dataset_cache.get(cache_key)
+                cache_status = "hit" if cached is not None else "miss"
+            if cached is not None:
+                df, metadata = cached
+                source_bytes = metadata.get("source_bytes")
             else:
-                return f"文件 '{filename}' 是一个辅助文件或不支持的格式，已跳过加载。"
-            self.tool_manager.state["dataframes"][df_name] = df
+                df, source_bytes = ingest.read_compact(filepath)
+                if self.dataset_cache is not None:
+                    cache_stored = self.dataset_cache.put(cache_key, df, metadata={"source_bytes": source_bytes})
+            compact_bytes = ingest.memory_bytes(df)
+            elapsed = time.perf_counter() - start_time
+            self.tool_manager.set_dataframe(df_name, df)
+            if cache_status == "hit" or (cache_status == "miss" and cache_stored):
+                # 缓存的 Parquet 文件与刚加载的数据一致，查询工具可直接扫描它
+                self.tool_manager.query_sources.register_file(df_name, self.dataset_cache.path_for(cache_key))
+            self.tool_manager.record_telemetry(
+                "load", df_name=df_name, file=filename, cache=cache_status,
+                seconds=round(elapsed, 4), rows=len(df), columns=len(df.columns),
+                source_bytes=source_bytes, memory_bytes=compact_bytes
+            )
+            self.tracer.record(
+                "load", os.path.splitext(lower_path)[1].lstrip('.'), elapsed, df_name=df_name, cache=cache_status,
+                df_rows=len(df), df_columns=len(df.columns), source_bytes=source_bytes, memory_bytes=compact_bytes
+            )
+            cache_note = {"hit": "，命中缓存", "miss": "，未命中缓存"}.get(cache_status, "")
+            memory_note = ingest.format_bytes(compact_bytes)
+            if source_bytes:
+                memory_note = f"{ingest.format_bytes(source_bytes)} → {memory_note}"
             
             # --- 修改：为前端生成HTML表格 ---
             try:
                 # to_html 会为前端生成一个美观的表格
-                df_head_html = df.head().to_html(classes='data-table', border=0, index=False)
+                # 列很多时只预览前面的列，避免生成过大的 HTML
+                df_head_html = df.head().iloc[:, :PREVIEW_MAX_COLUMNS].to_html(classes='data-table', border=0, index=False)
             except Exception:
                 # 如果生成HTML失败，回退到纯文本
-                df_head_html = f"<pre>{df.head().to_string(index=False)}</pre>"
+                df_head_html = f"<pre>{df.head().iloc[:, :PREVIEW_MAX_COLUMNS].to_string(index=False)}</pre>"
+            if len(df.columns) > PREVIEW_MAX_COLUMNS:
+                df_head_html += f"<p>共 {len(df.columns)} 列，预览只显示前 {PREVIEW_MAX_COLUMNS} 列。</p>"
 
             return (
-                f"<p>文件 '{filename}' 已成功加载为 DataFrame '{df_name}'。</p>"
+                f"<p>文件 '{filename}' 已成功加载为 DataFrame '{df_name}'（耗时 {elapsed:.2f} 秒{cache_note}）。</p>"
+                f"<p>内存占用：{memory_note}</p>"
                 f"<strong>数据预览：</strong>"
                 f"<div class='table-wrapper'>{df_head_html}</div>"
             )
@@ -68,6 +265,35 @@ class TalkToDataCore:
             return f"<p>加载文件 '{filename}' 时发生严重错误: {e}</p>"
 
     def _construct_system_prompt(self):
+        cache = TalkToDataCore._system_prompt_cache
+        if self.protocol not in cache:
+            cache[self.protocol] = self._render_native_prompt() if self.protocol == "native" else self._render_system_prompt()
+        return cache[self.protocol]
+
+    def _tool_specs(self):
+        """原生函数调用使用的工具定义。"""
+        if TalkToDataCore._tool_specs_cache is None:
+            TalkToDataCore._tool_specs_cache = [
+                {"type": "function", "function": {
+                    "name": d["name"], "description": d["description"],
+                    "parameters": d["parameters"] or {"type": "object", "properties": {}},
+                }}
+                for d in self.tool_manager.get_tool_definitions()
+            ]
+        return TalkToDataCore._tool_specs_cache
+
+    def _render_native_prompt(self):
+        # 工具定义通过 tools 参数发送，不必写进提示词
+        return f"""
+你是一个名为 Talk to Data 的AI数据分析助手。你的任务是根据用户的请求，通过思考和调用工具来一步步完成数据分析任务。
+你现在可以处理一个或多个数据集。每个加载的数据文件都会被分配一个以 'df_' 开头的 DataFrame 名称。
+每一轮先在回复正文中用一两句话说明你的思考和下一步计划，然后调用最合适的工具。**如果存在多个 DataFrame，你应该首先使用 `list_dataframes` 工具来了解它们各自的结构。**
+如果需要多个互不依赖的调用（例如查看多个 DataFrame 的统计信息），可以在同一轮中同时调用（最多 {MAX_ACTIONS_PER_TURN} 个）。它们按顺序执行，只读的调用会并发执行。
+重复以上步骤，直到当前子任务完成。当一个阶段的分析完成后，使用 `finish_task` 工具来提交你的阶段性结论和总结。用户可能会根据你的总结提出新的问题。
+每一轮都必须调用工具。
+"""
+
+    def _render_system_prompt(self):
         tool_definitions = self.tool_manager.get_tool_definitions()
         return f"""
 你是一个名为 Talk to Data 的AI数据分析助手。你的任务是根据用户的请求，通过思考和调用工具来一步步完成数据分析任务。
@@ -75,7 +301,8 @@ class TalkToDataCore:
 你的工作流程严格遵循 "思考-行动-观察" (Thought-Action-Observation) 的模式：
 1.  **思考 (Thought)**: 在 `<thought>` 标签中分析当前情况，明确你的目标，并规划下一步需要做什么。**如果存在多个 DataFrame，你应该首先使用 `list_dataframes` 工具来了解它们各自的结构。**
 2.  **行动 (Action)**: 根据你的思考，在 `<action>` 标签中以严格的 JSON 格式选择一个最合适的工具来执行。JSON 格式必须为: `{{"tool": "tool_name", "args": {{...}}}}`
-3.  你将得到一个 **观察 (Observation)** 结果，这是工具执行的输出。
+    如果需要多个互不依赖的调用（例如查看多个 DataFrame 的统计信息），可以在同一个 `<action>` 中给出 JSON 数组（最多 {MAX_ACTIONS_PER_TURN} 个）: `[{{"tool": ...}}, {{"tool": ...}}]`。它们按顺序执行，只读的调用会并发执行。
+3.  你将得到一个 **观察 (Observation)** 结果，这是工具执行的输出；多个调用的结果按编号一起返回。
 重复以上步骤，直到当前子任务完成。当一个阶段的分析完成后，使用 `finish_task` 工具来提交你的阶段性结论和总结。用户可能会根据你的总结提出新的问题。
 你可用的工具有:
 {json.dumps(tool_definitions, indent=2, ensure_ascii=False)}
@@ -104,9 +331,247 @@ class TalkToDataCore:
                     pass
             return thought, {"error": f"行动指令不是一个有效的JSON格式。收到的内容: {action_str}"}
 
-    def run(self, task: str, llm_history: list):
+    def _stream_kwargs(self):
+        if LLM_STREAM_USAGE:
+            return {"stream": True, "stream_options": {"include_usage": True}}
+        return {"stream": True}
+
+    def _complete(self, llm_history: list):
+        """非流式调用：等待完整响应。"""
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+        )
+        self.last_usage = response.usage
+        return response.choices[0].message.content
+
+    def _stream_completion(self, llm_history: list):
+        """流式调用：边接收边产出思考片段，看到 </action> 闭合后立即结束本轮生成。"""
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+            **self._stream_kwargs(),
+        )
+        parser = _StreamingTagParser()
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    self.last_usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                partial_thought = parser.feed(delta)
+                if partial_thought:
+                    yield {"type": "thought_delta", "content": partial_thought}
+                if parser.action_closed:
+                    break
+        finally:
+            # 提前关闭连接，不再为 </action> 之后的内容消耗 token
+            stream.close()
+        return parser.buffer
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = llm_clients.get_async_client(self._api_key, self._base_url)
+        return self._async_client
+
+    async def _acomplete(self, llm_history: list):
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+        )
+        self.last_usage = response.usage
+        return response.choices[0].message.content
+
+    async def _astream_completion(self, llm_history: list, parser: _StreamingTagParser):
+        """_stream_completion 的异步版本；完整输出保存在 parser.buffer 中。"""
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+            **self._stream_kwargs(),
+        )
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    self.last_usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                partial_thought = parser.feed(delta)
+                if partial_thought:
+                    yield {"type": "thought_delta", "content": partial_thought}
+                if parser.action_closed:
+                    break
+        finally:
+            # 客户端断开时任务被取消，同样会走到这里关闭上游连接
+            await stream.close()
+
+    def _complete_native(self, llm_history: list):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+            tools=self._tool_specs(),
+        )
+        self.last_usage = response.usage
+        return _native_message(response.choices[0].message)
+
+    def _stream_native(self, llm_history: list):
+        """原生函数调用的流式版本：正文作为思考片段实时产出，返回完整消息。"""
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+            tools=self._tool_specs(),
+            **self._stream_kwargs(),
+        )
+        accumulator = _ToolCallAccumulator()
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    self.last_usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                text = accumulator.feed(chunk.choices[0].delta)
+                if text:
+                    yield {"type": "thought_delta", "content": text}
+        finally:
+            stream.close()
+        return accumulator.message()
+
+    async def _acomplete_native(self, llm_history: list):
+        response = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+            tools=self._tool_specs(),
+        )
+        self.last_usage = response.usage
+        return _native_message(response.choices[0].message)
+
+    async def _astream_native(self, llm_history: list, accumulator: _ToolCallAccumulator):
+        stream = await self.async_client.chat.completions.create(
+            model=self.model,
+            messages=llm_history,
+            temperature=0.1,
+            tools=self._tool_specs(),
+            **self._stream_kwargs(),
+        )
+        try:
+            async for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    self.last_usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                text = accumulator.feed(chunk.choices[0].delta)
+                if text:
+                    yield {"type": "thought_delta", "content": text}
+        finally:
+            await stream.close()
+
+    def _fallback_to_tags(self, error, llm_history: list):
+        """服务商不支持原生函数调用时改用标签协议，并把历史转换为标签格式；返回是否已切换。"""
+        if not _tools_unsupported(error):
+            return False
+        _native_unsupported.add((str(self._base_url or "").rstrip('/'), self.model))
+        self.protocol = "tags"
+        self.system_prompt_content = self._construct_system_prompt()
+        self.tool_manager.record_telemetry("tool_protocol_fallback", model=self.model, error=str(error)[:200])
+        llm_history[:] = _history_as_tags(llm_history, self.system_prompt_content)
+        return True
+
+    def _usage_fields(self, llm_history: list, output, native: bool):
+        """本次调用的 token 用量；响应中没有用量（例如流式输出提前结束）时按文本估算。"""
+        usage = self.last_usage
+        if usage is not None and getattr(usage, "prompt_tokens", None) is not None:
+            return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+        if native:
+            text = output["content"] + "".join(call["name"] + call["arguments"] for call in output["tool_calls"])
+        else:
+            text = output
+        return {
+            "prompt_tokens": self.context_budget.total_tokens(llm_history),
+            "completion_tokens": count_tokens(text), "usage_estimated": True,
+        }
+
+    def _request_turn(self, llm_history: list):
+        """请求模型的下一步，流式产出思考片段；返回 (模型输出, 是否为原生函数调用)。"""
+        with self.tracer.span("llm", self.model, stream=self.stream) as span:
+            self.last_usage = None
+            output, native = yield from self._call_llm(llm_history)
+            span.update(protocol="native" if native else "tags", **self._usage_fields(llm_history, output, native))
+        return output, native
+
+    def _call_llm(self, llm_history: list):
+        if self.protocol == "native":
+            try:
+                if self.stream:
+                    return (yield from self._stream_native(llm_history)), True
+                return self._complete_native(llm_history), True
+            except openai.APIStatusError as e:
+                if not self._fallback_to_tags(e, llm_history):
+                    raise
+        if self.stream:
+            return (yield from self._stream_completion(llm_history)), False
+        return self._complete(llm_history), False
+
+    async def _arequest_turn(self, llm_history: list, turn: dict):
+        """_request_turn 的异步版本；结果写入 turn["output"] 和 turn["native"]。"""
+        with self.tracer.span("llm", self.model, stream=self.stream) as span:
+            self.last_usage = None
+            async for event in self._acall_llm(llm_history, turn):
+                yield event
+            span.update(
+                protocol="native" if turn["native"] else "tags",
+                **self._usage_fields(llm_history, turn["output"], turn["native"])
+            )
+
+    async def _acall_llm(self, llm_history: list, turn: dict):
+        if self.protocol == "native":
+            try:
+                if self.stream:
+                    accumulator = _ToolCallAccumulator()
+                    async for event in self._astream_native(llm_history, accumulator):
+                        yield event
+                    turn["output"] = accumulator.message()
+                else:
+                    turn["output"] = await self._acomplete_native(llm_history)
+                turn["native"] = True
+                return
+            except openai.APIStatusError as e:
+                if not self._fallback_to_tags(e, llm_history):
+                    raise
+        if self.stream:
+            parser = _StreamingTagParser()
+            async for event in self._astream_completion(llm_history, parser):
+                yield event
+            turn["output"] = parser.buffer
+        else:
+            turn["output"] = await self._acomplete(llm_history)
+        turn["native"] = False
+
+    def cancel(self):
+        """中止正在执行的工具代码（客户端断开连接时调用）。"""
+        return self.tool_manager.cancel()
+
+    def _begin(self, task: str, llm_history: list):
         if not any(msg['role'] == 'system' for msg in llm_history):
             llm_history.insert(0, {"role": "system", "content": self.system_prompt_content})
+        elif llm_history[0]['role'] == 'system' and llm_history[0]['content'] != self.system_prompt_content:
+            # 协议（或工具定义）变化后，系统提示词需与当前协议一致
+            llm_history[0] = {"role": "system", "content": self.system_prompt_content}
+        if self.protocol == "tags" and any(msg.get('tool_calls') for msg in llm_history):
+            llm_history[:] = _history_as_tags(llm_history, self.system_prompt_content)
+        _answer_pending_tool_calls(llm_history)
         
         # --- 修改：为LLM提供纯文本的数据加载信息 ---
         initial_user_content = f"任务: {task}"
@@ -118,64 +583,249 @@ class TalkToDataCore:
 
         llm_history.append({"role": "user", "content": initial_user_content})
         # -----------------------------------
+
+    def _attach_spans(self, events: list):
+        """把尚未发送的 span 附加到本批事件的第一个事件上；没有事件时留到下一批。"""
+        if events:
+            spans = self.tracer.take_new()
+            if spans:
+                events[0]["spans"] = spans
+        return events
+
+    def _compact_history(self, llm_history: list):
+        """历史超出上下文预算时压缩较早的轮次。"""
+        stats = self.context_budget.compact(llm_history)
+        if stats:
+            self.tool_manager.record_telemetry("context_compaction", **stats)
+
+    def _plan(self, output, native: bool, llm_history: list):
+        with self.tracer.span("parse", "native" if native else "tags") as span:
+            events, calls, call_ids, error = self._parse_turn(output, native, llm_history)
+            span.update(error=error is not None, calls=len(calls or []))
+        return events, calls, call_ids, error
+
+    def _parse_turn(self, output, native: bool, llm_history: list):
+        """解析模型输出，返回 (待发送的事件, 工具调用列表, 工具调用 ID 列表, 解析错误)。
+
+        每个工具调用为 (tool_name, tool_args, error)，error 不为空时该调用不执行、直接以 error 作为结果；
+        工具调用 ID 只在原生函数调用模式下存在，用于把结果对应回各个调用。
+        """
+        if native and output["tool_calls"]:
+            return self._plan_native(output, llm_history)
+        if native and '<action>' not in output["content"]:
+            events = [{"type": "thought", "content": output["content"].strip()}] if output["content"].strip() else []
+            llm_history.append({"role": "assistant", "content": output["content"]})
+            return events, None, None, "解析错误：本轮没有调用任何工具。每一轮都必须调用工具，分析完成后请调用 finish_task。"
+        # 原生模式下模型没有发起函数调用时，按标签协议解析正文
+        events, calls, error = self._plan_step(output["content"] if native else output, llm_history)
+        return events, calls, None, error
+
+    def _plan_step(self, llm_output: str, llm_history: list):
+        """解析标签协议的模型输出，返回 (待发送的事件, 工具调用列表, 解析错误)。"""
+        thought, action = self._parse_response(llm_output)
+        events = []
+        if thought:
+            events.append({"type": "thought", "content": thought})
         
-        max_turns = 25
-        for i in range(max_turns):
-            yield {"type": "progress", "value": (i / max_turns) * 100, "step": i + 1, "total_steps": max_turns}
-            try:
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=llm_history,
-                    temperature=0.1,
-                )
-                llm_output = response.choices[0].message.content
-            except Exception as e:
-                yield {"type": "observation", "content": f"调用LLM API时出错: {e}"}
-                llm_history.pop() 
+        llm_history.append({"role": "assistant", "content": llm_output})
+
+        if isinstance(action, dict) and action.get("error"):
+            return events, None, f"解析错误: {action.get('error')}"
+        actions = action if isinstance(action, list) else [action]
+        if not actions:
+            return events, None, "解析错误：行动列表为空。"
+        if len(actions) > MAX_ACTIONS_PER_TURN:
+            return events, None, f"解析错误：一轮最多调用 {MAX_ACTIONS_PER_TURN} 个工具，请分批调用。"
+        calls = []
+        for item in actions:
+            tool_name = item.get("tool") if isinstance(item, dict) else None
+            if not tool_name:
+                return events, None, "解析错误：模型输出的JSON中缺少 'tool' 字段。"
+            if 'args' in item and isinstance(item.get('args'), dict):
+                tool_args = item['args']
+            else:
+                tool_args = {k: v for k, v in item.items() if k != 'tool'}
+            calls.append((tool_name, tool_args, None))
+            if tool_name == "finish_task":
+                # 提交总结后任务即结束，之后的调用不再执行
                 break
-            
-            thought, action = self._parse_response(llm_output)
+        events.extend(self._action_events(calls))
+        return events, calls, None
 
-            if thought:
-                yield {"type": "thought", "content": thought}
-            
-            llm_history.append({"role": "assistant", "content": llm_output})
+    def _plan_native(self, message: dict, llm_history: list):
+        """处理原生函数调用：参数有误的调用单独返回错误，不影响同一轮中的其他调用。"""
+        content = message["content"].strip()
+        events = [{"type": "thought", "content": content}] if content else []
+        call_ids = [call["id"] or f"call_{uuid.uuid4().hex[:24]}" for call in message["tool_calls"]]
+        llm_history.append({
+            "role": "assistant", "content": content,
+            "tool_calls": [
+                {"id": call_id, "type": "function", "function": {"name": call["name"], "arguments": call["arguments"] or "{}"}}
+                for call_id, call in zip(call_ids, message["tool_calls"])
+            ],
+        })
 
-            if action.get("error"):
-                observation = f"解析错误: {action.get('error')}"
-            else:
-                tool_name = action.get("tool")
-                if not tool_name:
-                    observation = "解析错误：模型输出的JSON中缺少 'tool' 字段。"
-                else:
-                    if 'args' in action and isinstance(action.get('args'), dict):
-                        tool_args = action['args']
-                    else:
-                        tool_args = {k: v for k, v in action.items() if k != 'tool'}
-                    
-                    yield {"type": "action", "content": f"调用工具: {tool_name}，参数: {json.dumps(tool_args, ensure_ascii=False)}"}
-                    observation = self.tool_manager.dispatch(tool_name, **tool_args)
-            
+        calls, finished = [], False
+        for index, call in enumerate(message["tool_calls"]):
+            tool_name, error = call["name"], None
+            try:
+                tool_args = json.loads(call["arguments"] or "{}")
+            except json.JSONDecodeError:
+                tool_args, error = {}, f"错误：工具 '{tool_name}' 的参数不是有效的 JSON: {call['arguments']}"
+            if not isinstance(tool_args, dict):
+                tool_args, error = {}, f"错误：工具 '{tool_name}' 的参数必须是 JSON 对象。"
+            if finished:
+                error = "未执行：已调用 finish_task，任务已结束。"
+            elif index >= MAX_ACTIONS_PER_TURN:
+                error = f"未执行：一轮最多调用 {MAX_ACTIONS_PER_TURN} 个工具。"
+            finished = finished or (tool_name == "finish_task" and error is None)
+            calls.append((tool_name, tool_args, error))
+        events.extend(self._action_events(calls))
+        return events, calls, call_ids, None
+
+    def _action_events(self, calls):
+        events, read_only_so_far = [], True
+        for tool_name, tool_args, error in calls:
+            action_event = {"type": "action", "content": f"调用工具: {tool_name}，参数: {json.dumps(tool_args, ensure_ascii=False)}"}
+            # 前面有修改数据的调用时无法预先判断是否命中缓存
+            cached = self.tool_manager.cached_call(tool_name, tool_args) if read_only_so_far and error is None else None
+            if cached is not None:
+                # 相同参数、相同数据版本的调用直接复用之前的结果
+                action_event["cache"] = dict(cached, hit=True)
+            read_only_so_far = read_only_so_far and self.tool_manager.is_read_only(tool_name, tool_args)
+            events.append(action_event)
+        return events
+
+    def _execute_calls(self, calls):
+        """执行本轮的工具调用，返回 [(工具名, 观察结果, 保存的结果)]。"""
+        runnable = [index for index, (_, _, error) in enumerate(calls) if error is None]
+        outcomes = [(tool_name, error, []) for tool_name, _, error in calls]
+        dispatched = self.tool_manager.dispatch_batch([calls[index][:2] for index in runnable])
+        for index, (observation, results) in zip(runnable, dispatched):
+            outcomes[index] = (calls[index][0], observation, results)
+        return outcomes
+
+    def _finish_step(self, outcomes, step: int, llm_history: list, call_ids=None):
+        """记录本轮各调用的观察结果，返回 (待发送的事件, 任务是否已结束)。
+
+        outcomes 为 [(工具名, 观察结果, 保存的结果)]。标签协议下多个调用的结果编号后合并为一条消息交给模型；
+        原生函数调用模式下每个调用对应一条 tool 消息。
+        """
+        events, parts_for_llm, finished = [], [], False
+        for index, (tool_name, observation, results) in enumerate(outcomes, start=1):
+            if finished:
+                # finish_task 之后被跳过的调用只需回复给模型
+                parts_for_llm.append(str(observation))
+                continue
             try:
                 json.dumps(observation)
             except (TypeError, OverflowError):
                 observation = str(observation)
 
-            yield {"type": "observation", "content": observation}
+            event = {"type": "observation", "content": observation}
+            results = list(results)
+            if isinstance(observation, str) and '<div class=' not in observation:
+                # 过长的文本（例如打印整个 DataFrame）只发送预览，完整内容可通过 /results 分页获取
+                event["content"], meta = self.tool_manager.results.bound_observation(observation)
+                if meta is not None:
+                    results.append(meta)
+            if results:
+                event["results"] = results
+            events.append(event)
 
             if isinstance(observation, dict) and observation.get("status") == "finished":
-                yield {"type": "progress", "value": 100, "step": i + 1, "total_steps": max_turns}
-                yield {"type": "final_summary", "content": observation['summary']}
-                break
-            
+                events.append({"type": "progress", "value": 100, "step": step, "total_steps": self.MAX_TURNS})
+                events.append({"type": "final_summary", "content": observation['summary']})
+                finished = True
+                parts_for_llm.append("阶段性总结已提交。")
+                continue
+        
             # --- 修改：LLM的观察结果应该是纯文本，以避免上下文过大或解析问题 ---
             # 如果观察结果是HTML表格，我们只传递一个简短的确认信息给LLM
             if isinstance(observation, str) and observation.strip().startswith('<div class="table-wrapper">'):
                  observation_for_llm = "表格已生成并显示给用户。"
             else:
-                 observation_for_llm = str(observation)
-            llm_history.append({"role": "user", "content": f"观察结果:\n{observation_for_llm}"})
-            # -------------------------------------------------------------------
+                 observation_for_llm = self.context_budget.truncate_observation(str(observation))
+            if len(outcomes) > 1 and call_ids is None:
+                observation_for_llm = f"[{index}] {tool_name}:\n{observation_for_llm}"
+            parts_for_llm.append(observation_for_llm)
+
+        if call_ids is not None:
+            # 每个 tool_call 都必须有对应的结果，任务结束时也不例外
+            llm_history.extend(
+                {"role": "tool", "tool_call_id": call_id, "content": part} for call_id, part in zip(call_ids, parts_for_llm)
+            )
+        elif not finished:
+            llm_history.append({"role": "user", "content": "观察结果:\n" + "\n\n".join(parts_for_llm)})
+        # -------------------------------------------------------------------
+        return events, finished
+
+    def run(self, task: str, llm_history: list):
+        self._begin(task, llm_history)
+        max_turns = self.MAX_TURNS
+        for i in range(max_turns):
+            yield {"type": "progress", "value": (i / max_turns) * 100, "step": i + 1, "total_steps": max_turns}
+            self._compact_history(llm_history)
+            try:
+                output, native = yield from self._request_turn(llm_history)
+            except Exception as e:
+                yield from self._attach_spans([{"type": "observation", "content": f"调用LLM API时出错: {e}"}])
+                llm_history.pop() 
+                break
+            
+            events, calls, call_ids, error = self._plan(output, native, llm_history)
+            yield from self._attach_spans(events)
+            if calls is not None:
+                outcomes = self._execute_calls(calls)
+            else:
+                outcomes = [(None, error, self.tool_manager.results.take_new())]
+
+            events, finished = self._finish_step(outcomes, i + 1, llm_history, call_ids)
+            yield from self._attach_spans(events)
+            if finished:
+                break
+
+        else:
+            yield {"type": "final_summary", "content": "任务已达到最大步数限制，未能完成。"}
+
+    async def arun(self, task: str, llm_history: list):
+        """run 的异步版本：模型调用使用异步客户端，工具在线程池中执行，不阻塞事件循环。
+
+        调用方取消任务（例如客户端断开）时会关闭模型流并中止正在执行的代码。
+        """
+        self._begin(task, llm_history)
+        loop = asyncio.get_running_loop()
+        max_turns = self.MAX_TURNS
+        for i in range(max_turns):
+            yield {"type": "progress", "value": (i / max_turns) * 100, "step": i + 1, "total_steps": max_turns}
+            self._compact_history(llm_history)
+            try:
+                turn = {}
+                async for event in self._arequest_turn(llm_history, turn):
+                    yield event
+            except Exception as e:
+                for event in self._attach_spans([{"type": "observation", "content": f"调用LLM API时出错: {e}"}]):
+                    yield event
+                llm_history.pop() 
+                break
+            
+            events, calls, call_ids, error = self._plan(turn["output"], turn["native"], llm_history)
+            for event in self._attach_spans(events):
+                yield event
+            if calls is not None:
+                try:
+                    outcomes = await loop.run_in_executor(None, self._execute_calls, calls)
+                except asyncio.CancelledError:
+                    self.cancel()
+                    raise
+            else:
+                outcomes = [(None, error, self.tool_manager.results.take_new())]
+
+            events, finished = self._finish_step(outcomes, i + 1, llm_history, call_ids)
+            for event in self._attach_spans(events):
+                yield event
+            if finished:
+                break
 
         else:
-            yield {"type": "final_summary", "content": "任务已达到最大步数限制，未能完成。"}
\ No newline at end of file
+            yield {"type": "final_summary", "content": "任务已达到最大步数限制，未能完成。"}
@@ -0,0 +1,94 @@
+# tool_cache.py
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+TOOL_CACHE_MAX_ENTRIES = int(os.environ.get('TTD_TOOL_CACHE_ENTRIES', 128))
+# 观察结果超过该长度时不缓存，避免占用过多内存
+TOOL_CACHE_MAX_CHARS = 1_000_000
+
+
+def _df_name(args):
+    return [args.get("df_name")]
+
+
+# 可缓存的工具及其读取的 DataFrame；None 表示可能读取任意 DataFrame。
+# 生成文件（图表）、修改数据库或依赖外部状态的工具不在此列。
+CACHEABLE_TOOLS = {
+    "run_python_code": None,
+    "list_dataframes": None,
+    "describe_data": _df_name,
+    "correlation_analysis": _df_name,
+    "query_data": _df_name,
+    "explain_query": _df_name,
+    "train_linear_regression": _df_name,
+}
+
+
+def _normalize_args(tool_name, args):
+    """省略值为 None 的参数（等同于默认值）；代码去掉行尾空白和首尾空行。"""
+    normalized = {k: v for k, v in args.items() if v is not None}
+    if tool_name == "run_python_code" and isinstance(normalized.get("code"), str):
+        normalized["code"] = "\n".join(line.rstrip() for line in normalized["code"].strip("\n").split("\n"))
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def is_error(observation):
+    return isinstance(observation, str) and observation.startswith(("错误", "代码执行错误", "绘图代码执行错误"))
+
+
+class ToolCache:
+    """按 (工具名, 规范化参数, 所读 DataFrame 的版本戳) 缓存只读工具的结果，LRU 淘汰。
+
+    条目保存在会话状态的 "tool_cache" 中，跨任务复用；DataFrame 被修改后版本戳改变，
+    旧条目不会再命中，并由 invalidate 及时清除。
+    """
+
+    def __init__(self, state, max_entries=TOOL_CACHE_MAX_ENTRIES):
+        self.state = state
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def _entries(self):
+        return self.state.setdefault("tool_cache", OrderedDict())
+
+    def key_for(self, tool_name, args):
+        """返回调用的缓存键和读取的 DataFrame 名称；不可缓存时返回 (None, None)。"""
+        if tool_name not in CACHEABLE_TOOLS or self.max_entries <= 0:
+            return None, None
+        reads_for = CACHEABLE_TOOLS[tool_name]
+        versions = self.state.get("versions", {})
+        if reads_for is None:
+            reads = None
+            stamps = tuple(sorted((name, versions.get(name)) for name in list(self.state["dataframes"])))
+        else:
+            reads = frozenset(str(name) for name in reads_for(args))
+            stamps = tuple(sorted((name, versions.get(name)) for name in reads))
+        return (tool_name, _normalize_args(tool_name, args), stamps), reads
+
+    def get(self, key, touch=True):
+        with self._lock:
+            entry = self._entries().get(key)
+            if entry is not None and touch:
+                self._entries().move_to_end(key)
+            return entry
+
+    def put(self, key, reads, observation, results, seconds):
+        if isinstance(observation, str) and len(observation) > TOOL_CACHE_MAX_CHARS:
+            return
+        entries = self._entries()
+        with self._lock:
+            entries[key] = {"observation": observation, "results": results, "reads": reads, "seconds": seconds}
+            entries.move_to_end(key)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def invalidate(self, names):
+        """清除读取了这些 DataFrame 的条目。"""
+        names = set(names)
+        with self._lock:
+            entries = self._entries()
+            for key in [k for k, e in entries.items() if e["reads"] is None or e["reads"] & names]:
+                del entries[key]
@@ -1,29 +1,63 @@
 # tools.py
 
 import pandas as pd
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import numpy as np
-import io
+import pyarrow as pa
 import uuid
 import os
-from contextlib import redirect_stdout
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from sandbox import execute_code
+from shared_frames import new_version
+from profiles import ProfileCache
+from tool_cache import ToolCache, is_error
+import analytics
+import joins
+import lazy_query
+import sql_engine
+import plotting
+import interactive_plots
+from results_store import ResultsStore, PREVIEW_MAX_COLUMNS
+from metrics import Tracer
+
+
+TOOL_WORKERS = int(os.environ.get('TTD_TOOL_WORKERS', 4))
+_tool_executor = ThreadPoolExecutor(max_workers=max(1, TOOL_WORKERS), thread_name_prefix='tool')
+
+# 不修改会话数据、可以与其他只读调用并发执行的工具（query_data 指定 new_df_name 时除外）。
+# correlation_analysis 不改动 DataFrame，只在 _correlation_lock 下写入自己的缓存条目和结果存储。
+READ_ONLY_TOOLS = frozenset({
+    "list_dataframes", "describe_data", "query_data", "explain_query",
+    "correlation_analysis", "train_linear_regression",
+})
 
-# --- 中文字体配置 ---
-plt.rcParams['font.sans-serif'] = ['SimHei']
-plt.rcParams['axes.unicode_minus'] = False
 
 class ToolManager:
-    def __init__(self, plot_save_dir, session_state):
+    def __init__(self, plot_save_dir, session_state, executor=None, session_path=None):
         self.plot_save_dir = plot_save_dir
+        self.session_path = session_path or os.path.dirname(plot_save_dir)
         self.state = session_state
+        self.executor = executor
+        self.state.setdefault("versions", {})
+        self.profiles = ProfileCache(self.state)
+        self.query_sources = lazy_query.QuerySources(self.state)
+        self.database = sql_engine.SessionDatabase(sql_engine.database_path(self.session_path), self.state)
+        self.results = ResultsStore(self.session_path)
+        self.cache = ToolCache(self.state)
+        # 保护 state["correlations"]：correlation_analysis 可能与其他只读工具并发执行
+        self._correlation_lock = threading.Lock()
+        self.tracer = Tracer(self.session_path)
         self._tools = {
             "run_python_code": self.run_python_code,
             "generate_plot": self.generate_plot,
+            "generate_interactive_plot": self.generate_interactive_plot,
             "list_dataframes": self.list_dataframes,
             "describe_data": self.describe_data,
             "join_dataframes": self.join_dataframes,
+            "query_data": self.query_data,
+            "run_sql": self.run_sql,
+            "explain_query": self.explain_query,
             "correlation_analysis": self.correlation_analysis,
             "handle_missing_values": self.handle_missing_values,
             "train_linear_regression": self.train_linear_regression,
@@ -34,12 +68,13 @@ class ToolManager:
         """供 LLM 理解的工具定义"""
         return [
             {"name": "run_python_code", "description": "执行Python代码来操作`dataframes`字典中的数据。例如: `print(dataframes['initial_data'].head())`", "parameters": {"type": "object", "properties": {"code": {"type": "string"}}, "required": ["code"]}},
-            {"name": "generate_plot", "description": "执行Python代码生成图表。代码中必须包含`plt.savefig(save_path)`。一个名为 `save_path` 的变量会自动提供给你，你必须直接使用它。", "parameters": {"type": "object", "properties": {"code": {"type": "string"}}, "required": ["code"]}},
+            {"name": "generate_plot", "description": "执行Python代码生成图表。代码中必须包含`plt.savefig(save_path)`。一个名为 `save_path` 的变量会自动提供给你，你必须直接使用它。超大的散点序列会被自动抽样。", "parameters": {"type": "object", "properties": {"code": {"type": "string"}, "format": {"type": "string", "enum": ["png", "svg", "jpg", "webp"], "description": "图片格式，默认 png"}}, "required": ["code"]}},
+            {"name": "generate_interactive_plot", "description": "根据DataFrame直接生成可交互的 Plotly 图表（无需编写代码）。大数据会在服务端自动降采样：折线使用 LTTB/min-max，过多的散点改为密度图（指定 color 时按组抽样，保留图例），直方图在服务端分箱。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "kind": {"type": "string", "enum": ["line", "scatter", "bar", "histogram"]}, "x": {"type": "string", "description": "横轴列（直方图不需要）"}, "y": {"type": "array", "items": {"type": "string"}, "description": "纵轴列；柱状图按 x 分组求和，直方图统计这些列的分布"}, "color": {"type": "string", "description": "分组列，每组一条序列（可选，仅折线和散点）"}, "title": {"type": "string"}, "max_points": {"type": "integer", "description": "每条折线的最大点数，或散点改为密度图/按组抽样的阈值（可选）"}}, "required": ["df_name", "kind", "y"]}},
             {"name": "list_dataframes", "description": "列出内存中所有DataFrame的名称及其信息。", "parameters": {}},
             {"name": "describe_data", "description": "生成DataFrame的描述性统计信息。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}}, "required": ["df_name"]}},
             {
                 "name": "join_dataframes",
-                "description": "合并两个DataFrame并创建一个新的DataFrame。",
+                "description": "合并两个DataFrame并创建一个新的DataFrame。执行前会根据连接键估算结果行数，结果过大或行数成倍膨胀时拒绝执行。结果的行顺序不保证与输入一致。",
                 "parameters": {
                     "type": "object",
                     "properties": {
@@ -52,60 +87,208 @@ class ToolManager:
                     "required": ["left_df_name", "right_df_name", "on", "how", "new_df_name"]
                 }
             },
-            {"name": "correlation_analysis", "description": "计算DataFrame中数值列的相关系数矩阵。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}}, "required": ["df_name"]}},
-            {"name": "handle_missing_values", "description": "处理DataFrame中的缺失值。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "method": {"type": "string", "enum": ["fill_mean", "fill_median", "fill_mode", "drop"]}}, "required": ["df_name", "method"]}},
-            {"name": "train_linear_regression", "description": "训练一个简单的线性回归模型。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "target_column": {"type": "string"}, "feature_columns": {"type": "array", "items": {"type": "string"}}}, "required": ["df_name", "target_column", "feature_columns"]}},
+            {"name": "query_data", "description": "以延迟执行的方式对DataFrame做过滤、分组聚合和排序，只返回最终结果（比 run_python_code 更快、更省内存，适合大数据）。可选把结果保存为新的DataFrame。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "filters": {"type": "array", "items": {"type": "object"}, "description": "过滤条件列表（同时满足），每项为 {\"column\": 列名, \"op\": \"==|!=|>|>=|<|<=|in|not_in|is_null|not_null\", \"value\": 值}"}, "columns": {"type": "array", "items": {"type": "string"}, "description": "不聚合时返回的列（默认全部）"}, "group_by": {"type": "array", "items": {"type": "string"}}, "aggregations": {"type": "array", "items": {"type": "object"}, "description": "聚合列表，每项为 {\"column\": 列名, \"func\": \"sum|mean|min|max|count|count_distinct|count_all|stddev\", \"name\": 结果列名(可选)}"}, "sort_by": {"type": "array", "items": {"type": "object"}, "description": "排序，每项为 {\"column\": 结果列名, \"descending\": true/false}"}, "limit": {"type": "integer", "description": "最多返回的行数，默认 100"}, "new_df_name": {"type": "string", "description": "把查询结果保存为新DataFrame的名称（可选）"}}, "required": ["df_name"]}},
+            {"name": "explain_query", "description": "显示 query_data 的执行计划，以及过滤条件和列选择下推到数据文件后需要扫描的数据量，不执行查询。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "filters": {"type": "array", "items": {"type": "object"}, "description": "过滤条件列表（同时满足），每项为 {\"column\": 列名, \"op\": \"==|!=|>|>=|<|<=|in|not_in|is_null|not_null\", \"value\": 值}"}, "columns": {"type": "array", "items": {"type": "string"}, "description": "不聚合时返回的列（默认全部）"}, "group_by": {"type": "array", "items": {"type": "string"}}, "aggregations": {"type": "array", "items": {"type": "object"}, "description": "聚合列表，每项为 {\"column\": 列名, \"func\": \"sum|mean|min|max|count|count_distinct|count_all|stddev\", \"name\": 结果列名(可选)}"}, "sort_by": {"type": "array", "items": {"type": "object"}, "description": "排序，每项为 {\"column\": 结果列名, \"descending\": true/false}"}}, "required": ["df_name"]}},
+            {"name": "run_sql", "description": f"在会话数据库（{sql_engine.ENGINE}）中执行 SQL。每个DataFrame都是一张同名的只读表；用 CREATE TABLE 建立的表会保存在会话中。适合大数据上的分组、连接等查询。", "parameters": {"type": "object", "properties": {"sql": {"type": "string"}, "max_rows": {"type": "integer", "description": "最多返回的行数，默认 200"}, "explain": {"type": "boolean", "description": "为 true 时返回执行计划和耗时，而不是查询结果"}, "new_df_name": {"type": "string", "description": "把查询结果保存为新DataFrame的名称（可选）"}}, "required": ["sql"]}},
+            {"name": "correlation_analysis", "description": "计算DataFrame中数值列的相关系数，返回相关性最强的若干列对；完整矩阵保存在服务端，可通过结果句柄分页查看。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "method": {"type": "string", "enum": ["pearson", "spearman"], "description": "相关系数类型，默认 pearson"}, "top_k": {"type": "integer", "description": "返回的列对数量，默认 10"}, "sample_rows": {"type": "integer", "description": "数据行数超过该值时随机抽样计算（可选）"}}, "required": ["df_name"]}},
+            {"name": "handle_missing_values", "description": "处理DataFrame中的缺失值。method 作用于所有含缺失值的列，strategies 可为单独的列指定策略（mean/median/mode/drop，或 {\"value\": 常量}）。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "method": {"type": "string", "enum": ["fill_mean", "fill_median", "fill_mode", "drop"]}, "strategies": {"type": "object", "description": "按列指定的处理策略，例如 {\"age\": \"median\", \"city\": \"mode\"}"}}, "required": ["df_name"]}},
+            {"name": "train_linear_regression", "description": "训练线性回归模型（自动跳过含缺失值的行），返回系数、标准误和 R²。可选样本权重列和岭回归惩罚系数。", "parameters": {"type": "object", "properties": {"df_name": {"type": "string"}, "target_column": {"type": "string"}, "feature_columns": {"type": "array", "items": {"type": "string"}}, "weight_column": {"type": "string", "description": "样本权重列名（可选）"}, "ridge_alpha": {"type": "number", "description": "岭回归惩罚系数，默认 0（普通最小二乘）"}}, "required": ["df_name", "target_column", "feature_columns"]}},
             {"name": "finish_task", "description": "当一个子任务分析完成时调用此工具，提交阶段性总结。用户可能还会提出后续问题。", "parameters": {"type": "object", "properties": {"summary": {"type": "string"}}, "required": ["summary"]}},
         ]
         
+    def set_dataframe(self, name: str, df):
+        self.state["dataframes"][name] = df
+        self.state["versions"][name] = new_version()
+        # 新数据通常紧接着会被查看结构，提前在后台计算概要
+        self.profiles.schedule(name)
+
+    def touch_dataframe(self, name: str):
+        """标记 DataFrame 已被原地修改。"""
+        self.state["versions"][name] = new_version()
+
+    def _execute(self, code: str, kind: str, save_path: str = None):
+        frames = self.state["dataframes"]
+        versions = self.state["versions"]
+        for name in frames:
+            versions.setdefault(name, new_version())
+        if self.executor is not None:
+            result = self.executor.execute(code, kind, frames, versions, save_path)
+        else:
+            result = execute_code(code, frames, kind, save_path, self.state.setdefault("fingerprints", {}))
+        # 进程池会返回工作进程中采用的版本戳，沿用它可以避免把刚修改过的数据再同步回去
+        returned_versions = result.get("versions", {})
+        for name, df in result["changed"].items():
+            frames[name] = df
+            versions[name] = returned_versions.get(name) or new_version()
+            # 模型生成下一步期间在后台更新概要
+            self.profiles.schedule(name)
+        for name in result["deleted"]:
+            frames.pop(name, None)
+            versions.pop(name, None)
+            self.profiles.discard(name)
+            self.query_sources.discard(name)
+        return result
+
+    def cancel(self):
+        """终止正在执行的代码；只有在独立进程中执行时才能中止。"""
+        if self.executor is None:
+            return False
+        return self.executor.cancel()
+
+    def record_telemetry(self, event: str, **fields):
+        """记录一条结构化的运行统计（加载、合并等耗时信息）。"""
+        self.state.setdefault("telemetry", []).append({"event": event, **fields})
+
+    def cached_call(self, tool_name, args):
+        """若该调用会命中缓存，返回 {"saved_seconds": 上次执行耗时}，否则返回 None。"""
+        key, _ = self.cache.key_for(tool_name, args)
+        entry = self.cache.get(key, touch=False) if key is not None else None
+        return {"saved_seconds": entry["seconds"]} if entry is not None else None
+
     def dispatch(self, tool_name, **kwargs):
-        if tool_name not in self._tools: return f"错误：未知的工具 '{tool_name}'"
-        try: return self._tools[tool_name](**kwargs)
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return f"错误：执行工具 '{tool_name}' 时发生异常: {e}"
+        observation, results = self._dispatch(tool_name, kwargs)
+        self.results.enqueue(results)
+        return observation
+
+    def _dispatch(self, tool_name, kwargs):
+        """执行一次工具调用，返回 (观察结果, 本次调用保存的结果)。"""
+        with self.tracer.span("tool", tool_name, **self._frame_size(kwargs.get("df_name"))) as span:
+            observation, results, cached = self._call_tool(tool_name, kwargs)
+            span["cached"] = cached
+            span["error"] = is_error(observation)
+        return observation, results
+
+    def _frame_size(self, df_name):
+        df = self.state["dataframes"].get(df_name) if isinstance(df_name, str) else None
+        if df is None:
+            return {}
+        return {"df_name": df_name, "df_rows": len(df), "df_columns": len(df.columns)}
+
+    def _call_tool(self, tool_name, kwargs):
+        """返回 (观察结果, 保存的结果, 是否命中缓存)。"""
+        if tool_name not in self._tools: return f"错误：未知的工具 '{tool_name}'", [], False
+        # 先记录版本戳再计算缓存键：并发调用期间若有数据被修改，本次结果不会被缓存
+        versions_before = dict(self.state["versions"])
+        key, reads = self.cache.key_for(tool_name, kwargs)
+        if key is not None:
+            entry = self.cache.get(key)
+            # 结果文件可能已被淘汰，此时重新执行
+            if entry is not None and self.results.available(entry["results"]):
+                self.record_telemetry("tool_cache", tool=tool_name, hit=True, saved_seconds=entry["seconds"])
+                return entry["observation"], list(entry["results"]), True
+
+        start_time = time.perf_counter()
+        with self.results.capture() as produced:
+            try: observation = self._tools[tool_name](**kwargs)
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                return f"错误：执行工具 '{tool_name}' 时发生异常: {e}", produced, False
+        seconds = round(time.perf_counter() - start_time, 4)
+
+        # 数据被修改时清除依赖这些数据的缓存（修改也可能来自并发执行的其他调用）。
+        # 只缓存成功、且执行期间所读数据未变的调用；非只读工具还要求没有修改任何数据
+        versions_after = self.state["versions"]
+        changed = {name for name in versions_before.keys() | versions_after.keys()
+                   if versions_before.get(name) != versions_after.get(name)}
+        if changed:
+            self.cache.invalidate(changed)
+        stale = changed if reads is None else changed & reads
+        if (key is not None and not is_error(observation) and not stale
+                and (not changed or self.is_read_only(tool_name, kwargs))):
+            self.cache.put(key, reads, observation, list(produced), seconds)
+        return observation, produced, False
+
+    def is_read_only(self, tool_name, args):
+        if tool_name == "query_data" and args.get("new_df_name"):
+            return False
+        return tool_name in READ_ONLY_TOOLS
+
+    def dispatch_batch(self, calls):
+        """按顺序执行一组工具调用，返回每个调用的 (观察结果, 保存的结果)。
+
+        相邻的只读调用在线程池中并发执行；其他调用可能修改数据，作为屏障单独执行，
+        保证它们看到之前所有调用的结果、之后的调用看到它们的修改。
+        """
+        outcomes = [None] * len(calls)
+        i = 0
+        while i < len(calls):
+            j = i
+            while j < len(calls) and self.is_read_only(*calls[j]):
+                j += 1
+            if j - i > 1:
+                futures = {k: _tool_executor.submit(self._dispatch, *calls[k]) for k in range(i, j)}
+                for k, future in futures.items():
+                    outcomes[k] = future.result()
+                self.record_telemetry("parallel_tools", tools=[calls[k][0] for k in range(i, j)])
+            else:
+                j = max(j, i + 1)
+                outcomes[i] = self._dispatch(*calls[i])
+            i = j
+        return outcomes
 
     def run_python_code(self, code: str):
-        f = io.StringIO()
-        with redirect_stdout(f):
-            try:
-                exec_globals = { "dataframes": self.state["dataframes"], "pd": pd, "np": np }
-                exec_globals.update(self.state["dataframes"])
-                exec(code, exec_globals)
-            except Exception as e: return f"代码执行错误: [{type(e).__name__}] {e}"
-        return f"代码执行成功。\n输出:\n{f.getvalue()}"
-
-    def generate_plot(self, code: str):
-        plot_filename = f"{uuid.uuid4()}.png"
+        result = self._execute(code, "code")
+        if result["error"]: return f"代码执行错误: {result['error']}"
+        return f"代码执行成功。\n输出:\n{result['output']}"
+
+    def generate_plot(self, code: str, format: str = "png"):
+        if format not in plotting.PLOT_FORMATS: return f"错误: 不支持的图表格式 '{format}'，可用: {', '.join(plotting.PLOT_FORMATS)}"
+        plot_filename = f"{uuid.uuid4()}.{format}"
         save_path = os.path.join(self.plot_save_dir, plot_filename)
-        try:
-            exec_globals = {
-                "dataframes": self.state["dataframes"],
-                "plt": plt,
-                "pd": pd,
-                "np": np,
-                "save_path": save_path
-            }
-            exec_globals.update(self.state["dataframes"])
-            exec(code, exec_globals)
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
-            return f"绘图代码执行错误: [{type(e).__name__}] {e}"
+        with self.tracer.span("plot", "matplotlib", format=format) as span:
+            result = self._execute(code, "plot", save_path)
+            span["error"] = bool(result["error"])
+        if result["error"]:
+            return f"绘图代码执行错误: {result['error']}"
         if os.path.exists(save_path):
             self.state["plots"].append(save_path)
-            return f"图表已生成并保存于: {save_path}"
+            # 说明放在路径之前，前端和报告导出都从最后一个冒号之后取图表路径
+            notes = "".join(f"注意：{note}\n" for note in result.get("notes", []))
+            return f"{notes}图表已生成并保存于: {save_path}"
         else:
             return f"错误: 绘图代码已执行，但未在预期路径 '{save_path}' 找到图表文件。请确保代码中调用了 `plt.savefig(save_path)`。"
 
+    def generate_interactive_plot(self, df_name: str, kind: str, y, x: str = None, color: str = None,
+                                  title: str = None, max_points: int = None):
+        if df_name not in self.state["dataframes"]: return f"错误: 找不到DataFrame '{df_name}'"
+        start_time = time.perf_counter()
+        with self.tracer.span("plot", "plotly", chart=kind) as span:
+            try:
+                fig, stats = interactive_plots.build_chart(
+                    self.state["dataframes"][df_name], kind, x=x, y=y, color=color, title=title, max_points=max_points
+                )
+            except interactive_plots.ChartSpecError as e:
+                span["error"] = True
+                return f"错误: {e}"
+            spec = fig.to_json()
+            span.update(points_in=stats["points_in"], points_out=stats["points_out"], bytes=len(spec))
+        save_path = os.path.join(self.plot_save_dir, f"{uuid.uuid4()}.plotly.json")
+        with open(save_path, 'w', encoding='utf-8') as f:
+            f.write(spec)
+        self.state["plots"].append(save_path)
+        self.record_telemetry(
+            "interactive_plot", df_name=df_name, kind=kind, points_in=stats["points_in"],
+            points_out=stats["points_out"], bytes=len(spec), seconds=round(time.perf_counter() - start_time, 4)
+        )
+        notes = []
+        if kind in ("bar", "histogram"):
+            notes.append(f"原始数据 {stats['points_in']} 行，已在服务端汇总为 {stats['points_out']} 个值。")
+        elif stats["binned"]:
+            notes.append(f"散点数量 {stats['points_in']} 过多，已改为 {interactive_plots.SCATTER_BINS}×{interactive_plots.SCATTER_BINS} 的密度图。")
+        elif stats["points_out"] < stats["points_in"]:
+            notes.append(f"原始数据 {stats['points_in']} 个点，降采样后发送 {stats['points_out']} 个。")
+        if stats["truncated_categories"]:
+            notes.append(f"类别过多，只显示绝对值最大的 {interactive_plots.BAR_MAX_CATEGORIES} 个。")
+        # 与 generate_plot 一样，说明放在路径之前
+        return "".join(f"注意：{note}\n" for note in notes) + f"交互式图表已生成并保存于: {save_path}"
+
     def list_dataframes(self):
         if not self.state["dataframes"]: return "当前内存中没有DataFrame。"
         infos = []
-        for name, df in self.state["dataframes"].items():
-            buffer = io.StringIO()
-            df.info(buf=buffer)
-            infos.append(f"--- DataFrame: {name} ---\n{buffer.getvalue()}")
+        # 复制名称列表：并发执行的其他工具可能同时增删 DataFrame
+        for name in list(self.state["dataframes"]):
+            infos.append(f"--- DataFrame: {name} ---\n{self.profiles.get(name)['info']}")
         return "\n".join(infos)
 
     def describe_data(self, df_name: str):
@@ -114,10 +297,19 @@ class ToolManager:
         # --- 修改：为前端生成HTML表格 ---
         try:
             # describe() 的索引是统计量名称，所以 to_html 的 index 参数要为 True
-            desc_html = self.state['dataframes'][df_name].describe().to_html(classes='data-table data-table-stats', border=0, index=True)
+            describe = self.profiles.get(df_name)["describe"]
+            if describe is None:
+                return f"'{df_name}' 中没有可统计的列。"
+            note = ""
+            if describe.shape[1] > PREVIEW_MAX_COLUMNS:
+                # 列很多时只渲染前面的列，完整结果保存在服务端分页查看
+                self.results.put_table(describe)
+                note = f"<p>共 {describe.shape[1]} 列，此处只显示前 {PREVIEW_MAX_COLUMNS} 列。</p>"
+                describe = describe.iloc[:, :PREVIEW_MAX_COLUMNS]
+            desc_html = describe.to_html(classes='data-table data-table-stats', border=0, index=True)
             return (
                 f"<strong>'{df_name}' 的描述性统计：</strong>"
-                f"<div class='table-wrapper'>{desc_html}</div>"
+                f"<div class='table-wrapper'>{desc_html}</div>{note}"
             )
         except Exception as e:
             return f"为 '{df_name}' 生成描述性统计时出错: {e}"
@@ -126,52 +318,204 @@ class ToolManager:
     def join_dataframes(self, left_df_name: str, right_df_name: str, on: list, how: str, new_df_name: str):
         if left_df_name not in self.state["dataframes"]: return f"错误: 找不到左侧DataFrame '{left_df_name}'"
         if right_df_name not in self.state["dataframes"]: return f"错误: 找不到右侧DataFrame '{right_df_name}'"
+        if how not in ("inner", "outer", "left", "right"): return f"错误: 不支持的连接类型 '{how}'"
+        on = [on] if isinstance(on, str) else list(on)
         left_df = self.state["dataframes"][left_df_name]
         right_df = self.state["dataframes"][right_df_name]
+        missing = [c for c in on if c not in left_df.columns or c not in right_df.columns]
+        if missing: return f"错误: 连接键 {missing} 不同时存在于两个DataFrame中。"
         try:
-            merged_df = pd.merge(left_df, right_df, on=on, how=how)
-            self.state["dataframes"][new_df_name] = merged_df
-            return f"成功将 '{left_df_name}' 和 '{right_df_name}' 合并为 '{new_df_name}'。新DataFrame有 {len(merged_df)} 行。"
+            # 先用连接键的频数估算结果规模，避免多对多连接把内存耗尽
+            estimate = joins.estimate_join(left_df, right_df, on, how)
+            allowed, warnings = joins.check_join_budget(estimate, len(left_df), len(right_df))
+            telemetry = {
+                "left_rows": len(left_df), "right_rows": len(right_df), "how": how,
+                "estimated_rows": estimate["rows"], "estimated_bytes": estimate["bytes"],
+                "estimate_seconds": estimate["seconds"],
+            }
+            if not allowed:
+                self.record_telemetry("join", refused=True, **telemetry)
+                return f"错误: 已拒绝合并 '{left_df_name}' 和 '{right_df_name}'：{warnings[0]}。请检查连接键，或先去重/聚合后再合并。"
+            start_time = time.perf_counter()
+            # 有 Parquet 缓存文件的一侧直接流式扫描文件
+            merged_df, engine = joins.run_join(
+                left_df, right_df, on, how,
+                left_path=self.query_sources.parquet_path(left_df_name),
+                right_path=self.query_sources.parquet_path(right_df_name),
+                temp_dir=self.session_path,
+            )
+            self.set_dataframe(new_df_name, merged_df)
+            self.record_telemetry(
+                "join", refused=False, engine=engine, rows=len(merged_df),
+                seconds=round(time.perf_counter() - start_time, 4), **telemetry
+            )
+            message = f"成功将 '{left_df_name}' 和 '{right_df_name}' 合并为 '{new_df_name}'。新DataFrame有 {len(merged_df)} 行。"
+            if warnings:
+                message += "\n警告: " + "；".join(warnings) + "。"
+            return message
         except Exception as e:
             return f"合并DataFrame时出错: {e}"
 
-    def correlation_analysis(self, df_name: str):
+    def _query_plan(self, df_name, filters, columns, group_by, aggregations, sort_by):
+        dataset, source = self.query_sources.dataset(df_name)
+        plan, scan_columns, filter_expression = lazy_query.build_plan(
+            dataset, filters=filters, columns=columns, group_by=group_by, aggregations=aggregations, sort_by=sort_by
+        )
+        return dataset, source, plan, scan_columns, filter_expression
+
+    def query_data(self, df_name: str, filters: list = None, columns: list = None, group_by: list = None,
+                   aggregations: list = None, sort_by: list = None, limit: int = 100, new_df_name: str = None):
+        if df_name not in self.state["dataframes"]: return f"错误: 找不到DataFrame '{df_name}'"
+        limit = max(1, min(int(limit or 100), lazy_query.QUERY_MAX_ROWS))
+        try:
+            start_time = time.perf_counter()
+            _, source, plan, _, _ = self._query_plan(df_name, filters, columns, group_by, aggregations, sort_by)
+            table, truncated = lazy_query.run_plan(plan, limit)
+            result = table.to_pandas()
+        except lazy_query.QuerySpecError as e:
+            return f"错误: {e}"
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            return f"执行查询时出错: {e}"
+        elapsed = time.perf_counter() - start_time
+        self.record_telemetry("query", df_name=df_name, source=source, rows=len(result), seconds=round(elapsed, 4))
+
+        lines = [f"查询完成（数据来源: {source}，耗时 {elapsed:.2f} 秒），结果 {len(result)} 行{'（已达到 limit，结果被截断）' if truncated else ''}。"]
+        if new_df_name:
+            self.set_dataframe(new_df_name, result)
+            lines.append(f"结果已保存为 '{new_df_name}'。")
+        preview = result.head(lazy_query.QUERY_PREVIEW_ROWS)
+        if len(result) > len(preview):
+            handle = self.results.put_table(result)["handle"]
+            lines.append(f"以下只显示前 {len(preview)} 行（完整结果已保存，句柄 {handle}）：")
+        lines.append(preview.to_string(index=False))
+        return "\n".join(lines)
+
+    def explain_query(self, df_name: str, filters: list = None, columns: list = None, group_by: list = None,
+                      aggregations: list = None, sort_by: list = None):
+        if df_name not in self.state["dataframes"]: return f"错误: 找不到DataFrame '{df_name}'"
+        try:
+            dataset, source, plan, scan_columns, filter_expression = self._query_plan(
+                df_name, filters, columns, group_by, aggregations, sort_by
+            )
+        except lazy_query.QuerySpecError as e:
+            return f"错误: {e}"
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+            return f"构建执行计划时出错: {e}"
+        return f"数据来源: {source}\n" + lazy_query.explain(dataset, plan, scan_columns, filter_expression)
+
+    def run_sql(self, sql: str, max_rows: int = 200, explain: bool = False, new_df_name: str = None):
+        max_rows = max(1, min(int(max_rows or 200), sql_engine.SQL_MAX_ROWS))
+        try:
+            if explain:
+                plan, seconds = self.database.explain(sql)
+                self.record_telemetry("sql", engine=sql_engine.ENGINE, explain=True, seconds=round(seconds, 4))
+                return f"执行计划（{sql_engine.ENGINE}）:\n{plan}\n查询耗时: {seconds:.3f} 秒"
+            result = self.database.execute(sql, max_rows)
+        except sql_engine.SQL_ERRORS as e:
+            return f"SQL 执行错误: {e}"
+        self.record_telemetry(
+            "sql", engine=sql_engine.ENGINE, explain=False, rows=len(result["rows"]), seconds=round(result["seconds"], 4)
+        )
+        if not result["columns"]:
+            return f"SQL 执行成功（耗时 {result['seconds']:.3f} 秒），没有返回结果集。"
+        df = pd.DataFrame.from_records(result["rows"], columns=result["columns"])
+        lines = [f"查询完成（耗时 {result['seconds']:.3f} 秒），返回 {len(df)} 行{'（已达到 max_rows，结果被截断）' if result['truncated'] else ''}。"]
+        if new_df_name:
+            self.set_dataframe(new_df_name, df)
+            lines.append(f"结果已保存为 '{new_df_name}'。")
+        preview = df.head(sql_engine.SQL_PREVIEW_ROWS)
+        if len(df) > len(preview):
+            handle = self.results.put_table(df)["handle"]
+            lines.append(f"以下只显示前 {len(preview)} 行（完整结果已保存，句柄 {handle}）：")
+        lines.append(preview.to_string(index=False))
+        return "\n".join(lines)
+
+    def correlation_analysis(self, df_name: str, method: str = "pearson", top_k: int = 10, sample_rows: int = None):
         if df_name not in self.state["dataframes"]: return f"错误: 找不到DataFrame '{df_name}'"
-        df = self.state["dataframes"][df_name].select_dtypes(include=np.number)
-        if df.empty: return "错误: DataFrame中没有数值列可进行相关性分析。"
-        return f"'{df_name}' 的相关系数矩阵:\n{df.corr().to_string()}"
+        if method not in ("pearson", "spearman"): return f"错误: 不支持的相关系数类型 '{method}'"
+        df = self.state["dataframes"][df_name]
+        if df.select_dtypes(include=[np.number, 'bool']).columns.empty: return "错误: DataFrame中没有数值列可进行相关性分析。"
 
-    def handle_missing_values(self, df_name: str, method: str):
+        # 完整矩阵保存在结果存储中（不作为会话 DataFrame，避免出现在数据列表和提示词里），
+        # 同一版本、同一参数的重复调用直接复用
+        entry_name, cache_key = f"{df_name}:{method}", [self.state["versions"].get(df_name), method, sample_rows]
+        start_time = time.perf_counter()
+        with self._correlation_lock:
+            cached = self.state.setdefault("correlations", {}).get(entry_name)
+        if cached and cached["key"] == cache_key:
+            corr, counts, rows_used = cached["matrix"], cached["counts"], cached["rows"]
+        else:
+            # 计算在锁外进行，不阻塞其他并发的相关分析
+            corr, counts, rows_used = analytics.correlation_matrix(df, method=method, sample_rows=sample_rows)
+            cached = {"key": cache_key, "matrix": corr, "counts": counts, "rows": rows_used, "result": None}
+        with self._correlation_lock:
+            if cached["result"] is None or not self.results.available([cached["result"]]):
+                cached["result"] = self.results.put_table(corr.rename_axis("column"))
+            self.state["correlations"][entry_name] = cached
+            result_handle = cached["result"]["handle"]
+        elapsed = time.perf_counter() - start_time
+
+        pairs = analytics.top_correlated_pairs(corr, counts, max(1, int(top_k)))
+        sample_note = f"随机抽样 {rows_used} 行" if rows_used < len(df) else f"全部 {rows_used} 行"
+        lines = [f"'{df_name}' 的 {method} 相关分析（{len(corr.columns)} 个数值列，{sample_note}，耗时 {elapsed:.2f} 秒）。"]
+        if len(corr.columns) <= 8:
+            lines.append(corr.round(4).to_string())
+        lines.append(f"绝对值最大的 {len(pairs)} 对:")
+        lines.extend(f"- {a} ~ {b}: {r:.4f}（n={n}）" for a, b, r, n in pairs)
+        lines.append(f"完整相关系数矩阵已保存（句柄 {result_handle}）。")
+        return "\n".join(lines)
+
+    def handle_missing_values(self, df_name: str, method: str = None, strategies: dict = None):
         if df_name not in self.state["dataframes"]: return f"错误: 找不到DataFrame '{df_name}'"
+        method_map = {"fill_mean": "mean", "fill_median": "median", "fill_mode": "mode", "drop": "drop"}
+        if method is not None and method not in method_map: return f"错误: 未知的处理方法 '{method}'"
+        if method is None and not strategies: return "错误: 需要提供 method 或 strategies。"
         df = self.state["dataframes"][df_name]
-        original_rows = len(df)
-        if method == "fill_mean":
-            df.fillna(df.select_dtypes(include=np.number).mean(), inplace=True)
-            return f"已使用均值填充 '{df_name}' 的缺失值。"
-        elif method == "fill_median":
-            df.fillna(df.select_dtypes(include=np.number).median(), inplace=True)
-            return f"已使用中位数填充 '{df_name}' 的缺失值。"
-        elif method == "fill_mode":
-            for col in df.columns: df[col].fillna(df[col].mode()[0], inplace=True)
-            return f"已使用众数填充 '{df_name}' 中的缺失值。"
-        elif method == "drop":
-            df.dropna(inplace=True)
-            return f"已删除 '{df_name}' 中包含缺失值的 {original_rows - len(df)} 行。"
-        return f"错误: 未知的处理方法 '{method}'"
-
-    def train_linear_regression(self, df_name: str, target_column: str, feature_columns: list):
+        result, report, dropped_rows = analytics.impute_missing(df, method_map.get(method), strategies)
+        if not report:
+            return f"'{df_name}' 中没有需要处理的缺失值。"
+        if result is not df:
+            self.set_dataframe(df_name, result)
+
+        strategy_names = {"mean": "均值", "median": "中位数", "mode": "众数", "drop": "删除行", "value": "指定值"}
+        changed = dropped_rows > 0 or any(item["filled"] for item in report.values())
+        lines = [f"已处理 '{df_name}' 的缺失值：" if changed else f"'{df_name}' 的数据没有发生变化："]
+        for col, item in report.items():
+            if item["missing"] == 0:
+                lines.append(f"- {col}: {item.get('note') or '无缺失值'}")
+                continue
+            line = f"- {col}: 缺失 {item['missing']}，策略 {strategy_names.get(item['strategy'], item['strategy'])}"
+            if "dropped" in item:
+                line += f"，删除 {item['dropped']} 行"
+            elif item.get("note") is None:
+                line += f"，已填充 {item['filled']} 个（填充值 {item['value']}）" if item["filled"] else "，填充 0 个"
+            if item.get("note"):
+                line += f"（{item['note']}）"
+            lines.append(line)
+        if dropped_rows or any(item["strategy"] == "drop" for item in report.values()):
+            lines.append(f"共删除 {dropped_rows} 行，剩余 {len(result)} 行。")
+        return "\n".join(lines)
+
+    def train_linear_regression(self, df_name: str, target_column: str, feature_columns: list, weight_column: str = None, ridge_alpha: float = 0.0):
         if df_name not in self.state["dataframes"]: return f"错误: 找不到DataFrame '{df_name}'"
         df = self.state["dataframes"][df_name]
-        cols_to_check = [target_column] + feature_columns
-        non_numeric_cols = df[cols_to_check].select_dtypes(exclude=np.number).columns
+        cols_to_check = [target_column] + feature_columns + ([weight_column] if weight_column else [])
+        missing_cols = [c for c in cols_to_check if c not in df.columns]
+        if missing_cols: return f"错误: 找不到列 {missing_cols}。"
+        non_numeric_cols = df[cols_to_check].select_dtypes(exclude=[np.number, 'bool']).columns
         if not non_numeric_cols.empty: return f"错误: 列 {list(non_numeric_cols)} 不是数值类型。"
-        X = df[feature_columns].values
-        y = df[target_column].values
-        X = np.column_stack([np.ones(X.shape[0]), X])
         try:
-            coeffs = np.linalg.inv(X.T @ X) @ X.T @ y
-            return {"intercept": coeffs[0], "coefficients": dict(zip(feature_columns, coeffs[1:]))}
-        except np.linalg.LinAlgError: return "训练模型时出错：无法计算系数，可能存在共线性。"
+            result = analytics.linear_regression(
+                df, target_column, feature_columns,
+                weight_column=weight_column, ridge_alpha=float(ridge_alpha or 0.0)
+            )
+        except (ValueError, np.linalg.LinAlgError) as e:
+            return f"训练模型时出错：{e}"
+        self.record_telemetry(
+            "regression", df_name=df_name, rows=result["n_observations"],
+            features=len(feature_columns), seconds=result["runtime_seconds"]
+        )
+        return result
 
     def finish_task(self, summary: str):
         return {"summary": summary, "status": "finished"}
\ No newline at end of file